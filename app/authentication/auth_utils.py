@@ -1,9 +1,52 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import status, HTTPException
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.configuration.config import settings
+
+# Hashes with fewer rounds than 'bcrypt_rounds' are reported by needs_update and rehashed on login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__default_rounds=settings.bcrypt_rounds,
+                           bcrypt__min_rounds=settings.bcrypt_rounds)
+
+# bcrypt runs on its own bounded pool instead of the request threadpool. At most
+# 'password_hash_workers' hashes run at once and 'password_hash_queue_size' more may wait,
+# anything beyond that is rejected with 503 instead of queueing up without bound.
+_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(settings.password_hash_workers + settings.password_hash_queue_size)
+
+
+def _submit(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many concurrent password operations, try again later",
+                            headers={"Retry-After": "1"})
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+
+    future.add_done_callback(lambda _: _slots.release())
+    # Await the pool without holding the event loop or a request thread
+    return asyncio.wrap_future(future)
+
+
+async def hash(password: str):
+    return await _submit(pwd_context.hash, password)
+
+async def verify_password(plain_password, hashed_password):
+    return await _submit(pwd_context.verify, plain_password, hashed_password)
 
-def hash(password: str):
-    return pwd_context.hash(password)
+async def verify_and_update(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    '''
+    Verifies a password and rehashes it if the stored hash is outdated (e.g. fewer bcrypt rounds).
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+        Returns:
+            (valid, new_hash): new_hash is None unless the password is valid and needs a new hash
+    '''
+    return await _submit(pwd_context.verify_and_update, plain_password, hashed_password)
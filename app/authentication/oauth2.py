@@ -1,11 +1,15 @@
+import time
+from typing import Optional
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from fastapi import Depends, status, HTTPException
+from fastapi import Cookie, Depends, Query, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from app.configuration.config import settings
 from app.persistence import database, db_models
 from app.models import auth_models
+from app.utils.lru_cache import LRUCache
 
 # To get a hex 32 string for this run: `openssl rand -hex 32`
 SECRET_KEY = settings.secret_key
@@ -13,6 +17,14 @@ ALGORITHM = settings.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='login')
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl='login', auto_error=False)
+
+# Verified tokens, memoized until they expire so repeated requests skip the jwt decode/HMAC check
+token_cache = LRUCache(maxsize=settings.token_cache_size)
+
+# Users loaded by get_current_user, keyed by user id. Entries are dropped when the user is
+# updated or deleted through the ORM in this process, the TTL bounds staleness everywhere else.
+user_cache = LRUCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl_seconds)
 
 def create_access_token(data: dict):
     '''
@@ -44,38 +56,119 @@ def verify_access_token(token: str, credentials_exception):
             credentials_exception (HTTPException): The exception to be thrown in case of invalid token
 
         Returns:
-            token_data (TokenData): The data encoded in the token (user_id)
+            token_data (TokenData): The data encoded in the token (user_id, email)
     '''
+    token_data = token_cache.get(token)
+    if token_data is not None:
+        return token_data
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         id = payload.get("user_id")
-        
+
         if id is None:
             raise credentials_exception
-        token_data = auth_models.TokenData(id=id)
-        
+        token_data = auth_models.TokenData(id=id, email=payload.get("email"))
+
     except JWTError:
         raise credentials_exception
-    
+
+    # Remember the verified token until it expires
+    expiry_time = payload.get("exp")
+    if expiry_time is not None:
+        token_cache.set(token, token_data, ttl=expiry_time - time.time())
+
     return token_data
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
     '''
     Fetches the current logged in user after validating the JWT token.
 
+    With 'stateless_auth' enabled the user is built from the token claims and the database is
+    not queried. Otherwise the user comes from the user cache, or the database on a cache miss.
+
         Parameters:
             token (str): The token to be verified.
-    
+
         Returns:
-            user (User): The user object from the database
+            user (CurrentUser): The id and email of the logged in user
     '''
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
-    
+
     token = verify_access_token(token, credentials_exception)
+
+    # Tokens issued without the email claim still go through the user lookup
+    if settings.stateless_auth and token.email is not None:
+        return auth_models.CurrentUser(id=token.id, email=token.email)
+
+    user = user_cache.get(int(token.id))
+    if user is None:
+        user = await database.run(db, load_user, int(token.id))
+
+        # The user was deleted after the token was issued
+        if user is None:
+            raise credentials_exception
+
+        user_cache.set(user.id, user)
+
+    return user
+
+
+async def get_stream_user(token: Optional[str] = Depends(optional_oauth2_scheme),
+                          access_token: Optional[str] = Query(None),
+                          cookie_token: Optional[str] = Cookie(None, alias="access_token"),
+                          db: Session = Depends(database.get_db)):
+    '''
+    get_current_user for EventSource, which cannot send an Authorization header. The token may
+    also come as '?access_token=' or in the 'access_token' cookie. Prefer the cookie, access logs
+    and proxies record query strings.
+
+        Parameters:
+            token (str): The bearer token, if any
+            access_token (str): The token from the query string, if any
+            cookie_token (str): The token from the 'access_token' cookie, if any
+
+        Returns:
+            user (CurrentUser): The id and email of the logged in user
+    '''
+    token = token or access_token or cookie_token
+    if token is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return await get_current_user(token, db)
+
+
+async def get_token_user_id(token: Optional[str] = Depends(optional_oauth2_scheme)):
+    '''
+    Identifies the caller without requiring authentication.
+
+        Parameters:
+            token (str): The bearer token, if any
+
+        Returns:
+            user_id (int): The user id of a valid token, None for anonymous requests and invalid tokens
+    '''
+    if token is None:
+        return None
     
-    # SELECT * FROM users WHERE users.id == token.id
-    user = db.query(db_models.User).filter(db_models.User.id == token.id).first()
+    try:
+        return int(verify_access_token(token, HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)).id)
+    except HTTPException:
+        return None
+
+
+def load_user(db: Session, id: int):
+    # SELECT * FROM users WHERE users.id == id
+    db_user = db.query(db_models.User).filter(db_models.User.id == id).first()
+    if not db_user:
+        return None
     
-    return user
\ No newline at end of file
+    return auth_models.CurrentUser(id=db_user.id, email=db_user.email)
+
+
+@event.listens_for(db_models.User, "after_update")
+@event.listens_for(db_models.User, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    user_cache.delete(target.id)
@@ -1,3 +1,4 @@
+from typing import List
 from pydantic import BaseSettings
 
 # Environment variables
@@ -7,9 +8,94 @@ class Settings(BaseSettings):
     database_name: str
     database_password: str
     database_username: str
+    # Use asyncpg and AsyncSession for request sessions instead of psycopg2
+    database_async: bool = False
+    # Connection pool, requests waiting longer than db_pool_timeout seconds for a connection get a 503
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 5
+    db_pool_recycle: int = -1
+    db_pool_pre_ping: bool = False
+    db_statement_timeout_ms: int = 0
+    # Read replicas for the GET endpoints, e.g. DATABASE_REPLICA_URLS='["postgresql://user:pw@replica:5432/fastapi"]'
+    database_replica_urls: List[str] = []
+    replica_retry_seconds: float = 5
+    # After a write a user reads from the primary for 'read_your_writes_seconds', on every worker
+    # through a signed cookie (persistence/replicas.py)
+    read_your_writes_seconds: float = 5
     secret_key: str
     algorithm: str
     access_token_expire_minutes: int
+    # Authentication: trust the id/email claims of a valid token instead of loading the user per request
+    stateless_auth: bool = False
+    user_cache_size: int = 10000
+    user_cache_ttl_seconds: int = 60
+    token_cache_size: int = 10000
+    # Password hashing: bcrypt cost factor and the size of the dedicated bcrypt pool
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 4
+    password_hash_queue_size: int = 16
+    # Serialized GET /posts responses, dropped on every post/like write
+    response_cache_size: int = 1000
+    response_cache_ttl_seconds: float = 30
+    # Maximum number of items of POST /posts/batch and POST /like/batch
+    batch_max_size: int = 100
+    # Maximum 'limit' of the post feeds (GET /posts, GET /users/{id}/posts)
+    max_page_size: int = 100
+    # Rows fetched per round trip by GET /posts/export
+    export_batch_size: int = 1000
+    # Default length in characters of the 'excerpt' field of GET /posts?fields=
+    post_excerpt_length: int = 200
+    # Write-behind likes: POST /like/ answers 202 once the like is queued, a background task writes the
+    # queued likes 'like_flush_size' per transaction, at least every 'like_flush_interval_ms'.
+    # With 'like_queue_size' likes pending, POST /like/ answers 503. A like whose write failed
+    # 'like_flush_retries' times is dropped. Queueing checks that the post exists once per
+    # 'like_known_posts_ttl_seconds' for up to 'like_known_posts_size' posts, a post deleted meanwhile
+    # takes queued likes that long (the flush skips them).
+    like_write_behind: bool = False
+    like_queue_size: int = 10000
+    like_flush_size: int = 500
+    like_flush_interval_ms: float = 50
+    like_flush_retries: int = 5
+    like_known_posts_size: int = 10000
+    like_known_posts_ttl_seconds: float = 60
+    # GET /like/stream: at most 'like_stream_max_posts' posts per stream. A stream with 'like_stream_queue_size'
+    # undelivered changes is dropped, idle streams get a keepalive every 'like_stream_keepalive_seconds'
+    # and every stream ends after 'like_stream_max_seconds' (the client reconnects). The last
+    # 'like_stream_history' publishes are kept to replay to clients reconnecting with Last-Event-ID.
+    like_stream_max_posts: int = 100
+    like_stream_queue_size: int = 100
+    like_stream_keepalive_seconds: float = 15
+    like_stream_max_seconds: float = 300
+    like_stream_history: int = 10000
+    # GET /posts/trending: the top 'trending_size' posts by like score, where a like counts half after
+    # 'trending_half_life_hours' and not at all after 'trending_window_hours'. Every worker rebuilds its
+    # ranking from the likes table every 'trending_reconcile_seconds' (0 = never, for tests).
+    trending_size: int = 100
+    trending_half_life_hours: float = 6
+    trending_window_hours: float = 72
+    trending_reconcile_seconds: float = 60
+    # Monthly partitions of posts (persistence/partitions.py): every worker creates this month and the
+    # next 'posts_partitions_ahead_months' every 'posts_partitions_check_hours' (0 = never, for tests)
+    posts_partitions_ahead_months: int = 3
+    posts_partitions_check_hours: float = 24
+    # Token bucket rate limits per user (or client IP when not logged in): sustained rate and burst.
+    # A rate of 0 turns off limiting for that route group.
+    rate_limit_enabled: bool = True
+    rate_limit_max_keys: int = 100000
+    rate_limit_login_per_minute: float = 10
+    rate_limit_login_burst: int = 10
+    rate_limit_write_per_minute: float = 300
+    rate_limit_write_burst: int = 60
+    rate_limit_read_per_minute: float = 1200
+    rate_limit_read_burst: int = 200
+    # Reverse proxies (addresses or networks, e.g. '["10.0.0.0/8"]') whose X-Forwarded-For tells the client
+    # address. Without them, anonymous clients behind a proxy share the proxy's rate limit buckets.
+    trusted_proxies: List[str] = []
+    # Log SQL statements slower than this many milliseconds with their parameters and route (0 = off)
+    slow_query_ms: float = 0
+    # Also log their bound parameters, which include user data such as password hashes
+    slow_query_log_parameters: bool = False
     
     class Config:
         env_file = ".env"
@@ -1,31 +1,76 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from app.persistence import db_models
-from app.persistence.database import engine
-from app.routers import post_router, user_router, auth_router, like_router
+from fastapi.responses import JSONResponse
+from sqlalchemy import exc
+from app.persistence import database, partitions, replicas
+from app.configuration.config import settings
+from app.routers import post_router, user_router, auth_router, like_router, health_router, metrics_router
+from app.utils.metrics import MetricsMiddleware
+from app.utils.rate_limit import RateLimitMiddleware, rate_limit_backend
+from app.utils import trending
+from app.utils.like_queue import like_queue
 
-# This will create all tables in 'fastapi' postgres db at startup
-# Running first version of alembic will do the same 
-db_models.Base.metadata.create_all(bind=engine)
+# The schema is managed by alembic only ('alembic upgrade head' before starting the app)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Creating the engines opens no connection: a worker starts serving even while postgres
+    # is slow or down, and GET /health/ready tells when it can reach the database
+    database.init_engines()
+    tasks = []
+    if settings.trending_reconcile_seconds:
+        tasks.append(asyncio.create_task(trending.reconcile_periodically(settings.trending_reconcile_seconds)))
+    if settings.posts_partitions_check_hours:
+        tasks.append(asyncio.create_task(
+            partitions.create_partitions_periodically(settings.posts_partitions_check_hours * 3600)))
+    yield
+    for task in tasks:
+        task.cancel()
+    # Writes the queued likes before the engines go away
+    await like_queue.stop()
+    await replicas.replica_set.dispose()
+    await database.dispose_engines()
 
 # Initialize FastAPI app
 app = FastAPI()
+# FastAPI 0.89 has no lifespan argument yet, set it on the router like Starlette(lifespan=...) does
+app.router.lifespan_context = lifespan
 
 origins = ["*"]
 
+# Read-your-writes across workers (persistence/replicas.py), innermost so it only sees the app's responses
+app.add_middleware(replicas.ReadYourWritesMiddleware)
+
+# The middleware added last runs first: CORS wraps the rate limiter, so 429 responses carry CORS headers
+app.add_middleware(RateLimitMiddleware, backend=rate_limit_backend)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Retry-After"],
 )
 
+# Outermost, so the latency includes the rate limiter and CORS and 429s are counted too
+app.add_middleware(MetricsMiddleware)
+
 # URL Routers/ Controllers registration
 app.include_router(post_router.router)
 app.include_router(user_router.router)
 app.include_router(auth_router.router)
 app.include_router(like_router.router)
+app.include_router(health_router.router)
+app.include_router(metrics_router.router)
+
+# No database connection became free within 'db_pool_timeout', fail fast instead of hanging
+@app.exception_handler(exc.TimeoutError)
+async def pool_timeout_handler(request: Request, error: exc.TimeoutError):
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"},
+                        content={"detail": "Database connection pool exhausted, try again later"})
 
 @app.get("/")
 async def ping():
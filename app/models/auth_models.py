@@ -6,4 +6,9 @@ class Token(BaseModel):
     token_type: str
     
 class TokenData(BaseModel):
-    id: Optional[str] = None
\ No newline at end of file
+    id: Optional[str] = None
+    email: Optional[str] = None
+    
+class CurrentUser(BaseModel):
+    id: int
+    email: str
\ No newline at end of file
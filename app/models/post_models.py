@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, conint
 from datetime import datetime
+from app.persistence.db_models import MAX_ID
 from .user_models import UserResponse
 
 class Post(BaseModel):
@@ -19,10 +20,81 @@ class PostResponse(Post):
 class PostLikesResponse(BaseModel):
     Post: PostResponse
     likes: int
+    liked_by_me: bool = False
     
     class Config:
         orm_mode = True
     
+def post_json(row) -> dict:
+    '''
+    Builds the PostResponse JSON of a row selected with posts.query_post_likes,
+    without pydantic validation. Keys and their order must match PostResponse.
+
+        Parameters:
+            row (Row): posts columns and the owner_id/owner_email/owner_created columns
+
+        Returns:
+            dict: Ready for orjson, e.g. ORJSONResponse
+    '''
+    return {
+        "title": row.title,
+        "content": row.content,
+        "published": row.published,
+        "created": row.created,
+        "id": str(row.id),
+        "user_id": row.user_id,
+        "owner": {"id": str(row.owner_id), "email": row.owner_email, "created": row.owner_created},
+    }
+
+def post_likes_json(row) -> dict:
+    '''
+    Builds the PostLikesResponse JSON of a row selected with posts.query_post_likes,
+    see post_json.
+    '''
+    return {"Post": post_json(row), "likes": row.like_count, "liked_by_me": row.liked_by_me}
+
+def post_fields_json(row, fields) -> dict:
+    '''
+    Builds the PostLikesResponse JSON of a row selected with posts.query_post_fields, with only
+    the keys in 'fields' (plus 'excerpt' in 'Post' if asked for). Keys keep the order of
+    post_likes_json.
+    '''
+    post = {}
+    if "title" in fields:
+        post["title"] = row.title
+    if "content" in fields:
+        post["content"] = row.content
+    if "excerpt" in fields:
+        post["excerpt"] = row.excerpt
+    if "published" in fields:
+        post["published"] = row.published
+    if "created" in fields:
+        post["created"] = row.created
+    if "id" in fields:
+        post["id"] = str(row.id)
+    if "user_id" in fields:
+        post["user_id"] = row.user_id
+    if "owner" in fields:
+        post["owner"] = {"id": str(row.owner_id), "email": row.owner_email, "created": row.owner_created}
+
+    result = {"Post": post}
+    if "likes" in fields:
+        result["likes"] = row.like_count
+    if "liked_by_me" in fields:
+        result["liked_by_me"] = row.liked_by_me
+    return result
+
+def post_export_json(row) -> dict:
+    '''
+    Builds one line of GET /posts/export from a row selected with posts.select_posts_export,
+    see post_json.
+    '''
+    return {"Post": post_json(row), "likes": row.like_count}
+    
 class Like(BaseModel):
-    post_id: int
-    direction: int  # direction is 1 or 0 (like/unlike)
\ No newline at end of file
+    post_id: conint(le=MAX_ID)
+    direction: int  # direction is 1 or 0 (like/unlike)
+
+class LikeResult(Like):
+    status: int  # HTTP status the single item POST /like/ would have returned
+    detail: str
\ No newline at end of file
@@ -1,23 +1,192 @@
+from contextlib import asynccontextmanager
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 from ..configuration.config import settings
+from .pool import TimedAsyncAdaptedQueuePool, TimedQueuePool
 
 SQLALCHEMY_DATABASE_URL = f'postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}'
+ASYNC_SQLALCHEMY_DATABASE_URL = f'postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}'
+
+def engine_options(async_driver: bool = False) -> dict:
+    '''
+    Builds the create_engine/create_async_engine keyword arguments from the pool settings.
+
+        Parameters:
+            async_driver (bool): True for asyncpg, False for psycopg2
+
+        Returns:
+            dict: The engine keyword arguments
+    '''
+    connect_args = {}
+    if settings.db_statement_timeout_ms:
+        # Abort statements running longer than this on the server side
+        if async_driver:
+            connect_args = {"server_settings": {"statement_timeout": str(settings.db_statement_timeout_ms)}}
+        else:
+            connect_args = {"options": f"-c statement_timeout={settings.db_statement_timeout_ms}"}
+    
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if async_driver else TimedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "connect_args": connect_args,
+    }
+
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# The engines are created by init_engines in the app's lifespan (app.main), not at import, so
+# importing the app never touches the database. Sessions are bound to them there.
+engine = None
+async_engine = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# With 'database_async' enabled, requests get an AsyncSession on asyncpg instead of a psycopg2 Session.
+# Objects are not expired on commit, they are serialized after the session work is done.
+AsyncSessionLocal = sessionmaker(class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
+
+def init_engines():
+    '''
+    Creates the primary engine, and the asyncpg one with 'database_async', if not created yet.
+    No connection is opened until the first session needs one.
+    '''
+    global engine, async_engine
+    if engine is None:
+        engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options())
+        SessionLocal.configure(bind=engine)
+    if settings.database_async and async_engine is None:
+        async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options(async_driver=True))
+        AsyncSessionLocal.configure(bind=async_engine)
+
+
+async def dispose_engines():
+    '''
+    Closes the pooled connections of the engines created by init_engines.
+    '''
+    global engine, async_engine
+    if async_engine is not None:
+        await async_engine.dispose()
+        async_engine = None
+    if engine is not None:
+        await run_in_threadpool(engine.dispose)
+        engine = None
+
+
+def request_pool():
+    '''
+    Returns the connection pool that get_db sessions draw from.
+    '''
+    if settings.database_async:
+        return async_engine.sync_engine.pool
+    return engine.pool
+
+
+@asynccontextmanager
+async def open_session():
+    '''
+    A session on the primary for work outside of requests, closed when the block exits.
+    '''
+    if settings.database_async:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
+
+
+async def release(db):
+    '''
+    Ends the session's transaction and returns its connection to the pool, for requests that go on
+    for long without the database (streams). The session checks out a connection again if used.
+
+        Parameters:
+            db (Session | AsyncSession): The session from get_db
+    '''
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        await run_in_threadpool(db.close)
+
+
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with open_session() as db:
         yield db
+
+
+async def run(db, fn, *args, **kwargs):
+    '''
+    Runs session work written against the sync Session API without blocking the event loop.
+
+        Parameters:
+            db (Session | AsyncSession): The session from get_db
+            fn: A function called as fn(session, *args, **kwargs)
+
+        Returns:
+            The return value of fn
+    '''
+    # AsyncSession: fn runs on the event loop and every query awaits asyncpg under the hood
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    
+    # Session: fn runs on the threadpool with blocking psycopg2 calls, and the session is closed in
+    # the same call. No request holds a pooled connection while it waits for a thread, otherwise
+    # with more concurrent requests than threads, every thread could end up waiting for a
+    # connection held by a request that waits for a thread.
+    return await run_in_threadpool(_run_and_close, db, fn, *args, **kwargs)
+
+
+def _run_and_close(db, fn, *args, **kwargs):
+    try:
+        return fn(db, *args, **kwargs)
     finally:
+        # Rolls back what fn did not commit and returns the connection to the pool. Objects fn
+        # returns stay readable (detached), the session checks out a connection again if used.
         db.close()
+
+
+
+async def stream(db, statement, batch_size: int):
+    '''
+    Runs a SELECT through a server-side cursor and yields its rows in batches, so only
+    'batch_size' rows are in memory at a time however many the statement returns.
+
+        Parameters:
+            db (Session | AsyncSession): The session from get_db
+            statement (Select): The statement to run
+            batch_size (int): Rows fetched per round trip
+
+        Yields:
+            List[Row]: The next batch of rows
+    '''
+    if isinstance(db, AsyncSession):
+        # asyncpg: a cursor inside the session's transaction
+        result = await db.stream(statement)
+        try:
+            async for rows in result.partitions(batch_size):
+                yield rows
+        finally:
+            await result.close()
+        return
+
+    # psycopg2: stream_results makes it a named cursor, fetchmany sends FETCH FORWARD batch_size
+    result = await run_in_threadpool(db.execute, statement.execution_options(stream_results=True))
+    try:
+        while rows := await run_in_threadpool(result.fetchmany, batch_size):
+            yield rows
+    finally:
+        await run_in_threadpool(result.close)
         
         
 # code to connect to db manually without ORM sqlalchemy
@@ -1,20 +1,63 @@
 from .database import Base
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from . import partitions
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, Computed, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.expression import text
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
+
+# Text search configuration of posts.search_vector, queries must use the same one
+SEARCH_CONFIG = 'english'
+
+# The largest id of the Integer (int4) id columns. Ids from clients are bounded by it: asyncpg
+# refuses to bind a larger one (500) where psycopg2 just finds no row (404).
+MAX_ID = 2**31 - 1
+
+# posts is partitioned by month of 'created' and likes by hash of 'post_id', the partitions are
+# created by partitions.py. A primary key of a partitioned table must contain the partition key, so
+# posts.id alone is not unique to postgres and cannot be referenced. post_ids (PostId), kept by a
+# trigger on posts, makes it unique and is what likes.post_id references (see partitions.py).
 
 class Post(Base):
     __tablename__ = "posts"
     
-    id = Column(Integer, primary_key=True, nullable=False)
+    # The ids still come from one sequence, post_ids keeps them unique
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     title = Column(String, nullable=False)
     content = Column(String, nullable=False)
     published = Column(Boolean, server_default='TRUE', nullable=False)
-    created = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    created = Column(TIMESTAMP(timezone=True), primary_key=True, nullable=False, server_default=text('now()'))
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    owner = relationship("User")
+    # Denormalized COUNT(likes) for this post, kept in step by like_router in the same transaction
+    like_count = Column(Integer, nullable=False, server_default='0')
+    # Full text search document of the title (weight A) and content (weight B), kept up to date by postgres
+    # on every write. Deferred, it is only used in WHERE/ORDER BY and never loaded into the ORM objects.
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') || setweight(to_tsvector('{SEARCH_CONFIG}', content), 'B')",
+        persisted=True)))
+    # Every post response nests its owner, load it in the same SELECT (users JOIN) instead of one
+    # lazy SELECT per post. user_id is NOT NULL, so an inner join is safe.
+    owner = relationship("User", lazy="joined", innerjoin=True)
     
+    __table_args__ = (
+        # Serves the feed ordering and keyset pagination on (created, id)
+        Index("ix_posts_created_id", "created", "id"),
+        # Serves full text search (search_vector @@ tsquery)
+        Index("ix_posts_search_vector", "search_vector", postgresql_using="gin"),
+        # Serves the posts of a user newest first (GET /users/{id}/posts), and the ON DELETE CASCADE from users
+        Index("ix_posts_user_id_created_id", "user_id", "created", "id"),
+        {"postgresql_partition_by": "RANGE (created)"},
+    )
+    # The ORM knows posts by id, as before the partitioning
+    __mapper_args__ = {"primary_key": [id]}
+    
+class PostId(Base):
+    # Written by the posts_post_ids trigger only (partitions.POST_IDS_TRIGGERS)
+    __tablename__ = "post_ids"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    # Of the post, the partition a lookup by id reads (posts.by_id)
+    created = Column(TIMESTAMP(timezone=True), nullable=False)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, nullable=False)
@@ -25,4 +68,20 @@ class User(Base):
 class Like(Base):
     __tablename__ = "likes"
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
-    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
\ No newline at end of file
+    # Deleted with the post through post_ids
+    post_id = Column(Integer, ForeignKey("post_ids.id", ondelete="CASCADE"), primary_key=True)
+    created = Column(TIMESTAMP(timezone=True), nullable=False, server_default=text('now()'))
+    
+    __table_args__ = (
+        # The primary key (user_id, post_id) only serves lookups by user. This one serves the
+        # likes of a post and the ON DELETE CASCADE from post_ids.
+        Index("ix_likes_post_id_user_id", "post_id", "user_id"),
+        # Index only scan of the recent likes for the trending ranking (utils/trending.py)
+        Index("ix_likes_created", "created", postgresql_include=["post_id"]),
+        # Everything about one post is in one partition
+        {"postgresql_partition_by": "HASH (post_id)"},
+    )
+
+# Partitions and the post_ids triggers for metadata.create_all, the migrations create them themselves
+event.listen(Post.__table__, "after_create", partitions.after_create_posts)
+event.listen(Like.__table__, "after_create", partitions.after_create_likes)
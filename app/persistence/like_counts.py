@@ -0,0 +1,81 @@
+'''
+Consistency check and repair for the denormalized posts.like_count column.
+
+like_router keeps posts.like_count in step with the likes table, but rows removed
+outside the API (e.g. ON DELETE CASCADE when a user is deleted, manual SQL) are
+not counted. Run this to find and fix drift:
+
+    python -m app.persistence.like_counts            # report only
+    python -m app.persistence.like_counts --repair   # fix the drifted rows
+'''
+import argparse
+from typing import List, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from . import db_models
+
+
+def _actual_count():
+    # SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id
+    return select(func.count(db_models.Like.post_id))\
+        .where(db_models.Like.post_id == db_models.Post.id).scalar_subquery()
+
+
+def check_like_counts(db: Session) -> List[Tuple[int, int, int]]:
+    '''
+    Finds posts whose like_count does not match the likes table.
+
+        Parameters:
+            db (Session): The database session
+
+        Returns:
+            List[(post_id, like_count, actual)]: The drifted posts
+    '''
+    actual = _actual_count()
+    rows = db.query(db_models.Post.id, db_models.Post.like_count, actual)\
+             .filter(db_models.Post.like_count != actual).order_by(db_models.Post.id).all()
+    return [tuple(row) for row in rows]
+
+
+def repair_like_counts(db: Session) -> int:
+    '''
+    Recomputes like_count for every drifted post from the likes table.
+
+        Parameters:
+            db (Session): The database session
+
+        Returns:
+            repaired (int): The number of posts that were fixed
+    '''
+    actual = _actual_count()
+    result = db.execute(update(db_models.Post).where(db_models.Post.like_count != actual)
+                        .values(like_count=actual).execution_options(synchronize_session=False))
+    db.commit()
+    return result.rowcount
+
+
+def main():
+    from .database import SessionLocal, init_engines
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repair", action="store_true", help="fix the drifted like counts")
+    args = parser.parse_args()
+
+    init_engines()
+    db = SessionLocal()
+    try:
+        drifted = check_like_counts(db)
+        for post_id, like_count, actual in drifted:
+            print(f"post {post_id}: like_count={like_count} actual={actual}")
+        print(f"{len(drifted)} post(s) with inconsistent like_count")
+
+        if args.repair and drifted:
+            print(f"repaired {repair_like_counts(db)} post(s)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Float, Integer, and_, cast, column, delete, func, literal, select, tuple_, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from . import db_models
+from .posts import by_id
+
+# Single statement like/unlike.
+# The change on the likes table and the posts.like_count update run as one
+# data-modifying CTE, so each request costs one round trip and a concurrent
+# duplicate like resolves to 'nothing inserted' instead of a primary key error.
+
+def add_like(db: Session, post_id: int, user_id: int) -> Optional[datetime]:
+    '''
+    Likes a post on behalf of a user.
+
+        WITH new_like AS (INSERT INTO likes (user_id, post_id)
+                          SELECT user_id, posts.id FROM posts WHERE posts.id = post_id FOR KEY SHARE
+                          ON CONFLICT DO NOTHING RETURNING likes.post_id, likes.created)
+        UPDATE posts SET like_count = posts.like_count + 1 FROM new_like
+        WHERE posts.id = new_like.post_id RETURNING posts.id, new_like.created
+
+    (with 'posts.created = ...' from post_ids next to every 'posts.id = post_id', see posts.by_id)
+
+        Parameters:
+            post_id (int): The post to be liked
+            user_id (int): The user liking the post
+
+        Returns:
+            The time of the new like, None if the user already liked the post or the post
+            does not exist (see existing_posts)
+    '''
+    row = db.execute(add_like_statement(post_id, user_id)).first()
+    return row.created if row is not None else None
+
+
+def add_like_statement(post_id: int, user_id: int):
+    # The like is only inserted if the post exists, instead of failing the foreign key to post_ids.
+    # FOR KEY SHARE keeps the post from being deleted until the like commits, concurrent likes of
+    # the post still insert side by side and only queue up on the like_count update.
+    post = select(literal(user_id), db_models.Post.id).where(by_id(post_id))\
+        .with_for_update(read=True, key_share=True)
+    new_like = insert(db_models.Like).from_select(["user_id", "post_id"], post)\
+        .on_conflict_do_nothing().returning(db_models.Like.post_id, db_models.Like.created).cte("new_like")
+
+    return update(db_models.Post).where(by_id(post_id), db_models.Post.id == new_like.c.post_id)\
+        .values(like_count=db_models.Post.like_count + 1).returning(db_models.Post.id, new_like.c.created)\
+        .execution_options(synchronize_session=False)
+
+
+def remove_like(db: Session, post_id: int, user_id: int) -> Optional[datetime]:
+    '''
+    Removes a user's like from a post.
+
+        WITH old_like AS (DELETE FROM likes WHERE likes.post_id = post_id AND likes.user_id = user_id
+                          RETURNING likes.post_id, likes.created)
+        UPDATE posts SET like_count = posts.like_count - 1 FROM old_like
+        WHERE posts.id = old_like.post_id RETURNING posts.id, old_like.created
+
+        Parameters:
+            post_id (int): The post to be unliked
+            user_id (int): The user removing the like
+
+        Returns:
+            The time the removed like was made, None if the post was not liked by the user (or does not exist)
+    '''
+    row = db.execute(remove_like_statement(post_id, user_id)).first()
+    return row.created if row is not None else None
+
+
+def remove_like_statement(post_id: int, user_id: int):
+    old_like = delete(db_models.Like)\
+        .where(db_models.Like.post_id == post_id, db_models.Like.user_id == user_id)\
+        .returning(db_models.Like.post_id, db_models.Like.created).cte("old_like")
+
+    return update(db_models.Post).where(by_id(post_id), db_models.Post.id == old_like.c.post_id)\
+        .values(like_count=db_models.Post.like_count - 1).returning(db_models.Post.id, old_like.c.created)\
+        .execution_options(synchronize_session=False)
+
+
+# Batch like/unlike (like_router.like_batch).
+# The posts rows are locked in id order first, so concurrent batches touching the same posts
+# queue up instead of deadlocking on the like_count updates.
+
+def lock_posts(post_ids: Iterable[int]):
+    # SELECT posts.id FROM posts WHERE posts.id IN post_ids ORDER BY posts.id FOR NO KEY UPDATE
+    return select(db_models.Post.id).where(db_models.Post.id.in_(list(post_ids)))\
+        .order_by(db_models.Post.id).with_for_update(key_share=True)
+
+
+def add_likes(db: Session, post_ids: Iterable[int], user_id: int) -> Dict[int, datetime]:
+    '''
+    Likes several posts on behalf of a user in one statement.
+
+        WITH new_likes AS (INSERT INTO likes (user_id, post_id)
+                           SELECT user_id, posts.id FROM posts WHERE posts.id IN post_ids
+                           ORDER BY posts.id FOR NO KEY UPDATE
+                           ON CONFLICT DO NOTHING RETURNING likes.post_id, likes.created)
+        UPDATE posts SET like_count = posts.like_count + 1 FROM new_likes
+        WHERE posts.id = new_likes.post_id RETURNING posts.id, new_likes.created
+
+        Parameters:
+            post_ids (Iterable[int]): The posts to be liked
+            user_id (int): The user liking the posts
+
+        Returns:
+            Dict[int, datetime]: The ids of the posts that were liked and the time of the like.
+                                 The others were already liked by the user or do not exist (see existing_posts)
+    '''
+    locked = lock_posts(post_ids).subquery()
+    new_likes = insert(db_models.Like)\
+        .from_select(["user_id", "post_id"], select(literal(user_id), locked.c.id))\
+        .on_conflict_do_nothing().returning(db_models.Like.post_id, db_models.Like.created).cte("new_likes")
+
+    statement = update(db_models.Post).where(db_models.Post.id == new_likes.c.post_id)\
+        .values(like_count=db_models.Post.like_count + 1).returning(db_models.Post.id, new_likes.c.created)\
+        .execution_options(synchronize_session=False)
+
+    return dict(db.execute(statement).all())
+
+
+def remove_likes(db: Session, post_ids: Iterable[int], user_id: int) -> Dict[int, datetime]:
+    '''
+    Removes a user's likes from several posts in one statement.
+
+        WITH locked AS (SELECT posts.id FROM posts WHERE posts.id IN post_ids
+                        ORDER BY posts.id FOR NO KEY UPDATE),
+             old_likes AS (DELETE FROM likes WHERE likes.user_id = user_id
+                           AND likes.post_id IN (SELECT id FROM locked) RETURNING likes.post_id, likes.created)
+        UPDATE posts SET like_count = posts.like_count - 1 FROM old_likes
+        WHERE posts.id = old_likes.post_id RETURNING posts.id, old_likes.created
+
+        Parameters:
+            post_ids (Iterable[int]): The posts to be unliked
+            user_id (int): The user removing the likes
+
+        Returns:
+            Dict[int, datetime]: The ids of the posts whose like was removed and the time the like
+                                 was made. The others were not liked by the user (or do not exist)
+    '''
+    locked = lock_posts(post_ids).cte("locked")
+    old_likes = delete(db_models.Like)\
+        .where(db_models.Like.user_id == user_id, db_models.Like.post_id.in_(select(locked.c.id)))\
+        .returning(db_models.Like.post_id, db_models.Like.created).cte("old_likes")
+
+    statement = update(db_models.Post).where(db_models.Post.id == old_likes.c.post_id)\
+        .values(like_count=db_models.Post.like_count - 1).returning(db_models.Post.id, old_likes.c.created)\
+        .execution_options(synchronize_session=False)
+
+    return dict(db.execute(statement).all())
+
+
+def write_likes(db: Session, changes: Dict[Tuple[int, int], int]) \
+        -> Tuple[List[Tuple[int, datetime]], List[Tuple[int, datetime]]]:
+    '''
+    Writes the likes and unlikes of many users (utils/like_queue.py) in four statements,
+    whatever their number. Each post's like_count is updated once.
+
+        SELECT posts.id FROM posts WHERE posts.id IN post_ids ORDER BY posts.id FOR NO KEY UPDATE
+        INSERT INTO likes (user_id, post_id) VALUES (...), ... ON CONFLICT DO NOTHING
+        RETURNING likes.post_id, likes.created
+        DELETE FROM likes WHERE (likes.user_id, likes.post_id) IN (...) RETURNING likes.post_id, likes.created
+        UPDATE posts SET like_count = posts.like_count + deltas.delta
+        FROM (VALUES (post_id, delta), ...) AS deltas WHERE posts.id = deltas.post_id
+
+        Parameters:
+            changes (Dict[(user_id, post_id), direction]): 1 to like, 0 to unlike
+
+        Returns:
+            (added, removed): (post_id, created) of the likes inserted and of the likes deleted. Likes
+                              that already existed, unlikes of likes that did not and changes on
+                              posts that no longer exist are left out
+    '''
+    existing = set(db.execute(lock_posts({post_id for _, post_id in changes})).scalars())
+    to_add = [{"user_id": user_id, "post_id": post_id} for (user_id, post_id), direction in changes.items()
+              if direction and post_id in existing]
+    to_remove = [(user_id, post_id) for (user_id, post_id), direction in changes.items()
+                 if not direction and post_id in existing]
+
+    added = db.execute(insert(db_models.Like).values(to_add).on_conflict_do_nothing()
+                       .returning(db_models.Like.post_id, db_models.Like.created)).all() if to_add else []
+    removed = db.execute(delete(db_models.Like)
+                         .where(tuple_(db_models.Like.user_id, db_models.Like.post_id).in_(to_remove))
+                         .returning(db_models.Like.post_id, db_models.Like.created)
+                         .execution_options(synchronize_session=False)).all() if to_remove else []
+
+    deltas = {}
+    for post_id, _ in added:
+        deltas[post_id] = deltas.get(post_id, 0) + 1
+    for post_id, _ in removed:
+        deltas[post_id] = deltas.get(post_id, 0) - 1
+    deltas = {post_id: delta for post_id, delta in deltas.items() if delta}
+    if deltas:
+        rows = values(column("post_id", Integer), column("delta", Integer), name="deltas").data(list(deltas.items()))
+        db.execute(update(db_models.Post).where(db_models.Post.id == rows.c.post_id)
+                   .values(like_count=db_models.Post.like_count + rows.c.delta)
+                   .execution_options(synchronize_session=False))
+
+    return [tuple(row) for row in added], [tuple(row) for row in removed]
+
+
+def existing_posts(db: Session, post_ids: Iterable[int]) -> Set[int]:
+    # SELECT post_ids.id FROM post_ids WHERE post_ids.id IN post_ids, one index instead of one per month
+    return set(db.execute(select(db_models.PostId.id).where(db_models.PostId.id.in_(list(post_ids)))).scalars())
+
+
+def liked_posts(db: Session, user_id: int, post_ids: Iterable[int]) -> Set[int]:
+    # SELECT likes.post_id FROM likes WHERE likes.user_id = user_id AND likes.post_id IN post_ids
+    # One primary key probe per post, in the hash partitions of 'post_ids' only
+    return set(db.execute(select(db_models.Like.post_id).where(db_models.Like.user_id == user_id,
+                                                              db_models.Like.post_id.in_(list(post_ids)))).scalars())
+
+
+def like_counts(db: Session, post_ids: Iterable[int]) -> Dict[int, int]:
+    # SELECT posts.id, posts.like_count FROM post_ids JOIN posts ON posts.id = post_ids.id
+    # AND posts.created = post_ids.created WHERE post_ids.id IN post_ids
+    # posts.id alone probes the index of every month (see posts.by_id). Joined on 'created' each post
+    # is a nested loop probe into its own month, the others are pruned at run time.
+    same_post = and_(db_models.Post.id == db_models.PostId.id, db_models.Post.created == db_models.PostId.created)
+    return dict(db.execute(select(db_models.Post.id, db_models.Post.like_count)
+                           .select_from(db_models.PostId).join(db_models.Post, same_post)
+                           .where(db_models.PostId.id.in_(list(post_ids)))).all())
+
+
+def decayed_like_scores(db: Session, t0: float, half_life_seconds: float) -> Dict[int, float]:
+    '''
+    The time-decayed like score of every post liked since 't0' (see utils/trending.py).
+
+        SELECT likes.post_id, sum(power(2, (extract(epoch FROM likes.created) - t0) / half_life))
+        FROM likes WHERE likes.created >= to_timestamp(t0) GROUP BY likes.post_id
+
+        Parameters:
+            t0 (float): Start of the window, unix time
+            half_life_seconds (float): The time after which a like counts half
+
+        Returns:
+            Dict[int, float]: post id -> score
+    '''
+    return dict(db.execute(decayed_like_scores_statement(t0, half_life_seconds)).all())
+
+
+def decayed_like_scores_statement(t0: float, half_life_seconds: float):
+    # Index only scan of ix_likes_created (created INCLUDE post_id)
+    age = cast(func.extract("epoch", db_models.Like.created), Float) - t0
+    return select(db_models.Like.post_id, func.sum(func.power(2.0, age / half_life_seconds)))\
+        .where(db_models.Like.created >= func.to_timestamp(t0)).group_by(db_models.Like.post_id)
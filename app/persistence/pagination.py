@@ -0,0 +1,49 @@
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+from .db_models import MAX_ID
+
+# Keyset (cursor) pagination helpers for the posts feed.
+# The cursor is the (created, id) pair of the last row on a page, encoded as an
+# opaque url-safe string so clients never depend on its contents.
+
+def encode_cursor(created: datetime, id: int) -> str:
+    '''
+    Encodes the position of a post in the feed into an opaque cursor.
+
+        Parameters:
+            created (datetime): The creation time of the last post on the page
+            id (int): The id of the last post on the page
+
+        Returns:
+            cursor (str): url-safe cursor to be passed back as '?cursor='
+    '''
+    raw = json.dumps([created.isoformat(), id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    '''
+    Decodes a cursor created by encode_cursor.
+
+        Parameters:
+            cursor (str): The cursor received from the client
+
+        Returns:
+            (created, id): The position in the feed to continue after
+
+        Raises:
+            ValueError: If the cursor is malformed
+    '''
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created, id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created, id = datetime.fromisoformat(created), int(id)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"Invalid cursor {cursor!r}") from error
+    # posts.id is int4
+    if not -MAX_ID - 1 <= id <= MAX_ID:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return created, id
@@ -0,0 +1,226 @@
+'''
+Partitions of the posts and likes tables (see db_models).
+
+posts is partitioned by range of 'created', one partition per calendar month (UTC) named
+posts_yYYYYmMM, plus posts_history for everything before the first month. Old months can then be
+vacuumed, reindexed or detached one at a time, and feed queries bounded by 'created' only touch
+the months they ask for. likes is partitioned by hash of 'post_id' into LIKES_PARTITIONS
+partitions, so everything about the likes of one post (listing, like/unlike, deleting them with
+the post) happens in one of them.
+
+The primary key of posts is (id, created), so postgres alone does not keep ids unique. post_ids
+holds one (id, created) row per post, kept by the triggers of POST_IDS_TRIGGERS: its primary key
+makes ids unique, likes.post_id references it ON DELETE CASCADE (deleting a post, or the user
+owning it, deletes its likes), and a lookup by id reads 'created' from it so only the post's
+month is read (posts.by_id).
+
+Posts newer than the last month go to posts_future (up to MAXVALUE) instead of failing, and move
+into their month's partition when it is created. It is a range partition and not a DEFAULT one:
+with a DEFAULT partition postgres cannot read the months one after the other for the newest-first
+feed (ordered append), it merges the newest rows of every month instead. Months are still created
+ahead of time, so posts_future stays empty: every worker's lifespan creates the next
+'posts_partitions_ahead_months' months every 'posts_partitions_check_hours', or from cron:
+
+    python -m app.persistence.partitions              # create the missing months
+    python -m app.persistence.partitions --list       # and list all partitions
+'''
+import argparse
+import asyncio
+import logging
+from datetime import date, datetime, timezone
+from typing import List
+
+from sqlalchemy import text
+
+from app.configuration.config import settings
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Fixed when the table is created, changing it means rewriting likes
+LIKES_PARTITIONS = 16
+
+# posts.id cannot change. A post whose 'created' changes to another month is deleted from its
+# partition and inserted into the other one, its post_ids row is updated first so the delete does
+# not cascade to its likes. While create_post_partitions moves posts out of posts_future
+# ('app.moving_posts' set) their post_ids rows and likes stay too.
+POST_IDS_TRIGGERS = (
+    '''
+    CREATE OR REPLACE FUNCTION posts_post_ids() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            IF OLD.id <> NEW.id THEN
+                RAISE EXCEPTION 'posts.id cannot change';
+            END IF;
+            UPDATE post_ids SET created = NEW.created WHERE id = NEW.id;
+            RETURN NEW;
+        ELSIF current_setting('app.moving_posts', true) = 'on' THEN
+            RETURN NULL;
+        ELSIF TG_OP = 'INSERT' THEN
+            -- Already there when an update of created moves the post to another month
+            INSERT INTO post_ids (id, created) SELECT NEW.id, NEW.created
+            WHERE NOT EXISTS (SELECT FROM post_ids WHERE id = NEW.id AND created = NEW.created);
+        ELSE
+            DELETE FROM post_ids WHERE id = OLD.id AND created = OLD.created;
+        END IF;
+        RETURN NULL;
+    END $$
+    ''',
+    "CREATE TRIGGER posts_post_ids AFTER INSERT OR DELETE ON posts FOR EACH ROW EXECUTE FUNCTION posts_post_ids()",
+    "CREATE TRIGGER posts_post_ids_update BEFORE UPDATE OF id, created ON posts FOR EACH ROW "
+    "WHEN (OLD.id <> NEW.id OR OLD.created <> NEW.created) EXECUTE FUNCTION posts_post_ids()",
+)
+
+# Copied when posts move out of posts_future, search_vector is generated by the insert
+POSTS_COPY_COLUMNS = "id, title, content, published, created, user_id, like_count"
+
+
+def month_start(day: date, months: int = 0) -> date:
+    # The first day of the month 'months' months after the month of 'day'
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def post_partition_name(month: date) -> str:
+    return f"posts_y{month.year}m{month.month:02d}"
+
+
+def create_post_partitions(db, first: date, last: date) -> List[str]:
+    '''
+    Creates the monthly partitions of posts from the month of 'first' through the month of 'last'
+    that do not exist yet. Safe to run from several workers at once. Months before the first one
+    are in posts_history and cannot be created.
+
+    Months follow each other without gaps, so the first month in posts_future and every month up
+    to 'last' are created together. Their posts move out of posts_future, which then starts after
+    them:
+
+        ALTER TABLE posts DETACH PARTITION posts_future
+        CREATE TABLE posts_y2026m10 PARTITION OF posts
+        FOR VALUES FROM ('2026-10-01 00:00:00+00') TO ('2026-11-01 00:00:00+00')
+        INSERT INTO posts SELECT ... FROM posts_future WHERE created < '2026-11-01 00:00:00+00'
+        DELETE FROM posts_future WHERE created < '2026-11-01 00:00:00+00'
+        ALTER TABLE posts ATTACH PARTITION posts_future FOR VALUES FROM ('2026-11-01 00:00:00+00') TO (MAXVALUE)
+
+        Parameters:
+            db (Session | Connection): Where to run the DDL, the caller commits
+
+        Returns:
+            List[str]: The names of the created partitions
+    '''
+    # Serializes concurrent runs until the caller commits, the second one then sees the partitions
+    db.execute(text("SELECT pg_advisory_xact_lock(hashtext('posts partitions'))"))
+    existing = set(db.execute(text("SELECT inhrelid::regclass::text FROM pg_inherits "
+                                   "WHERE inhparent = 'posts'::regclass")).scalars())
+    future = _future_start(db)
+    created = []
+    month, end = month_start(first), month_start(last, 1)
+    while month < min(end, future):
+        if post_partition_name(month) not in existing:
+            created.append(_create_post_partition(db, month))
+        month = month_start(month, 1)
+
+    if end > future:
+        # Partition bounds are constants, not bind parameters
+        upper = f"'{end} 00:00:00+00'"
+        db.execute(text("ALTER TABLE posts DETACH PARTITION posts_future"))
+        month = future
+        while month < end:
+            created.append(_create_post_partition(db, month))
+            month = month_start(month, 1)
+        db.execute(text("SELECT set_config('app.moving_posts', 'on', true)"))
+        moved = db.execute(text(f"INSERT INTO posts ({POSTS_COPY_COLUMNS}) SELECT {POSTS_COPY_COLUMNS} "
+                                f"FROM posts_future WHERE created < {upper}")).rowcount
+        db.execute(text(f"DELETE FROM posts_future WHERE created < {upper}"))
+        db.execute(text("SELECT set_config('app.moving_posts', 'off', true)"))
+        db.execute(text(f"ALTER TABLE posts ATTACH PARTITION posts_future FOR VALUES FROM ({upper}) TO (MAXVALUE)"))
+        if moved:
+            # Their months should have been created ahead of time
+            logger.warning("moved %d posts from posts_future to %s", moved, ", ".join(created))
+    return created
+
+
+def _create_post_partition(db, month: date) -> str:
+    name = post_partition_name(month)
+    db.execute(text(f"CREATE TABLE {name} PARTITION OF posts "
+                    f"FOR VALUES FROM ('{month} 00:00:00+00') TO ('{month_start(month, 1)} 00:00:00+00')"))
+    return name
+
+
+def _future_start(db) -> date:
+    # The lower bound of posts_future. pg_get_expr prints it in the session's time zone, with the offset.
+    start = db.execute(text(
+        "SELECT (regexp_match(pg_get_expr(relpartbound, oid), 'FROM \\(''([^'']+)''\\)'))[1]::timestamptz "
+        "FROM pg_class WHERE oid = 'posts_future'::regclass")).scalar()
+    return start.astimezone(timezone.utc).date()
+
+
+def create_future_post_partitions(db) -> List[str]:
+    # This month and the 'posts_partitions_ahead_months' after it
+    today = datetime.now(timezone.utc).date()
+    return create_post_partitions(db, today, month_start(today, settings.posts_partitions_ahead_months))
+
+
+def after_create_posts(target, connection, **kw):
+    # Registered in db_models for metadata.create_all (tests, benchmarks), alembic does the same
+    # with the month of the oldest post instead of this month
+    this_month = month_start(datetime.now(timezone.utc).date())
+    connection.execute(text(f"CREATE TABLE posts_history PARTITION OF posts "
+                            f"FOR VALUES FROM (MINVALUE) TO ('{this_month} 00:00:00+00')"))
+    connection.execute(text(f"CREATE TABLE posts_future PARTITION OF posts "
+                            f"FOR VALUES FROM ('{this_month} 00:00:00+00') TO (MAXVALUE)"))
+    for statement in POST_IDS_TRIGGERS:
+        connection.execute(text(statement))
+    create_future_post_partitions(connection)
+
+
+def after_create_likes(target, connection, **kw):
+    for remainder in range(LIKES_PARTITIONS):
+        connection.execute(text(f"CREATE TABLE likes_p{remainder} PARTITION OF likes "
+                                f"FOR VALUES WITH (MODULUS {LIKES_PARTITIONS}, REMAINDER {remainder})"))
+
+
+async def create_partitions_periodically(interval: float):
+    # Started by the app's lifespan, first right away
+    while True:
+        try:
+            async with database.open_session() as db:
+                created = await database.run(db, _create_future_post_partitions)
+            if created:
+                logger.info("created posts partitions %s", ", ".join(created))
+        except Exception:
+            logger.exception("creating posts partitions failed")
+        await asyncio.sleep(interval)
+
+
+def _create_future_post_partitions(db) -> List[str]:
+    created = create_future_post_partitions(db)
+    db.commit()
+    return created
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--list", action="store_true", help="list the partitions of posts and likes")
+    args = parser.parse_args()
+
+    database.init_engines()
+    db = database.SessionLocal()
+    try:
+        created = _create_future_post_partitions(db)
+        print(f"created {len(created)} partition(s) {', '.join(created)}")
+        if args.list:
+            rows = db.execute(text('''
+                SELECT inhparent::regclass::text, inhrelid::regclass::text,
+                       pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+                FROM pg_inherits JOIN pg_class c ON c.oid = inhrelid
+                WHERE inhparent IN ('posts'::regclass, 'likes'::regclass) ORDER BY 1, 2
+            '''))
+            for table, partition, bound, rows_estimate in rows:
+                print(f"{table:<6} {partition:<16} {bound:<80} ~{max(rows_estimate, 0)} rows")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.utils.metrics import record_pool_wait
+
+
+class PoolStats:
+    '''
+    Counters of how long requests waited for a connection from a pool.
+    '''
+    def __init__(self):
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, timed_out: bool = False):
+        # Also charged to the current request for /metrics
+        record_pool_wait(seconds)
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+
+class TimedPoolMixin:
+    '''
+    Records the time spent waiting in _do_get, the point where a QueuePool blocks (up to
+    pool_timeout) when all pool_size + max_overflow connections are checked out.
+    '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_status(pool) -> dict:
+    '''
+    Reports the usage of a connection pool.
+
+        Parameters:
+            pool (TimedQueuePool | TimedAsyncAdaptedQueuePool): The engine's pool
+
+        Returns:
+            dict: checked out/idle connections and wait time statistics
+    '''
+    stats = pool.stats
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "waits": stats.waits,
+        "wait_seconds_total": round(stats.wait_seconds_total, 6),
+        "wait_seconds_max": round(stats.wait_seconds_max, 6),
+        "timeouts": stats.timeouts,
+    }
@@ -0,0 +1,132 @@
+from datetime import datetime
+from typing import Collection, Optional
+
+from sqlalchemy import and_, exists, func, select, tuple_
+from sqlalchemy.orm import Query, Session
+from sqlalchemy.sql import Select
+
+from . import db_models
+
+# Read endpoints select plain columns and encode them with orjson (post_models.post_likes_json).
+# The rows come from our own database, so pydantic's from_orm and re-validation are skipped.
+POST_COLUMNS = (
+    db_models.Post.id, db_models.Post.title, db_models.Post.content, db_models.Post.published,
+    db_models.Post.created, db_models.Post.user_id, db_models.Post.like_count,
+)
+OWNER_COLUMNS = (
+    db_models.User.id.label("owner_id"), db_models.User.email.label("owner_email"),
+    db_models.User.created.label("owner_created"),
+)
+POST_LIKES_COLUMNS = POST_COLUMNS + OWNER_COLUMNS
+
+
+def query_post_likes(db: Session, user_id: int) -> Query:
+    '''
+    Posts with their owner, like count and whether 'user_id' liked them, in one query.
+
+        SELECT posts.*, users.*, EXISTS (SELECT 1 FROM likes WHERE likes.post_id = posts.id
+                                         AND likes.user_id = user_id) AS liked_by_me
+        FROM posts JOIN users ON users.id = posts.user_id
+
+        Parameters:
+            user_id (int): The user asking, for 'liked_by_me'
+
+        Returns:
+            Query: Rows for post_models.post_likes_json
+    '''
+    # One primary key (user_id, post_id) probe per returned post
+    liked_by_me = exists().where(db_models.Like.post_id == db_models.Post.id, db_models.Like.user_id == user_id)
+    return db.query(*POST_LIKES_COLUMNS, liked_by_me.label("liked_by_me"))\
+             .select_from(db_models.Post).join(db_models.Post.owner)
+
+
+def by_id(post_id: int):
+    '''
+    WHERE posts.id = post_id AND posts.created = (SELECT post_ids.created FROM post_ids WHERE post_ids.id = post_id)
+
+    posts.id alone probes the index of every month. With the post's 'created' from post_ids
+    postgres reads its month only, the others are pruned when the statement starts.
+    '''
+    created = select(db_models.PostId.created).where(db_models.PostId.id == post_id).scalar_subquery()
+    return and_(db_models.Post.id == post_id, db_models.Post.created == created)
+
+
+# The fields GET /posts?fields= can select: the PostResponse fields, 'excerpt' (the start of the
+# content) and the PostLikesResponse fields next to 'Post'
+POST_FIELDS = ("title", "content", "excerpt", "published", "created", "id", "user_id", "owner",
+               "likes", "liked_by_me")
+
+
+def query_post_fields(db: Session, user_id: int, fields: Collection[str], excerpt_length: int) -> Query:
+    '''
+    Like query_post_likes, but selects only what 'fields' needs. The owner join and the
+    'liked_by_me' probe are left out unless asked for, and 'excerpt' reads the first
+    'excerpt_length' characters of the content instead of all of it.
+
+        SELECT posts.id, posts.created, posts.title, left(posts.content, excerpt_length) AS excerpt, ...
+        FROM posts
+
+        Parameters:
+            user_id (int): The user asking, for 'liked_by_me'
+            fields (Collection[str]): Names from POST_FIELDS
+            excerpt_length (int): The length of 'excerpt' in characters
+
+        Returns:
+            Query: Rows for post_models.post_fields_json. They always carry 'id' and 'created',
+                   the position for the next page's cursor
+    '''
+    columns = {
+        "title": [db_models.Post.title],
+        "content": [db_models.Post.content],
+        # Postgres decompresses only the start of a compressed (TOASTed) content for this
+        "excerpt": [func.left(db_models.Post.content, excerpt_length).label("excerpt")],
+        "published": [db_models.Post.published],
+        "user_id": [db_models.Post.user_id],
+        "owner": list(OWNER_COLUMNS),
+        "likes": [db_models.Post.like_count],
+        "liked_by_me": [exists().where(db_models.Like.post_id == db_models.Post.id,
+                                       db_models.Like.user_id == user_id).label("liked_by_me")],
+    }
+    selected = [db_models.Post.id, db_models.Post.created]
+    for field in POST_FIELDS:
+        if field in fields and field in columns:
+            selected += columns[field]
+
+    query = db.query(*selected).select_from(db_models.Post)
+    if "owner" in fields:
+        query = query.join(db_models.Post.owner)
+    return query
+
+
+def newest_first(query: Query) -> Query:
+    # ORDER BY posts.created DESC, posts.id DESC
+    return query.order_by(db_models.Post.created.desc(), db_models.Post.id.desc())
+
+
+def after_cursor(query: Query, created: datetime, post_id: int) -> Query:
+    # Keyset pagination: WHERE (posts.created, posts.id) < (created, post_id) AND posts.created <= created
+    # Seeks straight into a (..., created, id) index instead of reading and discarding 'skip' rows.
+    # Postgres prunes partitions on the plain comparison only, not on the row comparison.
+    return query.filter(tuple_(db_models.Post.created, db_models.Post.id) < (created, post_id),
+                        db_models.Post.created <= created)
+
+
+def select_posts_export(since: Optional[datetime] = None) -> Select:
+    '''
+    Every post with its owner and like count, oldest first.
+
+        SELECT posts.*, users.* FROM posts JOIN users ON users.id = posts.user_id
+        WHERE posts.created >= since ORDER BY posts.created, posts.id
+
+        Parameters:
+            since (datetime): Only posts created at or after this time, all posts when None
+
+        Returns:
+            Select: Rows for post_models.post_export_json
+    '''
+    # Walks ix_posts_created_id forward, starting at 'since'
+    statement = select(*POST_LIKES_COLUMNS).join_from(db_models.Post, db_models.User)\
+                  .order_by(db_models.Post.created, db_models.Post.id)
+    if since is not None:
+        statement = statement.where(db_models.Post.created >= since)
+    return statement
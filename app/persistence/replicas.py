@@ -0,0 +1,208 @@
+import contextvars
+import hashlib
+import hmac
+import itertools
+import math
+import time
+from typing import List, Optional
+
+from fastapi import Depends
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import cookie_parser
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+from app.utils.lru_cache import LRUCache
+from . import database
+
+
+class ReplicaSet:
+    '''
+    Read replicas picked round-robin. A replica that fails to connect is skipped for
+    'retry_seconds' before it is tried again.
+
+        Parameters:
+            urls (List[str]): postgresql:// urls of the replicas
+            retry_seconds (float): How long an unhealthy replica is left out
+            options (dict): Engine keyword arguments to use instead of database.engine_options()
+    '''
+    def __init__(self, urls: List[str], retry_seconds: float, options: Optional[dict] = None):
+        self.urls = urls
+        self.retry_seconds = retry_seconds
+        self.options = options
+        self._engines = {}
+        self._down_until = [0.0] * len(urls)
+        self._counter = itertools.count()
+
+    def engines(self, async_driver: bool):
+        # Engines are created on first use for the driver the primary session uses
+        if async_driver not in self._engines:
+            options = self.options if self.options is not None else database.engine_options(async_driver)
+            if async_driver:
+                self._engines[True] = [create_async_engine(make_url(url).set(drivername="postgresql+asyncpg"),
+                                                           **options) for url in self.urls]
+            else:
+                self._engines[False] = [create_engine(url, **options) for url in self.urls]
+        return self._engines[async_driver]
+
+    async def connect(self, async_driver: bool):
+        '''
+        Checks out a connection from the next healthy replica.
+
+            Returns:
+                Connection | AsyncConnection, or None if no replica is available
+        '''
+        engines = self.engines(async_driver)
+        for _ in range(len(engines)):
+            index = next(self._counter) % len(engines)
+            if self._down_until[index] > time.monotonic():
+                continue
+            try:
+                if async_driver:
+                    return await engines[index].connect()
+                return await run_in_threadpool(engines[index].connect)
+            except exc.TimeoutError:
+                # The replica is up but its pool is exhausted
+                continue
+            except (exc.DBAPIError, OSError):
+                self._down_until[index] = time.monotonic() + self.retry_seconds
+        return None
+
+    def pools(self):
+        # The pools of the engines in use, one per replica url
+        return [engine.sync_engine.pool if async_driver else engine.pool
+                for async_driver, engines in self._engines.items() for engine in engines]
+
+    async def dispose(self):
+        # Closes the pooled connections, the engines are created again on next use
+        engines, self._engines = self._engines, {}
+        for async_driver, replica_engines in engines.items():
+            for engine in replica_engines:
+                if async_driver:
+                    await engine.dispose()
+                else:
+                    await run_in_threadpool(engine.dispose)
+
+    def __len__(self):
+        return len(self.urls)
+
+
+replica_set = ReplicaSet(settings.database_replica_urls, settings.replica_retry_seconds)
+
+# Users who wrote recently read from the primary, so they see their own writes despite replica lag.
+# This worker remembers them in recent_writers. With several workers the next request may reach
+# another one, so the write's response also sets the PIN_COOKIE, '<user id>.<until>.<signature>',
+# which every worker checks (ReadYourWritesMiddleware). Clients that drop cookies are pinned on the
+# worker they wrote through only.
+recent_writers = LRUCache(maxsize=settings.user_cache_size, ttl=settings.read_your_writes_seconds)
+PIN_COOKIE = "read_primary"
+
+# Per request: {"user_id": user pinned by the request's cookie, "pin": user to set the cookie for}
+_request_pin: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_pin", default=None)
+
+
+def pin_to_primary(user_id: int):
+    '''
+    Sends the reads of this user to the primary for 'read_your_writes_seconds'.
+    '''
+    recent_writers.set(user_id, True)
+    pin = _request_pin.get()
+    if pin is not None:
+        pin["pin"] = user_id
+
+
+def is_pinned_to_primary(user_id: Optional[int]) -> bool:
+    if user_id is None:
+        return False
+    pin = _request_pin.get()
+    return bool(recent_writers.get(user_id)) or (pin is not None and pin["user_id"] == user_id)
+
+
+def _signature(value: str) -> str:
+    return hmac.new(settings.secret_key.encode(), f"{PIN_COOKIE}:{value}".encode(), hashlib.sha256).hexdigest()
+
+
+def pin_cookie(user_id: int, now: float) -> str:
+    value = f"{user_id}.{math.ceil(now + settings.read_your_writes_seconds)}"
+    return f"{value}.{_signature(value)}"
+
+
+def pinned_user(cookie: Optional[str], now: float) -> Optional[int]:
+    '''
+    The user a PIN_COOKIE pins to the primary, None if it is missing, expired or not signed by us.
+    '''
+    user_id, _, rest = (cookie or "").partition(".")
+    until, _, signature = rest.partition(".")
+    if not (user_id.isdigit() and until.isdigit() and
+            hmac.compare_digest(signature, _signature(f"{user_id}.{until}")) and int(until) > now):
+        return None
+    return int(user_id)
+
+
+class ReadYourWritesMiddleware:
+    '''
+    Reads the PIN_COOKIE of a request for is_pinned_to_primary, and sets it on the response of
+    a request that called pin_to_primary. Does nothing without replicas.
+    '''
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not len(replica_set):
+            await self.app(scope, receive, send)
+            return
+
+        now = time.time()
+        cookies = cookie_parser(dict(scope["headers"]).get(b"cookie", b"").decode("latin-1"))
+        pin = {"user_id": pinned_user(cookies.get(PIN_COOKIE), now), "pin": None}
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and pin["pin"] is not None:
+                cookie = (f"{PIN_COOKIE}={pin_cookie(pin['pin'], now)}; Max-Age="
+                          f"{math.ceil(settings.read_your_writes_seconds)}; Path=/; HttpOnly; SameSite=Lax")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        token = _request_pin.set(pin)
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _request_pin.reset(token)
+
+
+# Dependency
+async def get_read_db(primary: Session = Depends(database.get_db),
+                      user_id: Optional[int] = Depends(oauth2.get_token_user_id)):
+    '''
+    Yields a session on a read replica, or the primary session when no replica is configured
+    or healthy, or when the user wrote recently. The primary session only connects if used.
+    '''
+    async_driver = isinstance(primary, AsyncSession)
+    connection = None
+    if len(replica_set) and not is_pinned_to_primary(user_id):
+        connection = await replica_set.connect(async_driver)
+
+    if connection is None:
+        yield primary
+        return
+
+    if async_driver:
+        db = AsyncSession(bind=connection, autoflush=False, expire_on_commit=False)
+        try:
+            yield db
+        finally:
+            await db.close()
+            await connection.close()
+    else:
+        # The connection only tells the replica is up. Bound to the engine, the session checks
+        # out a connection per database.run and returns it before the thread is given back.
+        await run_in_threadpool(connection.close)
+        db = Session(bind=connection.engine, autoflush=False)
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
@@ -6,13 +6,14 @@ from app.models import auth_models
 from app.authentication import oauth2
 from app.authentication import auth_utils
 from app.persistence import database, db_models
+from app.persistence.database import run
 
 router = APIRouter(
     tags=['Authentication']
 )
 
 @router.post("/login", response_model=auth_models.Token)
-def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
     '''
     Summary:
     Login a user into the system.
@@ -24,19 +25,30 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session =
     The 'access token' and 'type' for a successful login and 403 Error for invalid credentials
     '''
     #Get the user from the database
-    user = db.query(db_models.User).filter(db_models.User.email == user_credentials.username).first()
+    user = await run(db, lambda db: db.query(db_models.User)
+                                      .filter(db_models.User.email == user_credentials.username).first())
    
    # If user does not exist in database, throw 403 Exception
     if not user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail=f"Invalid credentials for user {user_credentials.email}")
+                            detail=f"Invalid credentials for user {user_credentials.username}")
 
     # If the password is incorrect, throw 403 Exception
-    if not auth_utils.verify_password(user_credentials.password, user.password):
+    valid, new_hash = await auth_utils.verify_and_update(user_credentials.password, user.password)
+    if not valid:
          raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail=f"Invalid credentials for user {user_credentials.email}")
+                            detail=f"Invalid credentials for user {user_credentials.username}")
 
-    # create token
-    access_token = oauth2.create_access_token(data = {"user_id": user.id})
+    # The stored hash is outdated (e.g. bcrypt_rounds was raised), store the new one
+    if new_hash:
+        def store_hash(db: Session):
+            # 'user' was loaded by an earlier run and is detached from the session
+            db.query(db_models.User).filter(db_models.User.id == user.id).update({"password": new_hash})
+            db.commit()
+        
+        await run(db, store_hash)
+
+    # create token, the email claim lets get_current_user skip the user lookup (stateless_auth)
+    access_token = oauth2.create_access_token(data = {"user_id": user.id, "email": user.email})
     
     return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import exc, text
+from sqlalchemy.orm import Session
+
+from app.persistence import database, replicas
+from app.persistence.database import get_db, run
+from app.persistence.pool import pool_status
+from app.utils.like_events import like_events
+from app.utils.like_queue import like_queue
+from app.utils.response_cache import posts_cache
+
+router = APIRouter(
+    prefix="/health",
+    tags=['Health']
+)
+
+@router.get("/ready")
+async def get_readiness(db: Session = Depends(get_db)):
+    '''
+    Readiness probe: 200 once the database answers, 503 while it does not.
+    GET / (ping) only tells the process is up.
+
+        Parameters:
+            No user params
+
+        Returns:
+            {"status": "ready"}
+    '''
+    try:
+        await run(db, lambda db: db.execute(text("SELECT 1")))
+    except (exc.DBAPIError, OSError):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database unavailable")
+    return {"status": "ready"}
+
+
+@router.get("/pool")
+async def get_pool_status():
+    '''
+    Reports the database connection pool usage.
+
+        Parameters:
+            No user params
+
+        Returns:
+            checked out/idle/overflow connections, and how often and how long requests waited for one
+    '''
+    return {"primary": pool_status(database.request_pool()),
+            "replicas": [pool_status(pool) for pool in replicas.replica_set.pools()]}
+
+
+@router.get("/cache")
+async def get_cache_status():
+    '''
+    Reports the usage of the GET /posts response cache.
+
+        Parameters:
+            No user params
+
+        Returns:
+            cached responses, hits/misses/evictions, the number of 304 Not Modified answers and of
+            hits not served because a post in them was liked since ('stale')
+    '''
+    return {"posts": posts_cache.stats()}
+
+
+@router.get("/likes")
+async def get_like_queue_status():
+    '''
+    Reports the write-behind like queue (LIKE_WRITE_BEHIND).
+
+        Parameters:
+            No user params
+
+        Returns:
+            pending likes, and how many were queued, rejected (queue full), written, retried (queued again
+            after a failed write) and dropped (failed LIKE_FLUSH_RETRIES times)
+    '''
+    return like_queue.stats()
+
+
+@router.get("/streams")
+async def get_like_streams_status():
+    '''
+    Reports the live like count streams (GET /like/stream) of this worker.
+
+        Parameters:
+            No user params
+
+        Returns:
+            open streams, followed posts, and how many changes were published, delivered and dropped (slow streams),
+            and how many reconnects were replayed the changes since their Last-Event-ID
+    '''
+    return like_events.stats()
@@ -1,9 +1,20 @@
-from fastapi import status, HTTPException, Depends, APIRouter
+from typing import List, Optional
+
+from fastapi import status, HTTPException, Depends, APIRouter, Header, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import conint
 from sqlalchemy.orm import Session
 
 from app.authentication import oauth2
-from app.persistence import database, db_models
+from app.configuration.config import settings
+from app.persistence import database, db_models, likes
+from app.persistence.database import run
+from app.persistence.replicas import pin_to_primary
 from app.models import post_models
+from app.utils.like_events import event_stream, like_events
+from app.utils.like_queue import known_posts, like_queue
+from app.utils.response_cache import posts_cache
+from app.utils.trending import trending_posts
 
 router = APIRouter(
     prefix="/like",
@@ -14,7 +25,7 @@ LIKE = 1
 UNLIKE = 0
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
-def like(like: post_models.Like, db: Session = Depends(database.get_db), 
+async def like(like: post_models.Like, db: Session = Depends(database.get_db), 
          current_user: int = Depends(oauth2.get_current_user)):
     '''
     Adds or removes a 'like' from a post.
@@ -23,38 +34,181 @@ def like(like: post_models.Like, db: Session = Depends(database.get_db),
             like (Like): The like object containing post_id and direction (like = 1, unlike = 0)
 
         Returns:
-            Success/Failure of the action
-    '''
-    # check whether the post exists
-    post = db.query(db_models.Post).filter(db_models.Post.id == like.post_id).first()
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Post with id {like.post_id} does not exist")
-    
-    # find out if the post is already liked by user
-    already_liked_query = db.query(db_models.Like).filter(db_models.Like.post_id == like.post_id, 
-                                     db_models.Like.user_id == current_user.id)
-    already_liked_post = already_liked_query.first()
-    
-    if (like.direction == LIKE):
-        # If the post is already liked by this user, we can't like again, throw 409 Conflict
-        if already_liked_post:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, 
-                                detail=f"Post with id {like.post_id} already liked by user {current_user.id}")
-        
-        # Add like to the post in the databse
-        new_like = db_models.Like(post_id = like.post_id, user_id = current_user.id)
-        db.add(new_like)
-        db.commit()
-        return {"message": f"Successfully liked post {like.post_id}"}
-   
-    else: # User wants to unlike a post
-        # If the post is not already liked by user, it can't be unliked
-        if not already_liked_post:
+            Success/Failure of the action. With 'like_write_behind' 202 once the like is queued
+    '''
+    if settings.like_write_behind:
+        return await queue_like(like, db, current_user.id)
+    
+    def change_like(db: Session):
+        if (like.direction == LIKE):
+            # Insert the like and bump the post's like counter in one statement
+            liked = likes.add_like(db, like.post_id, current_user.id)
+            
+            if not liked:
+                # Only needed to tell 'already liked' (409) from 'no such post' (404)
+                exists = likes.existing_posts(db, [like.post_id])
+                db.rollback()
+                if not exists:
+                    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                        detail=f"Post with id {like.post_id} does not exist")
+                # If the post is already liked by this user, we can't like again, throw 409 Conflict
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, 
+                                    detail=f"Post with id {like.post_id} already liked by user {current_user.id}")
+            
+            db.commit()
+            trending_posts.add(like.post_id, liked)
+            return {"message": f"Successfully liked post {like.post_id}"}
+       
+        else: # User wants to unlike a post
+            # Remove the like and decrement the post's like counter in one statement
+            unliked = likes.remove_like(db, like.post_id, current_user.id)
+            
+            # If the post is not already liked by user (or doesn't exist), it can't be unliked
+            if not unliked:
+                db.rollback()
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                    detail=f"Post {like.post_id} is not liked by user {current_user.id}. Cannot unlike")
+            
+            db.commit()
+            # Takes back the weight the like was given when it was made
+            trending_posts.add(like.post_id, unliked, count=-1)
+            return {"message": f"Successfully deleted like for post {like.post_id}"}
+    
+    result = await run(db, change_like)
+    # The feed pages holding the post show its like count
+    posts_cache.invalidate_posts([like.post_id])
+    like_events.publish({like.post_id: 1 if like.direction == LIKE else -1})
+    pin_to_primary(current_user.id)
+    
+    return result
+
+
+
+async def queue_like(like: post_models.Like, db: Session, user_id: int):
+    '''
+    Write-behind POST /like/: checks that the post exists and queues the like for utils/like_queue.py.
+    Whether the user already liked the post is only known when the like is written, so this never
+    answers 409, and unliking a post the user did not like is accepted and ignored.
+    '''
+    if not known_posts.get(like.post_id):
+        if not await run(db, likes.existing_posts, [like.post_id]):
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail=f"Post {like.post_id} is not liked by user {current_user.id}. Cannot unlike")
+                                detail=f"Post with id {like.post_id} does not exist")
+        known_posts.set(like.post_id, True)
+    
+    if not like_queue.put(user_id, like.post_id, like.direction):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many likes waiting to be written, try again later",
+                            headers={"Retry-After": "1"})
+    # Reads of this user go to the primary, where the like lands within 'like_flush_interval_ms'
+    pin_to_primary(user_id)
+    
+    action = "like" if like.direction == LIKE else "unlike"
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED,
+                        content={"message": f"Queued {action} of post {like.post_id}"})
+
+
+@router.post("/batch", response_model=List[post_models.LikeResult])
+async def like_batch(batch: List[post_models.Like], db: Session = Depends(database.get_db),
+                     current_user: int = Depends(oauth2.get_current_user)):
+    '''
+    Adds or removes 'likes' on several posts in one transaction: one statement for all the likes
+    and one for all the unlikes. Items fail individually, with the status POST /like/ would give.
+
+        Parameters:
+            batch (List[Like]): At most 'batch_max_size' likes, each post at most once
+
+        Returns:
+            List[LikeResult]: The status (201, 404 or 409) and message of every item, in request order
+    '''
+    if len(batch) > settings.batch_max_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {settings.batch_max_size} likes per batch")
+    if len({item.post_id for item in batch}) != len(batch):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="A post can appear only once per batch")
+    
+    def change_likes(db: Session):
+        like_ids = [item.post_id for item in batch if item.direction == LIKE]
+        unlike_ids = [item.post_id for item in batch if item.direction != LIKE]
         
-        # Remove the like from the post for this user
-        already_liked_query.delete(synchronize_session=False)
+        liked = likes.add_likes(db, like_ids, current_user.id) if like_ids else {}
+        unliked = likes.remove_likes(db, unlike_ids, current_user.id) if unlike_ids else {}
+        # Only needed to tell 'already liked' (409) from 'no such post' (404)
+        missing_likes = set(like_ids) - liked.keys()
+        existing = likes.existing_posts(db, missing_likes) if missing_likes else set()
         db.commit()
-        return {"message": f"Successfully deleted like for post {like.post_id}"}
\ No newline at end of file
+        
+        for post_id, created in liked.items():
+            trending_posts.add(post_id, created)
+        for post_id, created in unliked.items():
+            trending_posts.add(post_id, created, count=-1)
+        
+        results = []
+        for item in batch:
+            if item.direction == LIKE:
+                if item.post_id in liked:
+                    result = (status.HTTP_201_CREATED, f"Successfully liked post {item.post_id}")
+                elif item.post_id in existing:
+                    result = (status.HTTP_409_CONFLICT, f"Post with id {item.post_id} already liked by user {current_user.id}")
+                else:
+                    result = (status.HTTP_404_NOT_FOUND, f"Post with id {item.post_id} does not exist")
+            elif item.post_id in unliked:
+                result = (status.HTTP_201_CREATED, f"Successfully deleted like for post {item.post_id}")
+            else:
+                result = (status.HTTP_404_NOT_FOUND,
+                          f"Post {item.post_id} is not liked by user {current_user.id}. Cannot unlike")
+            results.append({**item.dict(), "status": result[0], "detail": result[1]})
+        return results
+    
+    results = await run(db, change_likes)
+    changed = {result["post_id"]: 1 if result["direction"] == LIKE else -1
+               for result in results if result["status"] == status.HTTP_201_CREATED}
+    posts_cache.invalidate_posts(changed)
+    like_events.publish(changed)
+    pin_to_primary(current_user.id)
+    
+    return results
+
+
+@router.get("/stream", response_class=StreamingResponse,
+            responses={200: {"content": {"text/event-stream": {}}}})
+async def stream_likes(post_ids: List[conint(le=db_models.MAX_ID)] = Query(...), last_event_id: Optional[str] = Header(None),
+                       db: Session = Depends(database.get_db),
+                       current_user: int = Depends(oauth2.get_stream_user)):
+    '''
+    Pushes the like counts of posts as Server-Sent Events, instead of polling GET /posts/{id}.
+    The stream starts with a 'counts' event, add the changes of every 'likes' event to them.
+    EventSource reconnects with the id of the last event (Last-Event-ID) and gets the changes it
+    missed, or the counts again. After an 'event: dropped' (the client did not keep up) reconnect
+    without it. EventSource cannot set the Authorization header, the token can also be passed as
+    '?access_token=' or in the 'access_token' cookie.
+
+        Parameters:
+            post_ids (List[int]): The posts to follow, at most 'like_stream_max_posts', e.g. ?post_ids=1&post_ids=2
+
+        Returns:
+            text/event-stream: a 'counts' event with post id -> like count, then 'likes' events with
+                               post id -> change of its like count, see utils/like_events.py
+    '''
+    post_ids = set(post_ids)
+    if len(post_ids) > settings.like_stream_max_posts:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {settings.like_stream_max_posts} posts per stream")
+    
+    # The user is loaded, the stream must not keep a pooled connection for its whole life
+    await database.release(db)
+
+    async def counts():
+        # From the primary, a replica could lag behind the changes already published. The session
+        # checks out a connection again for this one query.
+        try:
+            return await database.run(db, likes.like_counts, post_ids)
+        finally:
+            await database.release(db)
+    
+    events = event_stream(like_events, post_ids, settings.like_stream_keepalive_seconds,
+                          settings.like_stream_max_seconds, counts, last_event_id)
+    # No-buffering header for nginx, the events must reach the client as they happen
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
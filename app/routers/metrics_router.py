@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.utils.like_queue import like_queue
+from app.utils.metrics import metrics
+
+router = APIRouter(
+    tags=['Metrics']
+)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    '''
+    Request and database metrics of this process in the Prometheus text format.
+
+        Parameters:
+            No user params
+
+        Returns:
+            Per route: request counts by status, latency histogram, SQL statements, database time
+            and connection pool wait time. The write-behind like queue's pending, written, retried and
+            dropped likes.
+    '''
+    return PlainTextResponse(metrics.render() + like_queue.render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,12 +1,24 @@
-from typing import List, Optional
-from fastapi import Response, status, HTTPException, Depends, APIRouter
-from sqlalchemy import func
+import zlib
+from datetime import datetime
+from typing import List, Literal, Optional
+
+import orjson
+from fastapi import Response, status, HTTPException, Depends, APIRouter, Header, Path, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from app.authentication import oauth2
+from app.configuration.config import settings
 from app.models import post_models
-from app.persistence import db_models
-from app.persistence.database import get_db
+from app.persistence import db_models, likes, pagination
+from app.persistence.posts import (OWNER_COLUMNS, POST_COLUMNS, POST_FIELDS, after_cursor, by_id, newest_first,
+                                   query_post_fields, query_post_likes, select_posts_export)
+from app.persistence.database import get_db, run, stream
+from app.persistence.replicas import get_read_db, is_pinned_to_primary, pin_to_primary
+from app.utils.response_cache import posts_cache
+from app.utils.trending import trending_posts
 
 router = APIRouter(
     prefix="/posts",
@@ -14,31 +26,208 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[post_models.PostLikesResponse])
-def get_posts(db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user), 
-              limit: int = 10, skip: int = 0, search: Optional[str] = ""):
+async def get_posts(db: Session = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_user), 
+              limit: int = Query(10, ge=1, le=settings.max_page_size), skip: int = Query(0, ge=0),
+              search: Optional[str] = "", cursor: Optional[str] = None,
+              order: Literal["recent", "relevance"] = "recent", fields: Optional[str] = None,
+              excerpt_length: int = settings.post_excerpt_length, if_none_match: Optional[str] = Header(None)):
     '''
-    Gets all the posts from the database.
+    Gets all the posts from the database, newest first.
 
         Parameters:
-            No user params
+            limit (int): The page size, at most 'max_page_size'
+            skip (int): The number of posts to skip (offset pagination)
+            search (str): Full text search over title and content (web search syntax: words, "phrases", -not, or)
+            cursor (str): The 'X-Next-Cursor' header of the previous page (keyset pagination).
+                          When given, 'skip' is ignored.
+            order (str): 'recent' (newest first) or 'relevance' (best search matches first, offset pagination only)
+            fields (str): Comma separated fields to return, e.g. 'id,title,excerpt,likes' for a listing.
+                          The PostResponse fields go into 'Post', 'likes' and 'liked_by_me' next to it.
+                          Only those columns are read. All fields but 'excerpt' when not given.
+            excerpt_length (int): The number of characters of the content in the 'excerpt' field
+            if_none_match (str): The 'ETag' of a previous response, answered with 304 if still current
 
         Returns:
-            List[PostResponse] : A list of PostResponse types
+            List[PostResponse] : A list of PostResponse types. If the page is full, the cursor
+                                 for the next page is returned in the 'X-Next-Cursor' header
     '''
     #posts = db.query(models.Post).filter(models.Post.title.contains(search)).limit(limit).offset(skip).all()
     
-    # SELECT posts.*, COUNT(likes.post_id) FROM posts LEFT OUTER JOIN likes ON posts.id = likes.post_id GROUP BY likes.post_id
-    # Where posts.title LIKE %search% LIMIT limit OFFSET skip
-    results = db.query(db_models.Post, func.count(db_models.Like.post_id).label("likes"))\
-                .join(db_models.Like, db_models.Like.post_id == db_models.Post.id, isouter=True)\
-                .group_by(db_models.Post.id).filter(db_models.Post.title.contains(search))\
-                .limit(limit).offset(skip).all()
+    rank_by_relevance = bool(search) and order == "relevance"
+    if cursor and rank_by_relevance:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Cursor pagination is only supported for order=recent")
+    
+    if cursor:
+        try:
+            created, post_id = pagination.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    
+    if fields is not None:
+        selected = {field.strip() for field in fields.split(",")} - {""}
+        if not selected or not selected <= set(POST_FIELDS):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"fields must be a comma separated list of {', '.join(POST_FIELDS)}")
+        # In a fixed order, so the same selection shares a cache entry
+        fields = tuple(field for field in POST_FIELDS if field in selected)
+    if excerpt_length < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="excerpt_length must be positive")
+    
+    # Serve the page from the serialized response cache. It is shared by all users, 'liked_by_me'
+    # is left out and added per request. Users who just wrote skip it, it may have been filled from
+    # a lagging replica.
+    liked_by_me = fields is None or "liked_by_me" in fields
+    since = posts_cache.sequence
+    cache_key = posts_cache.key(limit, skip, search, cursor, order, fields,
+                                excerpt_length if fields and "excerpt" in fields else None)
+    cached = None if is_pinned_to_primary(current_user.id) else posts_cache.get(cache_key)
+    if cached:
+        if liked_by_me and cached.post_ids:
+            # SELECT likes.post_id FROM likes WHERE likes.user_id = user_id AND likes.post_id IN (page)
+            liked = await run(db, likes.liked_posts, current_user.id, cached.post_ids)
+            cached = posts_cache.overlay(cached, "liked_by_me", [post_id in liked for post_id in cached.post_ids])
+        return posts_cache.respond(cached, if_none_match)
+    
+    def fetch_posts(db: Session):
+        # SELECT posts.*, users.*, EXISTS (...) AS liked_by_me FROM posts JOIN users ON users.id = posts.user_id
+        # WHERE posts.search_vector @@ websearch_to_tsquery('english', search)
+        # ORDER BY posts.created DESC, posts.id DESC LIMIT limit OFFSET skip
+        # The ORDER BY/LIMIT walks the ix_posts_created_id index, no aggregation over likes is needed
+        # With 'fields' the SELECT list holds only their columns (posts.query_post_fields)
+        if fields is None:
+            query = query_post_likes(db, current_user.id)
+        else:
+            query = query_post_fields(db, current_user.id, fields, excerpt_length)
+        
+        if search:
+            # The match is served by the ix_posts_search_vector GIN index
+            ts_query = func.websearch_to_tsquery(literal_column(f"'{db_models.SEARCH_CONFIG}'::regconfig"), search)
+            query = query.filter(db_models.Post.search_vector.op("@@")(ts_query))
+        
+        if rank_by_relevance:
+            # Title matches weigh more than content matches (setweight A/B)
+            query = query.order_by(func.ts_rank(db_models.Post.search_vector, ts_query).desc())
+        query = newest_first(query)
+        
+        if cursor:
+            # Served by the ix_posts_created_id index
+            query = after_cursor(query, created, post_id)
+        else:
+            query = query.offset(skip)
+        
+        return query.limit(limit).all()
+    
+    rows = await run(db, fetch_posts)
+    
+    # A full page means there may be more posts, hand out the position of the last one
+    headers = {}
+    if rows and len(rows) == limit and not rank_by_relevance:
+        headers["X-Next-Cursor"] = pagination.encode_cursor(rows[-1].created, rows[-1].id)
+
+    if fields is None:
+        results = [post_models.post_likes_json(row) for row in rows]
+    else:
+        results = [post_models.post_fields_json(row, fields) for row in rows]
+    # 'liked_by_me' is the last key, cached without it and put back the same way as on a hit
+    for result in results:
+        result.pop("liked_by_me", None)
+    cached = posts_cache.set(cache_key, results, headers, [row.id for row in rows], since)
+    if liked_by_me:
+        cached = posts_cache.overlay(cached, "liked_by_me", [row.liked_by_me for row in rows])
+    return posts_cache.respond(cached, if_none_match)
+
+
+@router.get("/export", response_class=StreamingResponse,
+            responses={200: {"content": {"application/x-ndjson": {}}}})
+async def export_posts(db: Session = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_user),
+                       since: Optional[datetime] = None, accept_encoding: Optional[str] = Header(None)):
+    '''
+    Streams all posts with their like counts as NDJSON, one PostLikesResponse without
+    'liked_by_me' per line, oldest first. The rows are read through a server-side cursor,
+    'export_batch_size' at a time, so memory use does not grow with the table.
+
+        Parameters:
+            since (datetime): Only posts created at or after this time. For incremental pulls pass
+                              the 'created' of the last post of the previous export, which is sent again
+            accept_encoding (str): With 'gzip' the stream is gzip compressed
+
+        Returns:
+            application/x-ndjson stream
+    '''
+    gzip = accepts_gzip(accept_encoding)
+
+    async def lines():
+        # 31: zlib's gzip container
+        compressor = zlib.compressobj(wbits=31) if gzip else None
+        async for rows in stream(db, select_posts_export(since), settings.export_batch_size):
+            chunk = b"".join(orjson.dumps(post_models.post_export_json(row), option=orjson.OPT_APPEND_NEWLINE)
+                             for row in rows)
+            yield compressor.compress(chunk) if gzip else chunk
+        if gzip:
+            yield compressor.flush()
+
+    headers = {"Vary": "Accept-Encoding"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers=headers)
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    '''
+    Whether an Accept-Encoding header allows gzip: listed (or '*' when it is not) with a q-value
+    above 0, e.g. not for 'gzip;q=0' or 'identity, *;q=0'.
+    '''
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+
+@router.get("/trending", response_model=List[post_models.PostLikesResponse])
+async def get_trending_posts(db: Session = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_user),
+                             limit: int = 10):
+    '''
+    Gets the posts with the most likes recently: every like counts, halved every
+    'trending_half_life_hours', for 'trending_window_hours'.
 
-    return results
+    The ranking is precomputed (utils/trending.py), so this reads 'limit' post ids from memory
+    and fetches those posts by primary key, however many likes there are.
+
+        Parameters:
+            limit (int): The number of posts, at most 'trending_size'
+
+        Returns:
+            List[PostLikesResponse] : The posts, highest ranked first
+    '''
+    if not 0 < limit <= settings.trending_size:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"limit must be between 1 and {settings.trending_size}")
+    
+    post_ids = trending_posts.top(limit)
+    
+    def fetch_posts(db: Session):
+        # SELECT posts.*, users.*, EXISTS (...) AS liked_by_me FROM posts JOIN users ON users.id = posts.user_id
+        # WHERE posts.id IN post_ids
+        return query_post_likes(db, current_user.id).filter(db_models.Post.id.in_(post_ids)).all()
+    
+    rows = {row.id: row for row in await run(db, fetch_posts)} if post_ids else {}
+    # In ranking order. A post deleted since it was ranked is left out.
+    return ORJSONResponse([post_models.post_likes_json(rows[post_id]) for post_id in post_ids if post_id in rows])
 
 
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=post_models.PostResponse)
-def create_posts(post:post_models.Post, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+async def create_posts(post:post_models.Post, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
     '''
     Creates a new post and stores it in the database.
 
@@ -48,17 +237,64 @@ def create_posts(post:post_models.Post, db: Session = Depends(get_db), current_u
         Returns:
             new_post (PostResponse) : The newly created post
     '''
-    # Add the user id to the post and store it in the database
-    new_post = db_models.Post(user_id = current_user.id, **post.dict())
-    db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
+    def add_post(db: Session):
+        # Add the user id to the post and store it in the database
+        new_post = db_models.Post(user_id = current_user.id, **post.dict())
+        db.add(new_post)
+        db.commit()
+        db.refresh(new_post)
+        
+        return post_models.PostResponse.from_orm(new_post)
+    
+    new_post = await run(db, add_post)
+    posts_cache.invalidate()
+    pin_to_primary(current_user.id)
     
     return new_post
 
 
+@router.post("/batch", status_code=status.HTTP_201_CREATED, response_model=List[post_models.PostResponse])
+async def create_posts_batch(posts: List[post_models.Post], db: Session = Depends(get_db),
+                             current_user: int = Depends(oauth2.get_current_user)):
+    '''
+    Creates several posts with one multi-row INSERT in one transaction. Either all posts are
+    created or none.
+
+        Parameters:
+            posts (List[Post]): The new posts, at most 'batch_max_size'
+
+        Returns:
+            List[PostResponse] : The created posts, in the order of the request
+    '''
+    if len(posts) > settings.batch_max_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {settings.batch_max_size} posts per batch")
+    if not posts:
+        return ORJSONResponse([], status_code=status.HTTP_201_CREATED)
+    
+    def add_posts(db: Session):
+        # WITH new_posts AS (INSERT INTO posts (title, content, published, user_id) VALUES (...), (...)
+        #                    RETURNING posts.*)
+        # SELECT new_posts.*, users.* FROM new_posts JOIN users ON users.id = new_posts.user_id ORDER BY new_posts.id
+        new_posts = insert(db_models.Post)\
+            .values([{**post.dict(), "user_id": current_user.id} for post in posts])\
+            .returning(*POST_COLUMNS).cte("new_posts")
+        statement = select(new_posts, *OWNER_COLUMNS)\
+            .join(db_models.User, db_models.User.id == new_posts.c.user_id).order_by(new_posts.c.id)
+        
+        rows = db.execute(statement).all()
+        db.commit()
+        return rows
+    
+    rows = await run(db, add_posts)
+    posts_cache.invalidate()
+    pin_to_primary(current_user.id)
+    
+    return ORJSONResponse([post_models.post_json(row) for row in rows], status_code=status.HTTP_201_CREATED)
+
+
 @router.get("/{id}", response_model=post_models.PostLikesResponse)
-def get_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+async def get_post(id: int = Path(..., le=db_models.MAX_ID), db: Session = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_user)):
     '''
     Fetches a post by its 'id' from the database.
 
@@ -68,27 +304,24 @@ def get_post(id: int, db: Session = Depends(get_db), current_user: int = Depends
         Returns:
             post (PostResponse) : The fetched post from db.
     '''
-    # SELECT posts.*, COUNT(likes.post_id) FROM posts LEFT OUTER JOIN likes ON posts.id = likes.post_id GROUP BY likes.post_id
-    # WHERE posts.id == id
-    post = db.query(db_models.Post, func.count(db_models.Like.post_id).label("likes"))\
-             .join(db_models.Like, db_models.Like.post_id == db_models.Post.id, isouter=True)\
-             .group_by(db_models.Post.id).filter(db_models.Post.id == id).first()
-
-    # If no post exists by this Id, then it cannot be liked, throw 404 NOT FOUND
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail=f"post with id {id} not found")
-    
-    # If the post is not created by the current user, it cannot be retrieved by this user
-    if post.Post.user_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action")
+    def fetch_post(db: Session):
+        # SELECT posts.*, users.*, EXISTS (...) AS liked_by_me FROM posts JOIN users ON users.id = posts.user_id
+        # WHERE posts.id == id AND posts.created = (SELECT created FROM post_ids WHERE id = id)
+        post = query_post_likes(db, current_user.id).filter(by_id(id)).first()
+
+        # If no post exists by this Id, then it cannot be liked, throw 404 NOT FOUND
+        if not post:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                                detail=f"post with id {id} not found")
         
-    return post
+        # Any user can read any post, like in the feed. Only updates and deletes are limited to the owner.
+        return post
+    
+    return ORJSONResponse(post_models.post_likes_json(await run(db, fetch_post)))
 
 
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_post(id: int, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+async def delete_post(id: int = Path(..., le=db_models.MAX_ID), db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
     '''
     Deletes a post by its 'id' from the database.
 
@@ -98,27 +331,37 @@ def delete_post(id: int, db: Session = Depends(get_db), current_user: int = Depe
        Returns:
             No Response. Status code 204
     '''
-    # SELECT * FROM posts WHERE posts.id == id
-    post_query = db.query(db_models.Post).filter(db_models.Post.id == id)
-    # Get the first entry, no need to scan the table once we found an entry as id is primary key
-    post = post_query.first()
-    
-    if post == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="post not found")
-    
-    # If the post was not created by the current user, they cannot delete the post
-    if post.user_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action")
+    def remove_post(db: Session):
+        # SELECT * FROM posts WHERE posts.id == id AND posts.created = (SELECT created FROM post_ids WHERE id = id)
+        post_query = db.query(db_models.Post).filter(by_id(id))
+        # Get the first entry, no need to scan the table once we found an entry as id is primary key
+        post = post_query.first()
+        
+        if post == None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="post not found")
+        
+        # If the post was not created by the current user, they cannot delete the post
+        if post.user_id != current_user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                detail="Not authorized to perform requested action")
+        
+        # DELETE FROM posts WHERE posts.id = id AND posts.created = post.created
+        # 'created' prunes the DELETE to the post's partition. The trigger on posts deletes its
+        # post_ids row and with it, ON DELETE CASCADE, its likes (see db_models).
+        db.query(db_models.Post).filter(db_models.Post.id == id, db_models.Post.created == post.created)\
+          .delete(synchronize_session=False)
+        db.commit()
     
-    post_query.delete(synchronize_session=False)
-    db.commit()
+    await run(db, remove_post)
+    posts_cache.invalidate()
+    trending_posts.remove(id)
+    pin_to_primary(current_user.id)
     
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.put("/{id}", response_model=post_models.PostResponse)
-def update_post(id: int, post: post_models.Post, db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
+async def update_post(post: post_models.Post, id: int = Path(..., le=db_models.MAX_ID), db: Session = Depends(get_db), current_user: int = Depends(oauth2.get_current_user)):
     '''
     Updates a post by its 'id' from the database.
 
@@ -128,21 +371,29 @@ def update_post(id: int, post: post_models.Post, db: Session = Depends(get_db),
        Returns:
             post (PostResponse) : The updated post.
     '''
-    # SELECT * FROM posts WHERE posts.id == id
-    post_query = db.query(db_models.Post).filter(db_models.Post.id == id)
-    # Get the first entry as there cannot be duplicate post id, so stop scanning table
-    post = post_query.first()
-    
-    if post == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"post with id {id} not found")
-    
-    # A user can only update their own post, throw exception if post was not created by this user
-    if post.user_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                            detail="Not authorized to perform requested action")
+    def modify_post(db: Session):
+        # SELECT * FROM posts WHERE posts.id == id AND posts.created = (SELECT created FROM post_ids WHERE id = id)
+        post_query = db.query(db_models.Post).filter(by_id(id))
+        # Get the first entry as there cannot be duplicate post id, so stop scanning table
+        db_post = post_query.first()
         
-    post_query.update(post.dict(), synchronize_session=False)
-    db.commit()
-    db.refresh(post)
+        if db_post == None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"post with id {id} not found")
+        
+        # A user can only update their own post, throw exception if post was not created by this user
+        if db_post.user_id != current_user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                detail="Not authorized to perform requested action")
+            
+        # 'created' prunes the UPDATE to the post's partition
+        post_query.filter(db_models.Post.created == db_post.created).update(post.dict(), synchronize_session=False)
+        db.commit()
+        db.refresh(db_post)
+        
+        return post_models.PostResponse.from_orm(db_post)
+    
+    updated_post = await run(db, modify_post)
+    posts_cache.invalidate()
+    pin_to_primary(current_user.id)
     
-    return post
+    return updated_post
@@ -1,10 +1,16 @@
-from fastapi import status, HTTPException, Depends, APIRouter
+from typing import List, Optional
+
+from fastapi import status, HTTPException, Depends, APIRouter, Path, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 
-from app.models import user_models
-from app.authentication import auth_utils
-from app.persistence import db_models
-from app.persistence.database import get_db
+from app.models import post_models, user_models
+from app.authentication import auth_utils, oauth2
+from app.configuration.config import settings
+from app.persistence import db_models, pagination
+from app.persistence.database import get_db, run
+from app.persistence.posts import after_cursor, newest_first, query_post_likes
+from app.persistence.replicas import get_read_db
 
 router = APIRouter(
     prefix="/users",
@@ -12,7 +18,7 @@ router = APIRouter(
 )
 
 @router.post("/", status_code=status.HTTP_201_CREATED,response_model=user_models.UserResponse)
-def create_user(user:user_models.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user:user_models.UserCreate, db: Session = Depends(get_db)):
     '''
     Creates a new user in the database.
 
@@ -23,19 +29,22 @@ def create_user(user:user_models.UserCreate, db: Session = Depends(get_db)):
             A success or failure status
     '''
     # hash the password
-    hashed_password = auth_utils.hash(user.password)
+    hashed_password = await auth_utils.hash(user.password)
     user.password = hashed_password
     
-    new_user = db_models.User(**user.dict())
-    print(new_user)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    def add_user(db: Session):
+        new_user = db_models.User(**user.dict())
+        print(new_user)
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+        
+        return user_models.UserResponse.from_orm(new_user)
     
-    return new_user
+    return await run(db, add_user)
 
 @router.get("/{id}", response_model=user_models.UserResponse)
-def get_user(id: int, db: Session = Depends(get_db)):
+async def get_user(id: int = Path(..., le=db_models.MAX_ID), db: Session = Depends(get_read_db)):
     '''
     Fetches a user from the database.
 
@@ -45,9 +54,57 @@ def get_user(id: int, db: Session = Depends(get_db)):
         Returns:
             UserResponse: The username and id.
     '''
-    user = db.query(db_models.User).filter(db_models.User.id == id).first()
+    user = await run(db, lambda db: db.query(db_models.User).filter(db_models.User.id == id).first())
     
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail=f"User with id {id} not found")      
-    return user
\ No newline at end of file
+    return user
+
+
+@router.get("/{id}/posts", response_model=List[post_models.PostLikesResponse])
+async def get_user_posts(id: int = Path(..., le=db_models.MAX_ID), db: Session = Depends(get_read_db), current_user: int = Depends(oauth2.get_current_user),
+                         limit: int = Query(10, ge=1, le=settings.max_page_size), cursor: Optional[str] = None):
+    '''
+    Gets the posts of a user, newest first.
+
+        Parameters:
+            id (int): The user id.
+            limit (int): The page size, at most 'max_page_size'
+            cursor (str): The 'X-Next-Cursor' header of the previous page
+
+        Returns:
+            List[PostLikesResponse] : The posts with their likes and whether the current user liked them.
+                                      If the page is full, the cursor for the next page is returned in
+                                      the 'X-Next-Cursor' header
+    '''
+    if cursor:
+        try:
+            created, post_id = pagination.decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    
+    def fetch_user_posts(db: Session):
+        # SELECT posts.*, users.*, EXISTS (...) AS liked_by_me FROM posts JOIN users ON users.id = posts.user_id
+        # WHERE posts.user_id = id AND (posts.created, posts.id) < (created, post_id)
+        # ORDER BY posts.created DESC, posts.id DESC LIMIT limit
+        # Served by the ix_posts_user_id_created_id index
+        query = newest_first(query_post_likes(db, current_user.id).filter(db_models.Post.user_id == id))
+        if cursor:
+            query = after_cursor(query, created, post_id)
+        rows = query.limit(limit).all()
+        
+        # An empty first page is either a user without posts or no user at all
+        if not rows and not cursor and not db.query(db_models.User.id).filter(db_models.User.id == id).first():
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                                detail=f"User with id {id} not found")
+        return rows
+    
+    rows = await run(db, fetch_user_posts)
+    
+    # A full page means there may be more posts, hand out the position of the last one
+    headers = {}
+    if rows and len(rows) == limit:
+        headers["X-Next-Cursor"] = pagination.encode_cursor(rows[-1].created, rows[-1].id)
+    
+    return ORJSONResponse([post_models.post_likes_json(row) for row in rows], headers=headers)
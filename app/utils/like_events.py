@@ -0,0 +1,262 @@
+'''
+Live like counts (GET /like/stream): like_router and the write-behind like queue publish the
+change of every post's like count here, and the broker pushes it to the streams subscribed to
+that post. A client opens one stream for the posts on its screen instead of polling
+GET /posts/{id}, which costs a token check, a user lookup and a like count query each time.
+
+A stream starts with the absolute counts of its posts, then sends their changes. Every event has
+an id, a client reconnecting with it (EventSource sends Last-Event-ID) gets the changes it missed
+from the broker's recent publishes instead of the counts again, as long as they are still kept.
+
+Every stream has a bounded queue. A stream that does not keep up (its queue is full) is dropped
+rather than slowing down the likes or growing without bound. It ends with a 'dropped' event and
+the client reconnects without Last-Event-ID, which starts over from the counts.
+'''
+import asyncio
+import collections
+import secrets
+import time
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, Optional, Set, Tuple
+
+import orjson
+
+from app.configuration.config import settings
+
+# Sent first, tells EventSource how long to wait before reconnecting
+RECONNECT_MS = 1000
+
+
+class Subscription:
+    '''
+    The like count changes waiting to be sent on one stream.
+
+        Parameters:
+            post_ids (Iterable[int]): The posts the stream follows
+            maxsize (int): The maximum number of undelivered publishes
+            event_id (str): The id of the broker's last publish when subscribing
+    '''
+    def __init__(self, post_ids: Iterable[int], maxsize: int, event_id: str):
+        self.post_ids = frozenset(post_ids)
+        self.dropped = False
+        # True when the changes since the client's Last-Event-ID were queued, it needs no counts
+        self.replayed = False
+        # The id of the last publish taken by get, sent as the 'id:' of the events
+        self.event_id = event_id
+        self._queue = asyncio.Queue(maxsize)
+
+    def put(self, event_id: str, deltas: Dict[int, int]) -> bool:
+        '''
+        Queues the like count changes of the publish 'event_id'. Must be called on the event loop.
+
+            Returns:
+                False if the queue is full, the subscription is then dropped
+        '''
+        try:
+            self._queue.put_nowait((event_id, deltas))
+        except asyncio.QueueFull:
+            self.dropped = True
+            return False
+        return True
+
+    async def get(self, timeout: float) -> Optional[Dict[int, int]]:
+        '''
+        Waits up to 'timeout' seconds for changes, then takes everything queued.
+
+            Returns:
+                Dict[int, int]: post id -> change of its like count, summed over the queued publishes
+                                (empty when they cancel out). None once the subscription was dropped.
+        '''
+        if self.dropped:
+            return None
+        self.event_id, deltas = await asyncio.wait_for(self._queue.get(), timeout)
+        deltas = dict(deltas)
+        while not self._queue.empty():
+            self.event_id, queued = self._queue.get_nowait()
+            for post_id, delta in queued.items():
+                deltas[post_id] = deltas.get(post_id, 0) + delta
+        return {post_id: delta for post_id, delta in deltas.items() if delta}
+
+
+class LikeBroker:
+    '''
+    Pub/sub of like count changes. The default LocalLikeBroker only reaches the streams of its
+    own process. With several workers a broker shared by all of them (e.g. redis pub/sub) has to
+    implement these methods: publish sends to every worker, and each worker hands what it
+    receives to the publish of its own LocalLikeBroker.
+    '''
+    def publish(self, deltas: Dict[int, int]):
+        '''
+        Sends like count changes (post id -> +1 per like, -1 per unlike) to the subscribed streams.
+        Must be called on the event loop.
+        '''
+        raise NotImplementedError
+
+    def subscribe(self, post_ids: Iterable[int], last_event_id: Optional[str] = None) -> Subscription:
+        '''
+        Starts queueing the changes of 'post_ids' for a stream. With the 'last_event_id' of a previous
+        stream the changes published since are queued first and 'replayed' is set, if the broker
+        still has all of them.
+        '''
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocalLikeBroker(LikeBroker):
+    '''
+    In process broker. A publish costs one lookup per changed post and one queue put per
+    stream following any of them, whatever the number of streams.
+
+    Event ids are '<broker>-<publish number>'. The broker part is random per process, so an id
+    from another worker or from before a restart is not mistaken for one of this broker's.
+
+        Parameters:
+            queue_size (int): The maximum number of undelivered publishes per stream
+            history (int): The number of recent publishes kept to replay after a reconnect
+    '''
+    def __init__(self, queue_size: int, history: int):
+        self.queue_size = queue_size
+        self._subscriptions: Dict[int, Set[Subscription]] = {}  # post id -> its subscriptions
+        self._count = 0
+        self._stats = {"published": 0, "delivered": 0, "dropped": 0, "replayed": 0}
+        self._broker_id = secrets.token_hex(4)
+        self._sequence = 0
+        self._history: Deque[Tuple[int, Dict[int, int]]] = collections.deque(maxlen=history)
+
+    def event_id(self) -> str:
+        # The id of the last publish
+        return f"{self._broker_id}-{self._sequence}"
+
+    def publish(self, deltas: Dict[int, int]):
+        self._stats["published"] += 1
+        self._sequence += 1
+        self._history.append((self._sequence, deltas))
+        event_id = self.event_id()
+        per_subscription: Dict[Subscription, Dict[int, int]] = {}
+        for post_id, delta in deltas.items():
+            if delta:
+                for subscription in self._subscriptions.get(post_id, ()):
+                    per_subscription.setdefault(subscription, {})[post_id] = delta
+
+        for subscription, subscription_deltas in per_subscription.items():
+            if subscription.put(event_id, subscription_deltas):
+                self._stats["delivered"] += 1
+            else:
+                self._stats["dropped"] += 1
+                self.unsubscribe(subscription)
+
+    def subscribe(self, post_ids: Iterable[int], last_event_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(post_ids, self.queue_size, self.event_id())
+        missed = self._since(last_event_id, subscription.post_ids) if last_event_id else None
+        if missed is not None:
+            subscription.replayed = True
+            self._stats["replayed"] += 1
+            if missed:
+                subscription.put(subscription.event_id, missed)
+        for post_id in subscription.post_ids:
+            self._subscriptions.setdefault(post_id, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def _since(self, last_event_id: str, post_ids: Set[int]) -> Optional[Dict[int, int]]:
+        # The summed changes of 'post_ids' published after 'last_event_id', None when not all kept
+        broker_id, _, sequence = last_event_id.partition("-")
+        if broker_id != self._broker_id or not sequence.isdigit() or int(sequence) > self._sequence:
+            return None
+        sequence = int(sequence)
+        if sequence < self._sequence - len(self._history):
+            return None
+        missed: Dict[int, int] = {}
+        for published, deltas in self._history:
+            if published > sequence:
+                for post_id in post_ids & deltas.keys():
+                    missed[post_id] = missed.get(post_id, 0) + deltas[post_id]
+        return {post_id: delta for post_id, delta in missed.items() if delta}
+
+    def unsubscribe(self, subscription: Subscription):
+        # Called again when a dropped stream ends
+        removed = False
+        for post_id in subscription.post_ids:
+            subscriptions = self._subscriptions.get(post_id)
+            if subscriptions is not None and subscription in subscriptions:
+                subscriptions.remove(subscription)
+                removed = True
+                if not subscriptions:
+                    del self._subscriptions[post_id]
+        if removed:
+            self._count -= 1
+
+    def stats(self) -> dict:
+        return {"streams": self._count, "posts": len(self._subscriptions), **self._stats}
+
+    def clear(self):
+        self._subscriptions.clear()
+        self._count = 0
+        self._stats = dict.fromkeys(self._stats, 0)
+        self._history.clear()
+
+
+def format_event(event: str, event_id: str, data: Dict[int, int]) -> bytes:
+    return f"event: {event}\nid: {event_id}\ndata: ".encode() \
+        + orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS) + b"\n\n"
+
+
+async def event_stream(broker: LikeBroker, post_ids: Iterable[int], keepalive_seconds: float,
+                       max_seconds: float, counts: Optional[Callable[[], Awaitable[Dict[int, int]]]] = None,
+                       last_event_id: Optional[str] = None) -> AsyncIterator[bytes]:
+    '''
+    The text/event-stream body of GET /like/stream:
+
+        retry: 1000
+
+        event: counts
+        id: 3f2a91c0-41
+        data: {"12":7,"15":3}
+
+        event: likes
+        id: 3f2a91c0-44
+        data: {"12":1,"15":-2}
+
+        : keepalive
+
+    'counts' has the like count of every followed post that exists, read by 'counts' once
+    subscribed, so no change after it is missed. A like committed while the counts are read can
+    be in them and in the first 'likes' event. With a 'last_event_id' the broker still has the
+    changes after, they come as a 'likes' event instead of the counts.
+
+    Then one 'likes' event per wakeup with the summed changes since the previous one. A comment is
+    sent every 'keepalive_seconds' without changes, so proxies keep the connection open. After
+    'max_seconds' the stream ends and the client reconnects, which spreads long-lived streams over
+    restarted workers and checks the token again. A dropped stream ends with 'event: dropped'.
+    '''
+    # Subscribed here and not in the route, so a client leaving before the first byte leaks nothing
+    subscription = broker.subscribe(post_ids, last_event_id)
+    try:
+        snapshot = await counts() if counts is not None and not subscription.replayed else None
+        yield f"retry: {RECONNECT_MS}\n\n".encode()
+        if snapshot is not None:
+            yield format_event("counts", subscription.event_id, snapshot)
+        deadline = time.monotonic() + max_seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                deltas = await subscription.get(min(keepalive_seconds, remaining))
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if deltas is None:
+                yield b"event: dropped\ndata: {}\n\n"
+                return
+            if deltas:
+                yield format_event("likes", subscription.event_id, deltas)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+like_events = LocalLikeBroker(queue_size=settings.like_stream_queue_size, history=settings.like_stream_history)
@@ -0,0 +1,220 @@
+'''
+Write-behind likes (LIKE_WRITE_BEHIND=true): POST /like/ answers once the like is queued here,
+and a background task writes the queued likes in batches.
+
+A popular post otherwise gets one transaction per like, all updating its like_count row, so they
+queue up on the row lock. A batch updates each post once, however many likes it carries.
+'''
+import asyncio
+import itertools
+import logging
+import time
+from typing import Callable, Dict, Tuple
+
+from app.configuration.config import settings
+from app.persistence import database, likes
+from app.utils.like_events import like_events
+from app.utils.lru_cache import LRUCache
+from app.utils.response_cache import posts_cache
+from app.utils.trending import trending_posts
+
+logger = logging.getLogger(__name__)
+
+
+class LikeQueue:
+    '''
+    The likes waiting to be written. Per (user, post) only the last direction is kept: liking
+    and unliking before a flush writes nothing, liking twice writes one like.
+
+    The flush task is started with the first queued like and flushes when 'flush_size' likes are
+    pending or 'flush_interval' seconds after the previous flush. With 'maxsize' likes pending,
+    put refuses new ones (the request gets 503) until a flush makes room.
+
+    A batch that fails to write goes back to the front of the queue and the flush task waits
+    twice as long after every failure in a row (at most MAX_RETRY_DELAY seconds), so a database
+    restart loses nothing. Likes that failed 'retries' times are dropped and counted.
+
+        Parameters:
+            maxsize (int): The maximum number of pending likes
+            flush_size (int): The number of likes written per transaction
+            flush_interval (float): The longest a like waits to be written, in seconds
+            retries (int): The failed writes after which a like is dropped
+            open_session: Returns an async context manager with a session to write with
+    '''
+    MAX_RETRY_DELAY = 10
+
+    def __init__(self, maxsize: int, flush_size: int, flush_interval: float, retries: int,
+                 open_session: Callable = database.open_session):
+        self.maxsize = maxsize
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.open_session = open_session
+        self._pending: Dict[Tuple[int, int], int] = {}  # (user_id, post_id) -> direction
+        self._failures: Dict[Tuple[int, int], int] = {}  # (user_id, post_id) -> failed writes of it
+        self._failed_flushes = 0  # in a row, sets the retry delay
+        self._task = None
+        self._wakeup = None
+        self._flushing = None  # one flush at a time, so the changes of a (user, post) land in order
+        self._stopping = False
+        self._stats = {"queued": 0, "rejected": 0, "written": 0, "retried": 0, "dropped": 0, "flushes": 0}
+
+    def put(self, user_id: int, post_id: int, direction: int) -> bool:
+        '''
+        Queues a like (direction 1) or unlike (direction 0). Must be called on the event loop.
+
+            Returns:
+                False if the queue is full
+        '''
+        key = (user_id, post_id)
+        if key not in self._pending and len(self._pending) >= self.maxsize:
+            self._stats["rejected"] += 1
+            return False
+
+        self._pending[key] = direction
+        self._stats["queued"] += 1
+        if self._task is None:
+            # Created here, on the loop that serves the requests
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        # A full batch does not cut a retry delay short
+        if len(self._pending) >= self.flush_size and not self._failed_flushes:
+            self._wakeup.set()
+        return True
+
+    def retry_delay(self) -> float:
+        # flush_interval after a successful flush, doubled with every failed one in a row
+        return min(self.flush_interval * 2 ** self._failed_flushes, self.MAX_RETRY_DELAY)
+
+    async def _run(self):
+        while not self._stopping:
+            # The task must outlive any error, put only starts it once. A failed write is handled
+            # by the flush, this catches the rest (e.g. the trending, cache or stream updates).
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.retry_delay())
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+            except Exception:
+                logger.exception("like queue flush task failed")
+
+    async def flush(self) -> bool:
+        '''
+        Writes everything pending, 'flush_size' likes per transaction. Stops at the first batch
+        that fails, which is queued again (see the class docstring).
+
+            Returns:
+                False if a batch failed
+        '''
+        if self._flushing is None:
+            self._flushing = asyncio.Lock()
+        async with self._flushing:
+            return await self._flush()
+
+    async def _flush(self) -> bool:
+        while self._pending:
+            # The oldest first, dicts keep insertion order
+            keys = list(itertools.islice(self._pending, self.flush_size))
+            batch = {key: self._pending.pop(key) for key in keys}
+            start = time.perf_counter()
+            try:
+                async with self.open_session() as db:
+                    added, removed = await database.run(db, _write, batch)
+            except Exception:
+                logger.exception("writing %d queued likes failed", len(batch))
+                self._requeue(batch)
+                return False
+
+            self._failed_flushes = 0
+            for key in batch:
+                self._failures.pop(key, None)
+            self._stats["written"] += len(batch)
+            self._stats["flushes"] += 1
+            for post_id, created in added:
+                trending_posts.add(post_id, created)
+            for post_id, created in removed:
+                trending_posts.add(post_id, created, count=-1)
+            if added or removed:
+                deltas = {}
+                for post_id, _ in added:
+                    deltas[post_id] = deltas.get(post_id, 0) + 1
+                for post_id, _ in removed:
+                    deltas[post_id] = deltas.get(post_id, 0) - 1
+                # The feed pages holding the posts show their like counts
+                posts_cache.invalidate_posts(deltas)
+                like_events.publish(deltas)
+            logger.debug("wrote %d queued likes in %.3f s", len(batch), time.perf_counter() - start)
+        return True
+
+    def _requeue(self, batch: Dict[Tuple[int, int], int]):
+        # Back in front of the likes queued meanwhile. A like changed meanwhile keeps its new direction.
+        self._failed_flushes += 1
+        retry, dropped = {}, 0
+        for key, direction in batch.items():
+            if key in self._pending:
+                self._failures.pop(key, None)
+                continue
+            failures = self._failures[key] = self._failures.get(key, 0) + 1
+            if failures < self.retries:
+                retry[key] = direction
+            else:
+                del self._failures[key]
+                dropped += 1
+        self._pending = {**retry, **self._pending}
+        self._stats["retried"] += len(retry)
+        self._stats["dropped"] += dropped
+        if dropped:
+            logger.error("dropped %d queued likes after %d failed writes", dropped, self.retries)
+
+    async def stop(self):
+        # Called by the app's lifespan on shutdown: lets a running flush finish, then writes the rest
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        # Every failure counts towards 'retries', so this ends
+        while not await self.flush():
+            await asyncio.sleep(self.retry_delay())
+        # The next app may run on another event loop
+        self._flushing = None
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), **self._stats}
+
+    def render_metrics(self) -> str:
+        '''
+        The stats in the Prometheus text exposition format, for GET /metrics.
+        '''
+        lines = ["# HELP like_queue_pending Likes waiting to be written", "# TYPE like_queue_pending gauge",
+                 f"like_queue_pending {len(self._pending)}"]
+        for name, description in (
+                ("written", "Queued likes written"),
+                ("retried", "Queued likes queued again after a failed write"),
+                ("dropped", "Queued likes dropped after repeated failed writes")):
+            lines += [f"# HELP like_queue_{name}_total {description}", f"# TYPE like_queue_{name}_total counter",
+                      f"like_queue_{name}_total {self._stats[name]}"]
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        self._pending.clear()
+        self._failures.clear()
+        self._failed_flushes = 0
+        self._stats = dict.fromkeys(self._stats, 0)
+
+
+def _write(db, batch):
+    result = likes.write_likes(db, batch)
+    db.commit()
+    return result
+
+
+like_queue = LikeQueue(maxsize=settings.like_queue_size, flush_size=settings.like_flush_size,
+                       flush_interval=settings.like_flush_interval_ms / 1000, retries=settings.like_flush_retries)
+
+# Posts known to exist, so queueing a like on a popular post needs no database round trip.
+# A post deleted meanwhile is skipped by the flush.
+known_posts = LRUCache(maxsize=settings.like_known_posts_size, ttl=settings.like_known_posts_ttl_seconds)
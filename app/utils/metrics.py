@@ -0,0 +1,205 @@
+import bisect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.configuration.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the request latency histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestStats:
+    '''
+    What one request spent on the database. Lives in a ContextVar, which run_in_threadpool
+    and AsyncSession.run_sync carry over to the code running the session work.
+    '''
+    __slots__ = ("scope", "statements", "db_seconds", "pool_wait_seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+_route_paths = {}  # endpoint -> path template
+
+def route_of(scope) -> str:
+    '''
+    The path template of the route that handled the request ('/posts/{id}'), so metrics
+    don't get one series per post id. Requests that matched no route are 'unmatched'.
+    '''
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        path = next((route.path for route in scope["router"].routes if getattr(route, "endpoint", None) is endpoint),
+                    "unmatched")
+        _route_paths[endpoint] = path
+    return path
+
+
+class RouteMetrics:
+    __slots__ = ("requests", "latency_buckets", "latency_sum", "statements", "db_seconds", "pool_wait_seconds")
+
+    def __init__(self):
+        self.requests = {}  # status code -> count
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # the last one is +Inf
+        self.latency_sum = 0.0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+
+class Metrics:
+    '''
+    Per (method, route) counters of the requests served by this process.
+    '''
+    def __init__(self):
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, method: str, route: str, status_code: int, seconds: float, stats: RequestStats):
+        with self._lock:
+            metrics = self.routes.get((method, route))
+            if metrics is None:
+                metrics = self.routes[(method, route)] = RouteMetrics()
+            metrics.requests[status_code] = metrics.requests.get(status_code, 0) + 1
+            metrics.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            metrics.latency_sum += seconds
+            metrics.statements += stats.statements
+            metrics.db_seconds += stats.db_seconds
+            metrics.pool_wait_seconds += stats.pool_wait_seconds
+
+    def clear(self):
+        with self._lock:
+            self.routes.clear()
+
+    def render(self) -> str:
+        '''
+        The counters in the Prometheus text exposition format.
+        '''
+        lines = [
+            "# HELP http_requests_total Requests served, by route template and status code",
+            "# TYPE http_requests_total counter",
+        ]
+        with self._lock:
+            routes = sorted(self.routes.items())
+            for (method, route), metrics in routes:
+                for status_code, count in sorted(metrics.requests.items()):
+                    lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status_code}"}} {count}')
+
+            lines += ["# HELP http_request_duration_seconds Request latency",
+                      "# TYPE http_request_duration_seconds histogram"]
+            for (method, route), metrics in routes:
+                labels = f'method="{method}",route="{route}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), metrics.latency_buckets):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {metrics.latency_sum:.6f}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+            for name, attribute, description in (
+                    ("db_statements_total", "statements", "SQL statements executed"),
+                    ("db_seconds_total", "db_seconds", "Time spent executing SQL statements"),
+                    ("db_pool_wait_seconds_total", "pool_wait_seconds", "Time spent waiting for a pooled connection")):
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+                for (method, route), metrics in routes:
+                    value = getattr(metrics, attribute)
+                    lines.append(f'{name}{{method="{method}",route="{route}"}} '
+                                 f'{value if isinstance(value, int) else f"{value:.6f}"}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def record_pool_wait(seconds: float):
+    # Called by TimedPoolMixin for every connection checkout
+    stats = current_request.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+
+# SQLAlchemy hooks, registered on the Engine class so they cover the primary, the replicas
+# and the sync engine behind AsyncEngine alike
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # A connection runs one statement at a time
+    conn.info["query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    record_statement(conn, statement, parameters)
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    # A failed statement never reaches after_cursor_execute, it took database time all the same
+    if context.connection is not None:
+        record_statement(context.connection, context.statement, context.parameters)
+
+
+def record_statement(conn, statement, parameters):
+    start = conn.info.pop("query_start", None)
+    if start is None:
+        return
+    seconds = time.perf_counter() - start
+    stats = current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += seconds
+
+    if settings.slow_query_ms and seconds * 1000 >= settings.slow_query_ms:
+        # Parameters hold user data such as password hashes, only logged when asked for
+        logger.warning("slow query (%.1f ms) on %s: %s%s", seconds * 1000,
+                       route_of(stats.scope) if stats is not None else "-", statement,
+                       f" parameters={parameters!r}" if settings.slow_query_log_parameters else "")
+
+
+class MetricsMiddleware:
+    '''
+    Times every HTTP request and records it, with the SQL statements, database time and pool
+    wait time it caused, in 'metrics' under its route template.
+
+        Parameters:
+            app (ASGIApp): The wrapped application
+    '''
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            metrics.record(scope["method"], route_of(scope), status_code, time.perf_counter() - start, stats)
@@ -0,0 +1,173 @@
+import functools
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+
+
+class Limit(NamedTuple):
+    per_minute: float
+    burst: int
+
+
+class RateLimitBackend:
+    '''
+    Token bucket store of the RateLimitMiddleware. The default LRURateLimitBackend lives in the
+    process, a backend shared by all workers (e.g. redis) only has to implement these methods.
+    '''
+    def take(self, key: Hashable, limit: Limit) -> float:
+        '''
+        Takes one token from the bucket of 'key'.
+
+            Returns:
+                float: 0 if the request is allowed, else the seconds until a token is available
+        '''
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRURateLimitBackend(RateLimitBackend):
+    '''
+    In process token buckets for at most 'maxsize' keys. When full, the bucket of the least
+    recently seen key is dropped (that client starts over with a full bucket).
+
+        Parameters:
+            maxsize (int): The maximum number of buckets
+    '''
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key: Hashable, limit: Limit) -> float:
+        now = time.monotonic()
+        rate = limit.per_minute / 60
+
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit.burst, now))
+            # Refill for the time since the last request, up to the burst size
+            tokens = min(limit.burst, tokens + (now - updated_at) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def route_group(method: str, path: str) -> Tuple[str, Limit]:
+    '''
+    The route group a request belongs to and its limit.
+    '''
+    if path == "/login":
+        return "login", Limit(settings.rate_limit_login_per_minute, settings.rate_limit_login_burst)
+    if method in ("POST", "PUT", "PATCH", "DELETE"):
+        return "write", Limit(settings.rate_limit_write_per_minute, settings.rate_limit_write_burst)
+    return "read", Limit(settings.rate_limit_read_per_minute, settings.rate_limit_read_burst)
+
+
+def client_key(scope) -> str:
+    '''
+    Authenticated requests are limited per user id, all others per client IP.
+    '''
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    # Memoized in oauth2.token_cache, so the route's own check is free afterwards
+                    return f"user:{oauth2.verify_access_token(token, HTTPException(status.HTTP_401_UNAUTHORIZED)).id}"
+                except HTTPException:
+                    pass
+            break
+    return f"ip:{client_ip(scope)}"
+
+
+def client_ip(scope) -> str:
+    '''
+    The address of the client. Behind reverse proxies listed in 'trusted_proxies' it is the
+    right-most X-Forwarded-For address that is not one of them: the addresses left of it were
+    sent by the client and can be anything.
+    '''
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    forwarded = next((value.decode("latin-1") for name, value in scope["headers"]
+                      if name == b"x-forwarded-for"), None)
+    if forwarded is None or not is_trusted_proxy(peer):
+        return peer
+    for address in reversed(forwarded.split(",")):
+        address = address.strip()
+        if address and not is_trusted_proxy(address):
+            return address
+    return peer
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _trusted_networks(tuple(settings.trusted_proxies)))
+
+
+@functools.lru_cache(maxsize=4)
+def _trusted_networks(proxies: Tuple[str, ...]):
+    return [ipaddress.ip_network(proxy, strict=False) for proxy in proxies]
+
+
+class RateLimitMiddleware:
+    '''
+    Token bucket rate limiting per route group (login, write, read) and client.
+    Requests over the limit get 429 with Retry-After. One bucket lookup per request.
+
+        Parameters:
+            app (ASGIApp): The wrapped application
+            backend (RateLimitBackend): Where the buckets are kept
+    '''
+    def __init__(self, app, backend: RateLimitBackend):
+        self.app = app
+        self.backend = backend
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.rate_limit_enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        group, limit = route_group(scope["method"], scope["path"])
+        # A limit of 0 per minute turns the group's limiting off
+        if limit.per_minute > 0:
+            wait = self.backend.take((group, client_key(scope)), limit)
+            if wait:
+                response = JSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                        headers={"Retry-After": str(math.ceil(wait))},
+                                        content={"detail": "Too many requests, try again later"})
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
+
+
+rate_limit_backend = LRURateLimitBackend(maxsize=settings.rate_limit_max_keys)
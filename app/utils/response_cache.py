@@ -0,0 +1,192 @@
+import hashlib
+import json
+from typing import Any, Dict, Hashable, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+import orjson
+from fastapi import Response, status
+from fastapi.encoders import jsonable_encoder
+
+from app.configuration.config import settings
+from .lru_cache import LRUCache
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    # The posts in the body and the write sequence when its data was read, see ResponseCache.get
+    post_ids: Tuple[int, ...] = ()
+    since: int = 0
+    # The offsets of the closing braces of the objects of a JSON array body, see ResponseCache.overlay
+    item_ends: Tuple[int, ...] = ()
+
+
+class CacheBackend:
+    '''
+    Storage of a ResponseCache. The default LRUCacheBackend lives in the process, a
+    backend shared by all workers (e.g. redis) only has to implement these methods.
+    '''
+    def get(self, key: str) -> Optional[CachedResponse]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: CachedResponse):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class LRUCacheBackend(CacheBackend):
+    '''
+    In process backend, bounded to 'maxsize' responses that expire after 'ttl' seconds.
+    '''
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: CachedResponse):
+        self.cache.set(key, value)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self.cache), "hits": self.cache.hits, "misses": self.cache.misses,
+                "evictions": self.cache.evictions}
+
+
+class ResponseCache:
+    '''
+    Caches serialized JSON responses, so a hit costs neither a query nor a pydantic
+    serialization. Every response carries an ETag, a matching If-None-Match gets a 304.
+
+    invalidate() drops all entries. Keys include a generation number that invalidate()
+    bumps, so a response computed from data read before a write is never served after it.
+
+    invalidate_posts() only makes the responses holding the written posts stale: it records the
+    write sequence of each post, and get() skips a response with a post written after its data
+    was read ('since', taken before reading). The records live as long as the responses, when
+    more than 'written_posts' posts are written within that time the oldest records are
+    forgotten and their responses may be served until they expire.
+
+        Parameters:
+            backend (CacheBackend): Where the responses are stored
+            written_posts (int): The maximum number of post writes recorded
+            ttl (float): The time to live of the responses in seconds (None = never expire)
+    '''
+    def __init__(self, backend: CacheBackend, written_posts: int, ttl: Optional[float] = None):
+        self.backend = backend
+        self.generation = 0
+        self.sequence = 0
+        self.not_modified = 0
+        self.stale = 0
+        self._written = LRUCache(maxsize=written_posts, ttl=ttl)  # post id -> sequence of its last write
+
+    def key(self, *parts: Hashable) -> str:
+        '''
+        Builds the cache key of a request from the parameters its response depends on.
+        Take the key before reading the data of the response.
+        '''
+        return f"{self.generation}:{json.dumps(parts, default=str)}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        cached = self.backend.get(key)
+        if cached is not None and any(self._written.get(post_id, 0) > cached.since for post_id in cached.post_ids):
+            self.stale += 1
+            return None
+        return cached
+
+    def set(self, key: str, content: Any, headers: Optional[Dict[str, str]] = None,
+            post_ids: Iterable[int] = (), since: int = 0) -> CachedResponse:
+        '''
+        Serializes 'content' with orjson (same output as FastAPI's JSONResponse) and stores it under 'key'.
+        Anything orjson doesn't know natively, like pydantic models, goes through jsonable_encoder.
+
+            Parameters:
+                post_ids (Iterable[int]): The posts in 'content', invalidate_posts of any drops it
+                since (int): 'sequence' before the data of 'content' was read
+
+            Returns:
+                CachedResponse: The serialized response
+        '''
+        item_ends = ()
+        if isinstance(content, list) and all(isinstance(item, dict) and item for item in content):
+            items = [orjson.dumps(item, default=jsonable_encoder) for item in content]
+            body = b"[" + b",".join(items) + b"]"
+            ends, end = [], 0
+            for item in items:
+                end += len(item) + 1
+                ends.append(end - 1)
+            item_ends = tuple(ends)
+        else:
+            body = orjson.dumps(content, default=jsonable_encoder)
+        cached = CachedResponse(body=body, etag=etag(body), headers=headers or {}, post_ids=tuple(post_ids),
+                                since=since, item_ends=item_ends)
+        self.backend.set(key, cached)
+        return cached
+
+    def overlay(self, cached: CachedResponse, name: str, values: Sequence[Any]) -> CachedResponse:
+        '''
+        Adds the key 'name' to every object of a cached JSON array, the i-th gets values[i]. For the
+        parts of a response that differ per request while the rest is shared. Not stored.
+
+            Returns:
+                CachedResponse: The response with its own body and ETag
+        '''
+        parts, start = [], 0
+        name = orjson.dumps(name)
+        for end, value in zip(cached.item_ends, values):
+            parts += [cached.body[start:end], b",", name, b":", orjson.dumps(value, default=jsonable_encoder)]
+            start = end
+        parts.append(cached.body[start:])
+        body = b"".join(parts)
+        return cached._replace(body=body, etag=etag(body), item_ends=())
+
+    def invalidate(self):
+        self.generation += 1
+        self.backend.clear()
+
+    def invalidate_posts(self, post_ids: Iterable[int]):
+        '''
+        Makes the responses holding any of 'post_ids' stale, the others are still served.
+        '''
+        self.sequence += 1
+        for post_id in post_ids:
+            self._written.set(post_id, self.sequence)
+
+    def respond(self, cached: CachedResponse, if_none_match: Optional[str]) -> Response:
+        '''
+        Builds the response for a cached body, or a 304 if the client already has it.
+
+            Parameters:
+                cached (CachedResponse): The cached response
+                if_none_match (str): The If-None-Match request header
+
+            Returns:
+                Response: 200 with the body, or 304 Not Modified
+        '''
+        headers = {**cached.headers, "ETag": cached.etag}
+        if if_none_match and (if_none_match.strip() == "*" or
+                              cached.etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))):
+            self.not_modified += 1
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=cached.body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        return {**self.backend.stats(), "not_modified": self.not_modified, "stale": self.stale}
+
+
+def etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+# GET /posts, invalidated by every post write of this process, and for the pages holding the
+# liked posts by every like
+posts_cache = ResponseCache(LRUCacheBackend(maxsize=settings.response_cache_size,
+                                            ttl=settings.response_cache_ttl_seconds),
+                            written_posts=100_000, ttl=settings.response_cache_ttl_seconds)
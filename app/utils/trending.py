@@ -0,0 +1,163 @@
+'''
+The "trending posts" ranking of GET /posts/trending: the top posts by time-decayed like score,
+kept in process, updated by like_router on every like and unlike and rebuilt periodically
+from the likes table.
+
+Scores use forward decay. A like made at time t is worth 2^((t - t0) / half_life), so new likes
+weigh more instead of every score shrinking as time passes. At any moment all decayed scores
+share the factor 2^(-(now - t0) / half_life), so the order of the stored scores is the order of
+the decayed ones and nothing has to be updated when no one likes anything. t0 is the start of
+the window and moves forward with every reconcile, which keeps the weights small.
+'''
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.configuration.config import settings
+from app.persistence import database, likes
+
+logger = logging.getLogger(__name__)
+
+
+class TrendingRanking:
+    '''
+    Time-decayed like scores of the posts liked within the window, and the ids of the 'size'
+    highest, kept sorted so reads are O(size).
+
+    An unlike only re-sorts the top, so a post outside it that now outranks the unliked post
+    moves in with its next like or at the next reconcile.
+
+        Parameters:
+            size (int): The number of posts kept ranked
+            half_life_seconds (float): The time after which a like counts half
+    '''
+    def __init__(self, size: int, half_life_seconds: float):
+        self.size = size
+        self.half_life_seconds = half_life_seconds
+        self.t0 = time.time()
+        self._scores = {}  # post id -> score
+        self._top = []  # post ids, highest score first
+        self._pending = None  # changes made while a reconcile runs, replayed onto its result
+        self._lock = threading.Lock()
+
+    def weight(self, at: float) -> float:
+        # Likes before t0 are outside the window. Every counted like weighs at least 1.
+        return 2 ** ((at - self.t0) / self.half_life_seconds)
+
+    def add(self, post_id: int, at: datetime, count: int = 1):
+        '''
+        Counts a like (count=1) or an unlike (count=-1) of the like made at 'at'.
+        '''
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._apply, post_id, at.timestamp(), count))
+            self._apply(post_id, at.timestamp(), count)
+
+    def _apply(self, post_id: int, at: float, count: int):
+        if at < self.t0:
+            return
+        score = self._scores.get(post_id, 0.0) + count * self.weight(at)
+        if score < 0.5:
+            # No like left, what remains is float rounding
+            self._scores.pop(post_id, None)
+            if post_id in self._top:
+                self._top.remove(post_id)
+            return
+
+        self._scores[post_id] = score
+        if post_id not in self._top:
+            if len(self._top) >= self.size and score <= self._scores[self._top[-1]]:
+                return
+            self._top.append(post_id)
+        # The list is sorted but for one id, which timsort fixes in O(size)
+        self._top.sort(key=self._scores.__getitem__, reverse=True)
+        del self._top[self.size:]
+
+    def remove(self, post_id: int):
+        # The post was deleted. A reconcile running meanwhile may still have read its likes.
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((self._remove, post_id))
+            self._remove(post_id)
+
+    def _remove(self, post_id: int):
+        self._scores.pop(post_id, None)
+        if post_id in self._top:
+            self._top.remove(post_id)
+
+    def top(self, limit: int) -> List[int]:
+        '''
+        The ids of the 'limit' (at most 'size') highest ranked posts, highest first.
+        '''
+        with self._lock:
+            return self._top[:limit]
+
+    def start_reconcile(self):
+        # Changes from here on are replayed onto the scores finish_reconcile gets
+        with self._lock:
+            self._pending = []
+
+    def finish_reconcile(self, scores: Optional[Dict[int, float]], t0: float):
+        '''
+        Replaces the scores with 'scores' computed from the likes table for 't0', or keeps
+        the current ones when the reconcile failed (scores=None) or the ranking was cleared since.
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, None
+            if scores is None or pending is None:
+                return
+            self.t0 = t0
+            self._scores = scores
+            self._top = heapq.nlargest(self.size, scores, key=scores.__getitem__)
+            for change, *args in pending:
+                change(*args)
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+            self._top.clear()
+            self._pending = None
+            self.t0 = time.time()
+
+    def __len__(self):
+        return len(self._scores)
+
+
+trending_posts = TrendingRanking(size=settings.trending_size,
+                                 half_life_seconds=settings.trending_half_life_hours * 3600)
+
+
+async def reconcile(db, ranking: TrendingRanking = trending_posts):
+    '''
+    Rebuilds 'ranking' from the likes of the last 'trending_window_hours'. Picks up the likes
+    made through other workers and drops the ones that left the window.
+
+        Parameters:
+            db (Session | AsyncSession): The session to read the likes with
+            ranking (TrendingRanking): The ranking to rebuild
+    '''
+    t0 = time.time() - settings.trending_window_hours * 3600
+    ranking.start_reconcile()
+    scores = None
+    try:
+        scores = await database.run(db, likes.decayed_like_scores, t0, ranking.half_life_seconds)
+    finally:
+        ranking.finish_reconcile(scores, t0)
+
+
+async def reconcile_periodically(interval: float):
+    # Started by the app's lifespan, first right away to fill the ranking
+    while True:
+        start = time.perf_counter()
+        try:
+            async with database.open_session() as db:
+                await reconcile(db)
+            logger.info("trending ranking reconciled in %.3f s, %d posts", time.perf_counter() - start,
+                        len(trending_posts))
+        except Exception:
+            logger.exception("trending ranking reconcile failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,114 @@
+'''
+Benchmark: sync (psycopg2 + threadpool) vs async (asyncpg + AsyncSession) persistence.
+
+Seeds a throwaway database, then starts uvicorn once per mode ('DATABASE_ASYNC=false/true')
+and drives the read endpoints at a fixed concurrency, reporting requests/sec and latency percentiles.
+
+    python -m benchmarks.bench_async --concurrency 128 --duration 10
+
+The database named by --database must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import create_engine
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+from benchmarks.bench_pagination import seed
+
+# The relevance search ranks every post matching 'title', a query slow enough for requests to queue for
+# threads and connections
+PATHS = ["/posts/?limit=10", "/posts/?search=title&order=relevance&limit=10", "/posts/1", "/users/1"]
+
+
+async def drive(base_url: str, paths, headers: dict, concurrency: int, duration: float):
+    '''
+    Sends requests from 'concurrency' workers round-robin over 'paths' for 'duration' seconds.
+
+        Returns:
+            (latencies, errors): latency of every successful request in ms, number of failed requests
+    '''
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=30) as client:
+        async def worker(offset: int):
+            nonlocal errors
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                res = await client.get(paths[i % len(paths)])
+                if res.status_code == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+                i += 1
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+    return latencies, errors
+
+
+def percentile(values, p: float) -> float:
+    return statistics.quantiles(values, n=100)[int(p) - 1] if len(values) > 1 else values[0]
+
+
+def run_server(database: str, database_async: bool, port: int, **settings_env: str):
+    # One benchmark client would hit the per user rate limits
+    env = {**os.environ, "DATABASE_NAME": database, "DATABASE_ASYNC": str(database_async).lower(),
+           "RATE_LIMIT_ENABLED": "false", **settings_env}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                               "--log-level", "warning"], env=env)
+
+    # Wait for the server to accept requests
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("uvicorn did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--posts", type=int, default=10000)
+    # Above the 40 threadpool threads and the 15 pooled connections, see the note in database.run
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    seed(create_engine(f'postgresql://{settings.database_username}:{settings.database_password}@'
+                       f'{settings.database_hostname}:{settings.database_port}/{args.database}'), args.posts)
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': 1})}"}
+
+    print(f"{'mode':>6} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+    for database_async in (False, True):
+        # Every request reaches the database
+        server = run_server(args.database, database_async, args.port, RESPONSE_CACHE_SIZE="0")
+        try:
+            # Warm up connections and caches before measuring
+            asyncio.run(drive(f"http://127.0.0.1:{args.port}", PATHS, headers, args.concurrency, 1))
+            latencies, errors = asyncio.run(drive(f"http://127.0.0.1:{args.port}", PATHS, headers,
+                                                  args.concurrency, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+
+        print(f"{'async' if database_async else 'sync':>6} {len(latencies) / args.duration:>10.1f} "
+              f"{percentile(latencies, 50):>10.2f} {percentile(latencies, 99):>10.2f} {errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+'''
+Benchmark: single item vs batch endpoints for creating posts and liking posts.
+
+Seeds a throwaway database, starts uvicorn and sends --items posts and --items likes,
+once one item per request (POST /posts/, POST /like/) and once --batch-size items per
+request (POST /posts/batch, POST /like/batch), from --concurrency clients. Reports items/sec.
+
+    python -m benchmarks.bench_batch --items 2000 --batch-size 100
+
+The database named by --database must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import time
+
+import httpx
+from sqlalchemy import create_engine
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+from benchmarks.bench_async import run_server
+from benchmarks.bench_pagination import seed
+
+
+async def send(base_url: str, headers: dict, requests, concurrency: int) -> float:
+    '''
+    Sends the (path, json) requests from 'concurrency' workers.
+
+        Returns:
+            float: The elapsed time in seconds
+    '''
+    queue = list(reversed(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        async def worker():
+            while queue:
+                path, body = queue.pop()
+                res = await client.post(path, json=body)
+                if res.status_code not in (200, 201):
+                    raise RuntimeError(f"{path} returned {res.status_code}: {res.text}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+def chunks(items, size: int):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    # Every like goes to a different post, half of them through each endpoint
+    seed(create_engine(f'postgresql://{settings.database_username}:{settings.database_password}@'
+                       f'{settings.database_hostname}:{settings.database_port}/{args.database}'), 2 * args.items)
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': 1})}"}
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    posts = [{"title": f"title {i}", "content": f"content {i}"} for i in range(args.items)]
+    single_likes = [{"post_id": i, "direction": 1} for i in range(1, args.items + 1)]
+    batch_likes = [{"post_id": i, "direction": 1} for i in range(args.items + 1, 2 * args.items + 1)]
+    runs = [
+        ("posts", [("/posts/", post) for post in posts],
+                  [("/posts/batch", batch) for batch in chunks(posts, args.batch_size)]),
+        ("likes", [("/like/", like) for like in single_likes],
+                  [("/like/batch", batch) for batch in chunks(batch_likes, args.batch_size)]),
+    ]
+
+    server = run_server(args.database, False, args.port)
+    try:
+        # Warm up connections and the user cache
+        asyncio.run(send(base_url, headers, [("/posts/batch", posts[:1])] * args.concurrency, args.concurrency))
+
+        print(f"{'items':>6} {'single items/s':>15} {'batch items/s':>15} {'speedup':>8}")
+        for name, single_requests, batch_requests in runs:
+            single_seconds = asyncio.run(send(base_url, headers, single_requests, args.concurrency))
+            batch_seconds = asyncio.run(send(base_url, headers, batch_requests, args.concurrency))
+            print(f"{name:>6} {args.items / single_seconds:>15.1f} {args.items / batch_seconds:>15.1f} "
+                  f"{single_seconds / batch_seconds:>7.1f}x")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+'''
+Load test of every endpoint of post_router, like_router, user_router and auth_router.
+
+Seeds a throwaway database with --users users, --posts posts and --likes likes (generated in
+postgres, so millions of rows take seconds to minutes), starts uvicorn against it and drives
+each scenario at --concurrency for --duration seconds. Reports req/s and p50/p95/p99 latency
+and saves them as JSON, so two runs can be compared:
+
+    GET /posts/           the same page again and again, served by the response cache
+    ... uncached          run against a second server with RESPONSE_CACHE_SIZE=0, the query path
+    GET /like/stream      the time until the stream's 'counts' event, then it is closed
+
+    python -m benchmarks.bench_endpoints --output before.json
+    ... change something ...
+    python -m benchmarks.bench_endpoints --no-seed --output after.json --compare before.json
+
+Everything runs on the local machine, the only server needed is the local postgres of .env
+(the app relies on postgres features such as tsvector and ON CONFLICT, so SQLite can't stand in).
+The database named by --database must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from app.authentication import auth_utils, oauth2
+from app.configuration.config import settings
+from app.persistence.database import Base
+from benchmarks.bench_async import percentile, run_server
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "password123"
+
+# The environment of the server of the uncached scenarios
+UNCACHED = {"RESPONSE_CACHE_SIZE": "0"}
+
+
+def seed(engine, users: int, posts: int, likes: int, own_posts: int):
+    '''
+    Fills the database. Users 1..users are the crowd, user users + 1 is the benchmark client:
+    it owns 'own_posts' posts and has no likes.
+    '''
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, email, password) "
+                          "SELECT g, 'user' || g || '@example.com', 'x' FROM generate_series(1, :users) g"),
+                     {"users": users})
+        conn.execute(text("INSERT INTO users (id, email, password) VALUES (:id, :email, :password)"),
+                     {"id": users + 1, "email": BENCH_EMAIL, "password": auth_utils.pwd_context.hash(BENCH_PASSWORD)})
+        conn.execute(text("SELECT setval('users_id_seq', :id)"), {"id": users + 1})
+
+        # The benchmark user's posts come first, so their ids are 1..own_posts
+        conn.execute(text('''
+            INSERT INTO posts (title, content, user_id, created)
+            SELECT 'title ' || g, 'content of post ' || g || ' about ' || (ARRAY['python', 'postgres', 'fastapi', 'cats'])[1 + g % 4],
+                   CASE WHEN g <= :own_posts THEN :bench_user ELSE 1 + g % :users END,
+                   now() - (:total - g) * interval '1 second'
+            FROM generate_series(1, :total) g
+        '''), {"own_posts": own_posts, "bench_user": users + 1, "users": users, "total": own_posts + posts})
+
+        # Distinct (user, post) pairs, spread over all posts
+        conn.execute(text('''
+            INSERT INTO likes (user_id, post_id)
+            SELECT 1 + g % :users, 1 + (g / :users) % :total FROM generate_series(0, :likes - 1) g
+            ON CONFLICT DO NOTHING
+        '''), {"users": users, "total": own_posts + posts, "likes": likes})
+        conn.execute(text('''
+            UPDATE posts SET like_count = counts.likes
+            FROM (SELECT post_id, count(*) AS likes FROM likes GROUP BY post_id) counts
+            WHERE posts.id = counts.post_id
+        '''))
+        conn.exec_driver_sql("ANALYZE")
+
+
+def scenarios(users: int, own_posts: int, batch_size: int):
+    '''
+    Every scenario is (name, expected statuses, request factory, server environment). The factory
+    turns the running request number into (method, path, json body), method STREAM opens
+    a text/event-stream and closes it after the first event. Scenarios with the same
+    environment share a server.
+    '''
+    bench_user = users + 1
+    # The first half of the benchmark user's posts is read/updated, the second half deleted
+    half = own_posts // 2
+    # The seeded posts are one second apart, the export reads the last ten minutes' worth
+    export_since = quote((datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat())
+
+    return [
+        ("GET /posts/", {200}, lambda i: ("GET", "/posts/?limit=10", None), {}),
+        ("GET /posts/ uncached", {200}, lambda i: ("GET", "/posts/?limit=10", None), UNCACHED),
+        ("GET /posts/ deep", {200}, lambda i: ("GET", f"/posts/?limit=10&skip={i % 1000 * 10}", None), UNCACHED),
+        ("GET /posts/ search", {200},
+         lambda i: ("GET", f"/posts/?limit=10&search={['python', 'postgres', 'fastapi', 'cats'][i % 4]}", None),
+         UNCACHED),
+        ("GET /posts/{id}", {200}, lambda i: ("GET", f"/posts/{1 + i % half}", None), {}),
+        ("GET /posts/trending", {200}, lambda i: ("GET", "/posts/trending?limit=10", None), {}),
+        ("GET /posts/export", {200}, lambda i: ("GET", f"/posts/export?since={export_since}", None), {}),
+        ("GET /users/{id}/posts", {200}, lambda i: ("GET", f"/users/{1 + i % bench_user}/posts?limit=10", None), {}),
+        ("POST /posts/", {201}, lambda i: ("POST", "/posts/", {"title": f"new {i}", "content": "content"}), {}),
+        ("POST /posts/batch", {201},
+         lambda i: ("POST", "/posts/batch", [{"title": f"new {i} {j}", "content": "content"} for j in range(batch_size)]), {}),
+        ("PUT /posts/{id}", {200},
+         lambda i: ("PUT", f"/posts/{1 + i % half}", {"title": f"edited {i}", "content": "content"}), {}),
+        # Past the benchmark user's posts deletes get 403
+        ("DELETE /posts/{id}", {204, 403}, lambda i: ("DELETE", f"/posts/{half + 1 + i}", None), {}),
+        # Like then unlike the same posts, requests past the seeded posts get 404
+        ("POST /like/ like", {201, 404, 409}, lambda i: ("POST", "/like/", {"post_id": 1 + i, "direction": 1}), {}),
+        ("POST /like/ unlike", {201, 404}, lambda i: ("POST", "/like/", {"post_id": 1 + i, "direction": 0}), {}),
+        ("POST /like/batch", {200},
+         lambda i: ("POST", "/like/batch", [{"post_id": 1 + i * batch_size + j, "direction": 1} for j in range(batch_size)]), {}),
+        ("GET /users/{id}", {200}, lambda i: ("GET", f"/users/{1 + i % bench_user}", None), {}),
+        # Following the page of a client, the stream is counted as open at its 'counts' event
+        ("GET /like/stream", {200},
+         lambda i: ("STREAM", "/like/stream?" + "&".join(f"post_ids={1 + (i * 10 + j) % half}" for j in range(10)), None),
+         {}),
+        # bcrypt bound, requests beyond the hashing queue get 503
+        ("POST /users/", {201, 503},
+         lambda i: ("POST", "/users/", {"email": f"new{i}-{time.time_ns()}@example.com", "password": "password123"}), {}),
+        ("POST /login", {200, 503},
+         lambda i: ("POST", "/login", {"username": BENCH_EMAIL, "password": BENCH_PASSWORD}), {}),
+    ]
+
+
+async def drive(base_url: str, headers: dict, make_request, expected, concurrency: int, duration: float):
+    '''
+    Sends the requests of 'make_request' from 'concurrency' workers for 'duration' seconds.
+
+        Returns:
+            (latencies, errors): latency in ms of every request with an expected status, number of others
+    '''
+    latencies, errors = [], 0
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                method, path, body = make_request(next(counter))
+                start = time.perf_counter()
+                if path == "/login":
+                    res = await client.post(path, data=body)
+                elif method == "STREAM":
+                    async with client.stream("GET", path) as res:
+                        async for line in res.aiter_lines():
+                            if res.status_code != 200 or line.startswith("data: "):
+                                break
+                else:
+                    res = await client.request(method, path, json=body)
+                if res.status_code in expected:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return latencies, errors
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_results(results: dict, baseline: dict):
+    print(f"{'scenario':<22} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+          + (f" {'req/s vs base':>14} {'p99 vs base':>12}" if baseline else ""))
+    for name, result in results.items():
+        line = (f"{name:<22} {result['requests_per_second']:>9.1f} {result['p50_ms']:>8.2f} "
+                f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['errors']:>7}")
+        base = baseline.get(name)
+        if base and base["requests_per_second"] and base["p99_ms"]:
+            line += (f" {(result['requests_per_second'] / base['requests_per_second'] - 1) * 100:>+13.1f}%"
+                     f" {(result['p99_ms'] / base['p99_ms'] - 1) * 100:>+11.1f}%")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--likes", type=int, default=1000000)
+    parser.add_argument("--own-posts", type=int, default=20000, help="posts of the benchmark user (read/update/delete)")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data from a previous run")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5, help="seconds per scenario")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--async-db", action="store_true", help="run the server with DATABASE_ASYNC=true")
+    parser.add_argument("--only", help="run only the scenarios whose name contains this")
+    parser.add_argument("--port", type=int, default=8765, help="and the next one for the uncached server")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare against")
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        start = time.perf_counter()
+        seed(create_engine(f'postgresql://{settings.database_username}:{settings.database_password}@'
+                           f'{settings.database_hostname}:{settings.database_port}/{args.database}'),
+             args.users, args.posts, args.likes, args.own_posts)
+        print(f"seeded {args.users} users, {args.posts + args.own_posts} posts, {args.likes} likes "
+              f"in {time.perf_counter() - start:.1f} s")
+
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': args.users + 1})}"}
+    results = {}
+
+    servers = {}  # server environment -> (server, base url)
+    try:
+        for name, expected, make_request, env in scenarios(args.users, args.own_posts, args.batch_size):
+            if args.only and args.only not in name:
+                continue
+            key = tuple(sorted(env.items()))
+            if key not in servers:
+                port = args.port + len(servers)
+                servers[key] = (run_server(args.database, args.async_db, port, **env), f"http://127.0.0.1:{port}")
+            latencies, errors = asyncio.run(drive(servers[key][1], headers, make_request, expected,
+                                                  args.concurrency, args.duration))
+            requests = len(latencies)
+            latencies = latencies or [0.0]
+            results[name] = {
+                "requests": requests,
+                "requests_per_second": round(requests / args.duration, 1),
+                "p50_ms": round(percentile(latencies, 50), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+                "errors": errors,
+            }
+    finally:
+        for server, _ in servers.values():
+            server.terminate()
+            server.wait()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        run = {
+            "revision": git_revision(),
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "results": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(run, file, indent=2)
+        print(f"saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''
+Benchmark: pulling the whole posts table through GET /posts pages vs the GET /posts/export stream.
+
+    offset   GET /posts/?limit=&skip=   pages until an empty one
+    cursor   GET /posts/?limit=         following X-Next-Cursor
+    export   GET /posts/export          one NDJSON stream (and again with gzip)
+
+Each mode runs against a fresh uvicorn process, so its peak resident memory (VmHWM) is the
+memory that mode needed on top of the idle server.
+
+    python -m benchmarks.bench_export --posts 200000
+
+The database named by --database must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import time
+
+import httpx
+from sqlalchemy import create_engine
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+from benchmarks.bench_async import run_server
+from benchmarks.bench_pagination import seed
+
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def pull_pages(client: httpx.Client, limit: int, keyset: bool) -> int:
+    posts, skip, cursor = 0, 0, None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {"skip": skip})}
+        page = client.get("/posts/", params=params)
+        page.raise_for_status()
+        posts += len(page.json())
+        skip += limit
+        cursor = page.headers.get("X-Next-Cursor")
+        if not page.json() or (keyset and not cursor):
+            return posts
+
+
+def pull_export(client: httpx.Client, compressed: bool) -> int:
+    posts = 0
+    headers = {"Accept-Encoding": "gzip" if compressed else "identity"}
+    with client.stream("GET", "/posts/export", headers=headers) as res:
+        res.raise_for_status()
+        # Counting newlines keeps the client from being the bottleneck
+        for chunk in res.iter_bytes():
+            posts += chunk.count(b"\n")
+    return posts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--posts", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=100, help="page size of the offset and cursor modes")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data from a previous run")
+    parser.add_argument("--async-db", action="store_true", help="run the server with DATABASE_ASYNC=true")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if not args.no_seed:
+        seed(create_engine(f'postgresql://{settings.database_username}:{settings.database_password}@'
+                           f'{settings.database_hostname}:{settings.database_port}/{args.database}'), args.posts)
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': 1})}"}
+
+    modes = {
+        "offset": lambda client: pull_pages(client, args.limit, keyset=False),
+        "cursor": lambda client: pull_pages(client, args.limit, keyset=True),
+        "export": lambda client: pull_export(client, compressed=False),
+        "export gzip": lambda client: pull_export(client, compressed=True),
+    }
+
+    print(f"{'mode':<12} {'posts':>9} {'seconds':>9} {'posts/s':>10} {'idle MB':>9} {'peak MB':>9}")
+    for name, pull in modes.items():
+        server = run_server(args.database, args.async_db, args.port)
+        try:
+            idle_mb = peak_rss_mb(server.pid)
+            with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", headers=headers, timeout=None) as client:
+                start = time.perf_counter()
+                posts = pull(client)
+                seconds = time.perf_counter() - start
+            print(f"{name:<12} {posts:>9} {seconds:>9.2f} {posts / seconds:>10.0f} {idle_mb:>9.1f}"
+                  f" {peak_rss_mb(server.pid):>9.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
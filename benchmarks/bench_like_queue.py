@@ -0,0 +1,97 @@
+'''
+Benchmark: likes/sec on a single hot post, written per request vs through the write-behind queue.
+
+    sync           LIKE_WRITE_BEHIND=false   one transaction per like, all updating the post's row
+    write-behind   LIKE_WRITE_BEHIND=true    POST /like/ answers 202, app/utils/like_queue.py
+                                             writes the queued likes in batches
+
+Every worker owns its own users and has them like and unlike the post in turns, so no request
+conflicts with an earlier one. The write-behind run is followed by a check that the post's
+like_count matches its likes once the server has shut down (which flushes the queue).
+
+    python -m benchmarks.bench_like_queue --users 2000 --concurrency 64
+
+The database named by --database must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import time
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+from benchmarks.bench_async import percentile, run_server
+from benchmarks.bench_pagination import seed
+
+
+async def drive(base_url: str, users: int, concurrency: int, duration: float):
+    '''
+    Likes and unlikes post 1 from 'concurrency' workers for 'duration' seconds.
+
+        Returns:
+            (latencies, errors): latency of every accepted like in ms, number of refused likes
+    '''
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    tokens = {user_id: f"Bearer {oauth2.create_access_token({'user_id': user_id})}"
+              for user_id in range(1, users + 1)}
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def worker(offset: int):
+            nonlocal errors
+            own_users = range(1 + offset, users + 1, concurrency)
+            i = 0
+            while time.perf_counter() < deadline:
+                # Like on the first pass over the users, unlike on the second and so on
+                user_id, direction = own_users[i % len(own_users)], 1 - i // len(own_users) % 2
+                start = time.perf_counter()
+                res = await client.post("/like/", json={"post_id": 1, "direction": direction},
+                                        headers={"Authorization": tokens[user_id]})
+                if res.status_code in (201, 202):
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+                i += 1
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--async-db", action="store_true", help="run the server with DATABASE_ASYNC=true")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    engine = create_engine(f'postgresql://{settings.database_username}:{settings.database_password}@'
+                           f'{settings.database_hostname}:{settings.database_port}/{args.database}')
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    print(f"{'mode':<13} {'likes/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8} {'count ok':>9}")
+    for write_behind in (False, True):
+        seed(engine, posts=1, users=args.users)
+        server = run_server(args.database, args.async_db, args.port, LIKE_WRITE_BEHIND=str(write_behind).lower())
+        try:
+            latencies, errors = asyncio.run(drive(base_url, args.users, args.concurrency, args.duration))
+        finally:
+            # Shutting down flushes the queue
+            server.terminate()
+            server.wait()
+
+        with engine.connect() as conn:
+            count_ok = conn.execute(text(
+                "SELECT like_count = (SELECT count(*) FROM likes WHERE post_id = 1) FROM posts WHERE id = 1")).scalar()
+        print(f"{'write-behind' if write_behind else 'sync':<13} {len(latencies) / args.duration:>10.1f} "
+              f"{percentile(latencies, 50):>10.2f} {percentile(latencies, 99):>10.2f} {errors:>8} {str(count_ok):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+'''
+Benchmark: keeping like counts current by polling GET /posts/{id} vs one GET /like/stream per client.
+
+    poll     every client fetches its post every --interval seconds (token check, user lookup and
+             post query per request)
+    stream   every client holds one Server-Sent Events stream for its post (utils/like_events.py)
+
+Meanwhile likes arrive on the clients' posts at --like-rate per second. Reported are the requests
+per second the server answered for the clients, the server process' CPU use, and how long after
+a like its client saw the new count.
+
+    python -m benchmarks.bench_like_stream --clients 200 --interval 2
+
+The database named by --database must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+import orjson
+from sqlalchemy import create_engine
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+from benchmarks.bench_async import percentile, run_server
+from benchmarks.bench_pagination import seed
+
+
+def cpu_seconds(pid: int) -> float:
+    # utime + stime of the process, Linux only
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def like_posts(client, posts: int, users: int, rate: float, deadline: float, liked_at: dict,
+                     ready: asyncio.Event):
+    # Every like comes from a new user, so none is refused. liked_at: post id -> times of its likes
+    await ready.wait()
+    i = 0
+    while time.perf_counter() < deadline:
+        post_id, user_id = 1 + i % posts, 1 + i // posts % users
+        token = oauth2.create_access_token({"user_id": user_id})
+        start = time.perf_counter()
+        res = await client.post("/like/", json={"post_id": post_id, "direction": 1},
+                                headers={"Authorization": f"Bearer {token}"})
+        if res.status_code == 201:
+            liked_at.setdefault(post_id, []).append(start)
+        i += 1
+        await asyncio.sleep(max(0.0, start + 1 / rate - time.perf_counter()))
+
+
+async def poll(client, post_id: int, headers: dict, interval: float, deadline: float, seen: list,
+               connected) -> int:
+    # Returns the number of requests, 'seen' gets the time every new count was first seen
+    requests, likes = 0, 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        res = await client.get(f"/posts/{post_id}", headers=headers)
+        requests += 1
+        count = res.json()["likes"]
+        if count > likes:
+            seen.extend([time.perf_counter()] * (count - likes))
+        if requests == 1:
+            connected()
+        likes = count
+        await asyncio.sleep(max(0.0, start + interval - time.perf_counter()))
+    return requests
+
+
+async def stream(client, post_id: int, headers: dict, deadline: float, seen: list, connected) -> int:
+    try:
+        async with client.stream("GET", "/like/stream", params={"post_ids": post_id}, headers=headers) as res:
+            event = None
+            async for line in res.aiter_lines():
+                line = line.rstrip("\r\n")
+                if line.startswith("event: "):
+                    event = line[7:]
+                if line.startswith("data: ") and event == "counts":
+                    connected()
+                if line.startswith("data: ") and event == "likes":
+                    seen.extend([time.perf_counter()] * orjson.loads(line[6:]).get(str(post_id), 0))
+                if time.perf_counter() >= deadline:
+                    break
+    except httpx.ReadTimeout:
+        pass
+    return 1
+
+
+async def drive(base_url: str, mode: str, clients: int, users: int, interval: float, like_rate: float,
+                duration: float):
+    '''
+    Returns (client requests, likes, delays): the requests the clients made, the likes made and, per
+    like seen by its client, the seconds until it was.
+    '''
+    deadline = time.perf_counter() + duration
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': 1})}"}
+    limits = httpx.Limits(max_connections=clients + 1, max_keepalive_connections=clients + 1)
+    liked_at, seen = {}, {post_id: [] for post_id in range(1, clients + 1)}
+    # The likes start once every client polled or subscribed
+    ready, waiting = asyncio.Event(), [clients]
+
+    def connected():
+        waiting[0] -= 1
+        if not waiting[0]:
+            ready.set()
+
+    # The streams only end at the deadline when something arrives, the keepalives wake them up
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=5) as client:
+        if mode == "poll":
+            watchers = [poll(client, post_id, headers, interval, deadline, seen[post_id], connected)
+                        for post_id in seen]
+        else:
+            watchers = [stream(client, post_id, headers, deadline, seen[post_id], connected) for post_id in seen]
+        *requests, _ = await asyncio.gather(*watchers, like_posts(client, clients, users, like_rate, deadline,
+                                                                  liked_at, ready))
+
+    delays = [seen_at - at for post_id, times in liked_at.items() for at, seen_at in zip(times, seen[post_id])]
+    return sum(requests), sum(map(len, liked_at.values())), delays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--clients", type=int, default=200, help="one post per client")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=2, help="seconds between two polls of a client")
+    parser.add_argument("--like-rate", type=float, default=20, help="likes per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    engine = create_engine(f'postgresql://{settings.database_username}:{settings.database_password}@'
+                           f'{settings.database_hostname}:{settings.database_port}/{args.database}')
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    print(f"{'mode':<7} {'req/s':>8} {'cpu %':>7} {'likes':>6} {'seen':>6} {'p50 delay ms':>13} {'p99 delay ms':>13}")
+    for mode in ("poll", "stream"):
+        seed(engine, posts=args.clients, users=args.users)
+        server = run_server(args.database, False, args.port, LIKE_STREAM_KEEPALIVE_SECONDS="1")
+        try:
+            cpu = cpu_seconds(server.pid)
+            requests, likes, delays = asyncio.run(drive(base_url, mode, args.clients, args.users,
+                                                        args.interval, args.like_rate, args.duration))
+            cpu = cpu_seconds(server.pid) - cpu
+        finally:
+            server.terminate()
+            server.wait()
+
+        delays_ms = [delay * 1000 for delay in delays] or [0.0]
+        print(f"{mode:<7} {requests / args.duration:>8.1f} {cpu / args.duration * 100:>7.1f} {likes:>6} "
+              f"{len(delays):>6} {percentile(delays_ms, 50):>13.1f} {percentile(delays_ms, 99):>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+'''
+Benchmark: which partitions of posts and likes the app's queries read, and how long they take.
+
+Seeds posts spread over --months months (one partition each) and likes on them, then runs
+EXPLAIN ANALYZE on the statements of the routers and reports, per statement, the partitions
+the plan reads out of those that exist and the execution time.
+
+    feed first page      GET /posts                      ordered append, newest month first
+    feed deep page       GET /posts?cursor=              months after the cursor pruned
+    export since         GET /posts/export?since=        months before 'since' pruned
+    post by id only      posts.id = id                   no 'created', one index probe per month
+    post by id           GET /posts/{id}                 'created' from post_ids, the post's month only
+    delete by id+created DELETE /posts/{id}              the post's month only
+    likes of a post      likes WHERE post_id =           one hash partition
+    like / unlike        POST /like/                     one likes partition
+
+Partitions the plan lists but never executes (ordered append stopping at the LIMIT, runtime
+pruning of the liked_by_me probe and of the post_ids lookups) are counted as 'never executed'.
+
+    python -m benchmarks.bench_partitions --posts 1000000 --months 24
+
+The database in --url must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, delete, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+from app.persistence import db_models, likes, partitions, posts
+from app.persistence.database import Base
+from .bench_pagination import BENCH_USER, DEFAULT_URL
+
+
+def seed(engine, users: int, post_count: int, like_count: int, months: int):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    today = datetime.now(timezone.utc).date()
+
+    with engine.begin() as conn:
+        # create_all starts the months at this one, start them 'months' earlier
+        first = partitions.month_start(today, -months + 1)
+        conn.execute(text("DROP TABLE posts_history"))
+        conn.execute(text(f"CREATE TABLE posts_history PARTITION OF posts "
+                          f"FOR VALUES FROM (MINVALUE) TO ('{first} 00:00:00+00')"))
+        partitions.create_post_partitions(conn, first, today)
+        conn.execute(text("SELECT setseed(0.42)"))
+        conn.execute(text("INSERT INTO users (id, email, password) "
+                          "SELECT g, 'user' || g || '@example.com', 'x' FROM generate_series(1, :users) g"),
+                     {"users": users})
+        # Evenly spread over the months, oldest first so ids grow with 'created'
+        conn.execute(text('''
+            INSERT INTO posts (title, content, user_id, created)
+            SELECT 'title ' || g, 'content ' || g, 1 + g % :users,
+                   date_trunc('month', now()) - (:months - 1) * interval '1 month'
+                   + (now() - (date_trunc('month', now()) - (:months - 1) * interval '1 month')) * g / :posts
+            FROM generate_series(1, :posts) g
+        '''), {"users": users, "posts": post_count, "months": months})
+        conn.execute(text('''
+            INSERT INTO likes (user_id, post_id)
+            SELECT 1 + g % :users, 1 + floor(random() * :posts)::int FROM generate_series(1, :likes) g
+            ON CONFLICT DO NOTHING
+        '''), {"users": users, "posts": post_count, "likes": like_count})
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM ANALYZE")
+
+
+def explain(db, statement):
+    '''
+    Returns (partitions read, partitions never executed, execution ms) of 'statement', run
+    in a transaction that is rolled back. Partitions are counted per table.
+    '''
+    compiled = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"render_postcompile": True})
+    plan = db.connection().exec_driver_sql(f"EXPLAIN (ANALYZE, FORMAT JSON) {compiled}", compiled.params).scalar()
+    db.rollback()
+
+    read, skipped, nodes = set(), set(), [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        relation = node.get("Relation Name")
+        if relation and relation not in ("posts", "likes", "users") and "Scan" in node["Node Type"]:
+            (read if node.get("Actual Loops") else skipped).add(relation)
+        nodes.extend(node.get("Plans", []))
+    skipped -= read
+
+    def per_table(names):
+        return {table: sum(name.startswith(f"{table}_") for name in names) for table in ("posts", "likes")}
+    return per_table(read), per_table(skipped), plan[0]["Execution Time"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--likes", type=int, default=2000000)
+    parser.add_argument("--months", type=int, default=24, help="the posts are spread over this many months")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data from a previous run")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if not args.no_seed:
+        seed(engine, args.users, args.posts, args.likes, args.months)
+    db = sessionmaker(bind=engine)()
+
+    post_partitions, like_partitions = (
+        db.execute(text(f"SELECT count(*) FROM pg_inherits WHERE inhparent = '{table}'::regclass")).scalar()
+        for table in ("posts", "likes"))
+    # A post from the middle of the range
+    middle = db.execute(select(db_models.Post.id, db_models.Post.created).where(db_models.Post.id == args.posts // 2)).one()
+    feed = posts.newest_first(posts.query_post_likes(db, BENCH_USER.id))
+
+    statements = {
+        "feed first page": feed.limit(10).statement,
+        "feed deep page": posts.after_cursor(feed, middle.created, middle.id).limit(10).statement,
+        "export since": posts.select_posts_export(middle.created),
+        "post by id only": posts.query_post_likes(db, BENCH_USER.id).filter(db_models.Post.id == middle.id).statement,
+        "post by id": posts.query_post_likes(db, BENCH_USER.id).filter(posts.by_id(middle.id)).statement,
+        "delete by id+created": delete(db_models.Post).where(db_models.Post.id == middle.id,
+                                                             db_models.Post.created == middle.created),
+        "likes of a post": select(db_models.Like.user_id).where(db_models.Like.post_id == middle.id),
+        "like": likes.add_like_statement(middle.id, BENCH_USER.id),
+        "unlike": likes.remove_like_statement(middle.id, BENCH_USER.id),
+    }
+
+    print(f"{args.posts} posts in {post_partitions} partitions, likes in {like_partitions} partitions")
+    print("partitions read / listed in the plan but never executed")
+    print(f"{'statement':<22} {'posts':>10} {'likes':>10} {'ms':>9}")
+    for name, statement in statements.items():
+        read, skipped, ms = explain(db, statement)
+        print(f"{name:<22} " + " ".join(f"{f'{read[table]}/{skipped[table]}':>10}" for table in ("posts", "likes"))
+              + f" {ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
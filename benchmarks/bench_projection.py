@@ -0,0 +1,92 @@
+'''
+Benchmark: GET /posts with all fields vs a listing projection, on posts with large bodies.
+
+    full      get_posts()                                     every column, the whole content
+    listing   get_posts(fields="id,title,excerpt,likes")      four columns, left(content, 200)
+    no body   get_posts(fields="id,title,likes")              the content is not read at all
+
+Reports the median latency of a page (response cache off) and its payload size.
+
+    python -m benchmarks.bench_projection --posts 20000 --content-kb 20
+
+The database in --url must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.persistence.database import Base
+from app.routers import post_router
+from app.utils.response_cache import posts_cache
+from .bench_pagination import BENCH_USER, DEFAULT_URL
+
+MODES = {"full": None, "listing": "id,title,excerpt,likes", "no body": "id,title,likes"}
+
+
+def seed(engine, posts: int, content_kb: int, users: int = 100):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, email, password) "
+                          "SELECT g, 'user' || g || '@example.com', 'x' FROM generate_series(1, :users) g"),
+                     {"users": users})
+        # md5 hex compresses poorly, like real text that has been through pglz. 33 bytes per md5 + space.
+        conn.execute(text('''
+            INSERT INTO posts (title, content, user_id)
+            SELECT 'title ' || g,
+                   -- 'WHERE g > 0' makes the subquery run per row
+                   (SELECT string_agg(md5(random()::text), ' ') FROM generate_series(1, :chunks) WHERE g > 0),
+                   1 + g % :users
+            FROM generate_series(1, :posts) g
+        '''), {"users": users, "posts": posts, "chunks": content_kb * 1024 // 33})
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM ANALYZE")
+
+
+def time_page(db, repeat: int, **params):
+    '''
+    Returns the median latency in milliseconds of get_posts with the given params, and the
+    size of its response body in bytes.
+    '''
+    async def sample():
+        posts_cache.invalidate()
+        start = time.perf_counter()
+        res = await post_router.get_posts(db=db, current_user=BENCH_USER, if_none_match=None, search="",
+                                          skip=0, cursor=None, **params)
+        return (time.perf_counter() - start) * 1000, len(res.body)
+
+    samples = []
+    for _ in range(repeat):
+        samples.append(asyncio.run(sample()))
+        db.rollback()
+    return statistics.median(ms for ms, _ in samples), samples[0][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--content-kb", type=int, default=20, help="size of each post's content")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data from a previous run")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if not args.no_seed:
+        seed(engine, args.posts, args.content_kb)
+    db = sessionmaker(bind=engine)()
+
+    print(f"{'limit':>6} {'mode':<8} {'ms':>9} {'bytes':>10}")
+    for limit in (10, 50, 100):
+        for name, fields in MODES.items():
+            ms, size = time_page(db, args.repeat, limit=limit, fields=fields)
+            print(f"{limit:>6} {name:<8} {ms:>9.2f} {size:>10}")
+
+
+if __name__ == "__main__":
+    main()
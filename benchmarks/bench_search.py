@@ -0,0 +1,117 @@
+'''
+Benchmark: LIKE '%term%' vs full text search (tsvector + GIN) for GET /posts?search=.
+
+Seeds a throwaway database with generated posts (words follow a skewed distribution so
+there are common, medium and rare terms), then times one page of results per search term:
+
+    like     title LIKE '%term%' OR content LIKE '%term%'  (sequential scan)
+    recent   get_posts(search=term), full text search newest first
+    ranked   get_posts(search=term, order=relevance)
+
+    python -m benchmarks.bench_search --posts 1000000
+
+The database named by --database must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, or_, text
+from sqlalchemy.orm import sessionmaker
+
+from app.configuration.config import settings
+from app.models.auth_models import CurrentUser
+from app.persistence import db_models
+from app.persistence.database import Base
+from app.routers import post_router
+from app.utils.response_cache import posts_cache
+
+BENCH_USER = CurrentUser(id=1, email="user1@example.com")
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "ta", "vo", "sel", "dun", "pri", "zo", "gal", "ne", "fo", "tri", "bek"]
+
+
+def vocabulary(size: int):
+    rng = random.Random(0)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def seed(engine, posts: int, words):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, email, password) "
+                          "SELECT g, 'user' || g || '@example.com', 'x' FROM generate_series(1, 100) g"))
+        # power(random(), 3) skews towards the first words of the vocabulary. 'i' ties string_agg
+        # to the inner generate_series, otherwise postgres aggregates at the outer query level.
+        conn.execute(text('''
+            INSERT INTO posts (title, content, user_id, created)
+            SELECT
+                (SELECT string_agg(w[1 + i * 0 + floor(power(random(), 3) * array_length(w, 1))::int], ' ')
+                 FROM generate_series(1, 4 + g % 2) i),
+                (SELECT string_agg(w[1 + i * 0 + floor(power(random(), 3) * array_length(w, 1))::int], ' ')
+                 FROM generate_series(1, 40 + g % 2) i),
+                1 + g % 100,
+                now() - g * interval '1 second'
+            FROM generate_series(1, :posts) g, (SELECT CAST(:words AS text[]) AS w) vocabulary
+        '''), {"posts": posts, "words": words})
+        conn.exec_driver_sql("ANALYZE")
+
+
+def median_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--words", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data from a previous run")
+    args = parser.parse_args()
+
+    engine = create_engine(f'postgresql://{settings.database_username}:{settings.database_password}@'
+                           f'{settings.database_hostname}:{settings.database_port}/{args.database}')
+    words = vocabulary(args.words)
+    if not args.no_seed:
+        start = time.perf_counter()
+        seed(engine, args.posts, words)
+        print(f"seeded {args.posts} posts in {time.perf_counter() - start:.1f} s")
+    db = sessionmaker(bind=engine)()
+
+    def like(term):
+        db.query(db_models.Post)\
+          .filter(or_(db_models.Post.title.contains(term), db_models.Post.content.contains(term)))\
+          .order_by(db_models.Post.created.desc(), db_models.Post.id.desc()).limit(10).all()
+        db.rollback()
+
+    def search(term, order):
+        # Measure the query, not the response cache
+        posts_cache.invalidate()
+        asyncio.run(post_router.get_posts(db=db, current_user=BENCH_USER, if_none_match=None, limit=10, skip=0,
+                                          search=term, cursor=None, order=order))
+        db.rollback()
+
+    print(f"{'term':>14} {'matches':>9} {'like ms':>10} {'recent ms':>10} {'ranked ms':>10}")
+    for label, term in [("common", words[0]), ("medium", words[len(words) // 20]), ("rare", words[-1])]:
+        matches = db.execute(text("SELECT count(*) FROM posts WHERE search_vector @@ websearch_to_tsquery('english', :term)"),
+                             {"term": term}).scalar()
+        print(f"{label + ' ' + term:>14} {matches:>9} {median_ms(lambda: like(term), args.repeat):>10.1f} "
+              f"{median_ms(lambda: search(term, 'recent'), args.repeat):>10.1f} "
+              f"{median_ms(lambda: search(term, 'relevance'), args.repeat):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+'''
+Benchmark: pydantic response_model vs the orjson fast path for a page of GET /posts.
+
+    pydantic  ORM rows -> PostLikesResponse.from_orm -> FastAPI serialize_response
+              (re-validation against List[PostLikesResponse], jsonable_encoder) -> JSONResponse
+    orjson    column rows -> post_models.post_likes_json -> ORJSONResponse
+
+Both produce the same bytes. Times are the median per page, with and without the query.
+
+    python -m benchmarks.bench_serialization --posts 10000
+
+The database in --url must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import post_models
+from app.persistence import db_models
+from app.persistence.posts import query_post_likes
+from .bench_pagination import DEFAULT_URL, seed
+
+RESPONSE_FIELD = create_response_field(name="Response_get_posts", type_=List[post_models.PostLikesResponse])
+
+
+def query_orm(db, limit: int):
+    return db.query(db_models.Post, db_models.Post.like_count.label("likes"))\
+             .order_by(db_models.Post.created.desc(), db_models.Post.id.desc()).limit(limit).all()
+
+
+def query_columns(db, limit: int):
+    # User 0 liked nothing, matching the liked_by_me default of the pydantic path
+    return query_post_likes(db, 0)\
+             .order_by(db_models.Post.created.desc(), db_models.Post.id.desc()).limit(limit).all()
+
+
+def encode_pydantic(rows) -> bytes:
+    content = [post_models.PostLikesResponse.from_orm(row) for row in rows]
+    return JSONResponse(asyncio.run(serialize_response(field=RESPONSE_FIELD, response_content=content))).body
+
+
+def encode_orjson(rows) -> bytes:
+    return ORJSONResponse([post_models.post_likes_json(row) for row in rows]).body
+
+
+def median_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data from a previous run")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if not args.no_seed:
+        seed(engine, args.posts)
+    db = sessionmaker(bind=engine)()
+
+    print(f"{'limit':>6} {'pydantic ms':>12} {'orjson ms':>10} {'speedup':>8}"
+          f" {'+query pydantic':>16} {'+query orjson':>14} {'speedup':>8}")
+    for limit in (10, 100, 1000):
+        orm_rows, column_rows = query_orm(db, limit), query_columns(db, limit)
+        assert encode_pydantic(orm_rows) == encode_orjson(column_rows)
+
+        def pydantic_path():
+            encode_pydantic(query_orm(db, limit))
+            # Drop the identity map, like a new request session would
+            db.expunge_all()
+
+        pydantic_ms = median_ms(lambda: encode_pydantic(orm_rows), args.repeat)
+        orjson_ms = median_ms(lambda: encode_orjson(column_rows), args.repeat)
+        pydantic_total_ms = median_ms(pydantic_path, args.repeat)
+        orjson_total_ms = median_ms(lambda: encode_orjson(query_columns(db, limit)), args.repeat)
+        print(f"{limit:>6} {pydantic_ms:>12.2f} {orjson_ms:>10.2f} {pydantic_ms / orjson_ms:>7.1f}x"
+              f" {pydantic_total_ms:>16.2f} {orjson_total_ms:>14.2f} {pydantic_total_ms / orjson_total_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+'''
+Benchmark: cold start of the app.
+
+    import      seconds to import app.main in a fresh interpreter
+    first /     seconds from starting uvicorn until it answers GET /
+    first read  seconds from starting uvicorn until GET /posts/ returns 200 (one DB round trip)
+
+Each is the median of --repeat runs. --database-port points the app at a port where no postgres
+listens, to see how a worker behaves while the database is unreachable.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --database-port 1
+
+The database named by --database must already have its tables (alembic upgrade head).
+'''
+import argparse
+import math
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+
+
+def server_env(database: str, database_port: str) -> dict:
+    return {**os.environ, "DATABASE_NAME": database, "DATABASE_PORT": database_port, "RATE_LIMIT_ENABLED": "false"}
+
+
+def import_seconds(env: dict) -> float:
+    '''
+    Returns the import time of app.main, or nan if the import failed.
+    '''
+    result = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], env=env, capture_output=True, text=True)
+    return float(result.stdout) if result.returncode == 0 else float("nan")
+
+
+def first_request_seconds(env: dict, port: int, path: str, headers: dict, timeout: float) -> float:
+    '''
+    Starts uvicorn and polls 'path' until it returns 200.
+
+        Returns:
+            float: Seconds from process start to the first 200, nan if uvicorn exited or 'timeout' passed
+    '''
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                               "--log-level", "critical"], env=env, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout and server.poll() is None:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}{path}", headers=headers, timeout=timeout).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            time.sleep(0.01)
+        return float("nan")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{settings.database_name}_bench")
+    parser.add_argument("--database-port", default=settings.database_port)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for the first response")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    env = server_env(args.database, args.database_port)
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': 1})}"}
+    measurements = {
+        "import": lambda: import_seconds(env),
+        "first /": lambda: first_request_seconds(env, args.port, "/", {}, args.timeout),
+        "first read": lambda: first_request_seconds(env, args.port, "/posts/?limit=10", headers, args.timeout),
+    }
+
+    print(f"{'':<12} {'median s':>9} {'min s':>9} {'max s':>9} {'failed':>7}")
+    for name, measure in measurements.items():
+        samples = [measure() for _ in range(args.repeat)]
+        succeeded = [seconds for seconds in samples if not math.isnan(seconds)] or [math.nan]
+        print(f"{name:<12} {statistics.median(succeeded):>9.3f} {min(succeeded):>9.3f} {max(succeeded):>9.3f}"
+              f" {sum(math.isnan(seconds) for seconds in samples):>7}")
+
+
+if __name__ == "__main__":
+    main()
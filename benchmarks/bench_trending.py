@@ -0,0 +1,142 @@
+'''
+Benchmark: GET /posts/trending from the precomputed ranking vs ranking the likes on every request.
+
+    aggregate   the decayed score of every post liked in the window, computed by postgres per
+                request (SELECT ... GROUP BY post_id ORDER BY score DESC LIMIT k), then the posts
+    ranking     post_router.get_trending_posts: k ids from utils/trending.py, then the posts
+
+Also times a full reconcile (what every worker runs each 'trending_reconcile_seconds') and the
+in-memory update done for every like.
+
+    python -m benchmarks.bench_trending --likes 3000000
+
+The database in --url must already exist. Its tables are dropped and re-created.
+'''
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, desc, text
+from sqlalchemy.orm import sessionmaker
+
+from app.configuration.config import settings
+from app.models import post_models
+from app.persistence import db_models, likes
+from app.persistence.database import Base
+from app.persistence.posts import query_post_likes
+from app.routers import post_router
+from app.utils import trending
+from .bench_pagination import BENCH_USER, DEFAULT_URL
+
+
+def seed(engine, users: int, posts: int, like_count: int, days: float):
+    '''
+    Likes are spread over the last 'days' days, most of them on a few posts.
+    '''
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT setseed(0.42)"))
+        conn.execute(text("INSERT INTO users (id, email, password) "
+                          "SELECT g, 'user' || g || '@example.com', 'x' FROM generate_series(1, :users) g"),
+                     {"users": users})
+        conn.execute(text("INSERT INTO posts (title, content, user_id) "
+                          "SELECT 'title ' || g, 'content ' || g, 1 + g % :users FROM generate_series(1, :posts) g"),
+                     {"users": users, "posts": posts})
+        conn.execute(text('''
+            INSERT INTO likes (user_id, post_id, created)
+            SELECT 1 + g % :users, 1 + floor(:posts * power(random(), 4))::int,
+                   now() - random() * :days * interval '1 day'
+            FROM generate_series(1, :likes) g
+            ON CONFLICT DO NOTHING
+        '''), {"users": users, "posts": posts, "likes": like_count, "days": days})
+        conn.execute(text('''
+            UPDATE posts SET like_count = counts.likes
+            FROM (SELECT post_id, count(*) AS likes FROM likes GROUP BY post_id) counts
+            WHERE posts.id = counts.post_id
+        '''))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # Sets the visibility map, like autovacuum would, for index only scans
+        conn.exec_driver_sql("VACUUM ANALYZE")
+
+
+def aggregate_trending(db, limit: int, half_life_seconds: float):
+    t0 = time.time() - settings.trending_window_hours * 3600
+    scores = likes.decayed_like_scores_statement(t0, half_life_seconds).subquery()
+    top = db.execute(scores.select().order_by(desc(scores.c[1])).limit(limit)).all()
+    post_ids = [row.post_id for row in top]
+    rows = {row.id: row for row in query_post_likes(db, BENCH_USER.id).filter(db_models.Post.id.in_(post_ids))}
+    return [post_models.post_likes_json(rows[post_id]) for post_id in post_ids]
+
+
+def median_ms(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--likes", type=int, default=3000000)
+    parser.add_argument("--days", type=float, default=14, help="the likes are spread over this many days")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data from a previous run")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    if not args.no_seed:
+        start = time.perf_counter()
+        seed(engine, args.users, args.posts, args.likes, args.days)
+        print(f"seeded {args.likes} likes over {args.days} days in {time.perf_counter() - start:.1f} s")
+    db = sessionmaker(bind=engine)()
+    ranking = trending.trending_posts
+
+    start = time.perf_counter()
+    asyncio.run(trending.reconcile(db, ranking))
+    reconcile_ms = (time.perf_counter() - start) * 1000
+    db.rollback()
+
+    def ranked():
+        asyncio.run(post_router.get_trending_posts(db=db, current_user=BENCH_USER, limit=args.limit))
+        db.rollback()
+
+    def aggregated():
+        aggregate_trending(db, args.limit, ranking.half_life_seconds)
+        db.rollback()
+
+    # Both rank the same posts
+    assert [post["Post"]["id"] for post in aggregate_trending(db, args.limit, ranking.half_life_seconds)] == \
+        [str(post_id) for post_id in ranking.top(args.limit)]
+    db.rollback()
+
+    scored_posts = len(ranking)
+    now = datetime.now(timezone.utc)
+    like_times = [now - timedelta(seconds=i) for i in range(100000)]
+    start = time.perf_counter()
+    for i, at in enumerate(like_times):
+        ranking.add(1 + i % args.posts, at)
+    add_us = (time.perf_counter() - start) / len(like_times) * 1e6
+
+    total_likes, window_likes = db.execute(text(
+        "SELECT count(*), count(*) FILTER (WHERE created >= now() - :hours * interval '1 hour') FROM likes"),
+        {"hours": settings.trending_window_hours}).one()
+    print(f"{total_likes} likes, {window_likes} in the {settings.trending_window_hours:g} h window, "
+          f"{scored_posts} posts scored")
+    print(f"{'aggregate per request ms':>26} {median_ms(aggregated, args.repeat):>9.2f}")
+    print(f"{'ranking per request ms':>26} {median_ms(ranked, args.repeat):>9.2f}")
+    print(f"{'reconcile ms':>26} {reconcile_ms:>9.2f}")
+    print(f"{'ranking update per like us':>26} {add_us:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
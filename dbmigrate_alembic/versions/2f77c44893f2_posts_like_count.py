@@ -0,0 +1,28 @@
+"""posts like count
+
+Revision ID: 2f77c44893f2
+Revises: f34557a4e30d
+Create Date: 2026-10-18 11:02:47.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f77c44893f2'
+down_revision = 'f34557a4e30d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+    # Backfill the counter for the existing posts
+    op.execute('UPDATE posts SET like_count = counts.likes '
+               'FROM (SELECT post_id, COUNT(*) AS likes FROM likes GROUP BY post_id) AS counts '
+               'WHERE posts.id = counts.post_id')
+
+
+def downgrade() -> None:
+    op.drop_column('posts', 'like_count')
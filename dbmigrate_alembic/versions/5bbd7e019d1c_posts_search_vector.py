@@ -0,0 +1,31 @@
+"""posts search vector
+
+Revision ID: 5bbd7e019d1c
+Revises: 2f77c44893f2
+Create Date: 2026-10-18 12:15:33.671120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5bbd7e019d1c'
+down_revision = '2f77c44893f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Generated column, postgres computes it for the existing rows and on every insert/update.
+    # Adding it rewrites the posts table.
+    op.add_column('posts', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(
+        "setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', content), 'B')",
+        persisted=True), nullable=True))
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_search_vector', table_name='posts', postgresql_using='gin')
+    op.drop_column('posts', 'search_vector')
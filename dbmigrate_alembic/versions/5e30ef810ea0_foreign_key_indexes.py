@@ -0,0 +1,36 @@
+"""foreign key indexes
+
+Revision ID: 5e30ef810ea0
+Revises: 5bbd7e019d1c
+Create Date: 2026-10-18 14:05:41.207519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e30ef810ea0'
+down_revision = '5bbd7e019d1c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY doesn't block writes but cannot run inside a transaction.
+    # If it fails it leaves an INVALID index behind, drop it and run the upgrade again.
+    with op.get_context().autocommit_block():
+        # Posts of a user, and the ON DELETE CASCADE from users
+        op.create_index('ix_posts_user_id', 'posts', ['user_id'], unique=False,
+                        postgresql_concurrently=True)
+        # Likes of a post, and the ON DELETE CASCADE from posts. The primary key (user_id, post_id)
+        # only serves lookups by user.
+        op.create_index('ix_likes_post_id_user_id', 'likes', ['post_id', 'user_id'], unique=False,
+                        postgresql_concurrently=True)
+    # posts.created is already covered by ix_posts_created_id (f34557a4e30d)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_likes_post_id_user_id', table_name='likes', postgresql_concurrently=True)
+        op.drop_index('ix_posts_user_id', table_name='posts', postgresql_concurrently=True)
@@ -0,0 +1,83 @@
+"""post ids and posts future partition
+
+Revision ID: 7d3e5a9b2c41
+Revises: c61f08d2b7e4
+Create Date: 2026-10-19 09:26:44.172305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3e5a9b2c41'
+down_revision = 'c61f08d2b7e4'
+branch_labels = None
+depends_on = None
+
+# As in app/persistence/partitions.py when this revision was written
+POST_IDS_TRIGGERS = (
+    '''
+    CREATE OR REPLACE FUNCTION posts_post_ids() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' THEN
+            IF OLD.id <> NEW.id THEN
+                RAISE EXCEPTION 'posts.id cannot change';
+            END IF;
+            UPDATE post_ids SET created = NEW.created WHERE id = NEW.id;
+            RETURN NEW;
+        ELSIF current_setting('app.moving_posts', true) = 'on' THEN
+            RETURN NULL;
+        ELSIF TG_OP = 'INSERT' THEN
+            -- Already there when an update of created moves the post to another month
+            INSERT INTO post_ids (id, created) SELECT NEW.id, NEW.created
+            WHERE NOT EXISTS (SELECT FROM post_ids WHERE id = NEW.id AND created = NEW.created);
+        ELSE
+            DELETE FROM post_ids WHERE id = OLD.id AND created = OLD.created;
+        END IF;
+        RETURN NULL;
+    END $$
+    ''',
+    "CREATE TRIGGER posts_post_ids AFTER INSERT OR DELETE ON posts FOR EACH ROW EXECUTE FUNCTION posts_post_ids()",
+    "CREATE TRIGGER posts_post_ids_update BEFORE UPDATE OF id, created ON posts FOR EACH ROW "
+    "WHEN (OLD.id <> NEW.id OR OLD.created <> NEW.created) EXECUTE FUNCTION posts_post_ids()",
+)
+
+# Validating the foreign key reads all of likes (NOT VALID is not supported on partitioned tables),
+# run it while the app is stopped.
+
+
+def upgrade() -> None:
+    # posts.id is not unique to postgres since c61f08d2b7e4 made (id, created) the primary key,
+    # post_ids makes it unique again and gives likes.post_id something to reference
+    op.create_table('post_ids',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('created', sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute("INSERT INTO post_ids (id, created) SELECT id, created FROM posts")
+    # Likes of posts deleted while likes had no foreign key
+    op.execute("DELETE FROM likes WHERE NOT EXISTS (SELECT 1 FROM post_ids WHERE post_ids.id = likes.post_id)")
+    op.create_foreign_key('likes_post_id_fkey', 'likes', 'post_ids', ['post_id'], ['id'], ondelete='CASCADE')
+    for statement in POST_IDS_TRIGGERS:
+        op.execute(statement)
+
+    # Posts after the last month go here instead of failing, see app/persistence/partitions.py
+    last = op.get_bind().execute(sa.text(
+        "SELECT max((regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamptz) "
+        "FROM pg_inherits JOIN pg_class c ON c.oid = inhrelid WHERE inhparent = 'posts'::regclass")).scalar()
+    op.execute(f"CREATE TABLE posts_future PARTITION OF posts FOR VALUES FROM ('{last.isoformat()}') TO (MAXVALUE)")
+    op.execute("ANALYZE post_ids")
+
+
+def downgrade() -> None:
+    # Its posts would be lost, create the partitions of their months first (python -m app.persistence.partitions)
+    op.execute("DO $$ BEGIN IF EXISTS (SELECT 1 FROM posts_future) THEN "
+               "RAISE EXCEPTION 'posts_future is not empty'; END IF; END $$")
+    op.drop_table('posts_future')
+
+    op.execute("DROP TRIGGER posts_post_ids_update ON posts")
+    op.execute("DROP TRIGGER posts_post_ids ON posts")
+    op.execute("DROP FUNCTION posts_post_ids()")
+    op.drop_constraint('likes_post_id_fkey', 'likes', type_='foreignkey')
+    op.drop_table('post_ids')
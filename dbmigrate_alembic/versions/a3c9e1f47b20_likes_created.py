@@ -0,0 +1,33 @@
+"""likes created
+
+Revision ID: a3c9e1f47b20
+Revises: de590ccd9402
+Create Date: 2026-10-18 17:04:31.218406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c9e1f47b20'
+down_revision = 'de590ccd9402'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The existing likes get the time of their post, the earliest they can have been made. With
+    # now() they would all count as just made and flood the trending ranking.
+    op.add_column('likes', sa.Column('created', sa.TIMESTAMP(timezone=True), nullable=True))
+    op.execute('UPDATE likes SET created = posts.created FROM posts WHERE posts.id = likes.post_id')
+    op.alter_column('likes', 'created', server_default=sa.text('now()'), nullable=False)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_likes_created', 'likes', ['created'], unique=False, postgresql_include=['post_id'],
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_likes_created', table_name='likes', postgresql_concurrently=True)
+    op.drop_column('likes', 'created')
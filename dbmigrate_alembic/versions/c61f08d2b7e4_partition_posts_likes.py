@@ -0,0 +1,147 @@
+"""partition posts and likes
+
+Revision ID: c61f08d2b7e4
+Revises: a3c9e1f47b20
+Create Date: 2026-10-18 21:42:07.315208
+
+"""
+from datetime import date, datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c61f08d2b7e4'
+down_revision = 'a3c9e1f47b20'
+branch_labels = None
+depends_on = None
+
+# As in app/persistence/partitions.py when this revision was written
+LIKES_PARTITIONS = 16
+AHEAD_MONTHS = 3
+
+# An existing table cannot be turned into a partitioned one: both tables are renamed, re-created
+# partitioned, copied over and dropped. This rewrites posts and likes under an exclusive lock and
+# builds their indexes afterwards (CREATE INDEX CONCURRENTLY is not supported on partitioned
+# tables), so run it while the app is stopped.
+
+
+def upgrade() -> None:
+    # With (id, created) as primary key posts.id is not unique to postgres and cannot be referenced.
+    # Until 7d3e5a9b2c41 points likes.post_id at post_ids, deleting a post leaves its likes behind.
+    op.drop_constraint('likes_post_id_fkey', 'likes', type_='foreignkey')
+
+    _rename_away('posts', 'posts_unpartitioned',
+                 ['ix_posts_created_id', 'ix_posts_search_vector', 'ix_posts_user_id_created_id'])
+    _create_posts(partitioned=True)
+    today = datetime.now(timezone.utc).date()
+    oldest = op.get_bind().execute(sa.text("SELECT min(created) FROM posts_unpartitioned")).scalar()
+    month = _month_start(oldest.astimezone(timezone.utc).date() if oldest else today)
+    # 7d3e5a9b2c41 adds posts_future after the last month
+    op.execute(f"CREATE TABLE posts_history PARTITION OF posts FOR VALUES FROM (MINVALUE) TO ('{month} 00:00:00+00')")
+    while month <= _month_start(today, AHEAD_MONTHS):
+        op.execute(f"CREATE TABLE posts_y{month.year}m{month.month:02d} PARTITION OF posts "
+                   f"FOR VALUES FROM ('{month} 00:00:00+00') TO ('{_month_start(month, 1)} 00:00:00+00')")
+        month = _month_start(month, 1)
+    _copy_posts('posts_unpartitioned')
+    op.drop_table('posts_unpartitioned')
+    _create_posts_indexes()
+
+    _rename_away('likes', 'likes_unpartitioned', ['ix_likes_post_id_user_id', 'ix_likes_created'])
+    _create_likes(partitioned=True)
+    for remainder in range(LIKES_PARTITIONS):
+        op.execute(f"CREATE TABLE likes_p{remainder} PARTITION OF likes "
+                   f"FOR VALUES WITH (MODULUS {LIKES_PARTITIONS}, REMAINDER {remainder})")
+    op.execute("INSERT INTO likes (user_id, post_id, created) SELECT user_id, post_id, created FROM likes_unpartitioned")
+    op.drop_table('likes_unpartitioned')
+    _create_likes_indexes()
+
+    op.execute("ANALYZE posts, likes")
+
+
+def downgrade() -> None:
+    _rename_away('likes', 'likes_partitioned', ['ix_likes_post_id_user_id', 'ix_likes_created'])
+    _create_likes(partitioned=False)
+    # Likes of deleted posts would violate the foreign key
+    op.execute("INSERT INTO likes (user_id, post_id, created) SELECT user_id, post_id, created FROM likes_partitioned "
+               "WHERE post_id IN (SELECT id FROM posts)")
+
+    _rename_away('posts', 'posts_partitioned',
+                 ['ix_posts_created_id', 'ix_posts_search_vector', 'ix_posts_user_id_created_id'])
+    _create_posts(partitioned=False)
+    _copy_posts('posts_partitioned')
+
+    op.drop_table('likes_partitioned')
+    op.create_foreign_key('likes_post_id_fkey', 'likes', 'posts', ['post_id'], ['id'], ondelete='CASCADE')
+    op.drop_table('posts_partitioned')
+    _create_posts_indexes()
+    _create_likes_indexes()
+
+    op.execute("ANALYZE posts, likes")
+
+
+def _month_start(day: date, months: int = 0) -> date:
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def _rename_away(table: str, new_name: str, indexes) -> None:
+    # Index names are unique per schema, the new table's primary key and indexes need them
+    op.rename_table(table, new_name)
+    op.execute(f"ALTER INDEX {table}_pkey RENAME TO {new_name}_pkey")
+    for index in indexes:
+        op.drop_index(index, table_name=new_name)
+    if table == 'posts':
+        # Keeps the sequence alive when the old table is dropped
+        op.execute("ALTER SEQUENCE posts_id_seq OWNED BY NONE")
+
+
+def _create_posts(partitioned: bool) -> None:
+    # The primary key of a partitioned table must include its partition key
+    op.create_table('posts',
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('posts_id_seq'::regclass)"), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('content', sa.String(), nullable=False),
+        sa.Column('published', sa.Boolean(), server_default='TRUE', nullable=False),
+        sa.Column('created', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('like_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(
+            "setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', content), 'B')",
+            persisted=True), nullable=True),
+        # Named, the old table still holds the default name
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='posts_user_id_fkey', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', 'created') if partitioned else sa.PrimaryKeyConstraint('id'),
+        **({'postgresql_partition_by': 'RANGE (created)'} if partitioned else {}),
+    )
+    op.execute("ALTER SEQUENCE posts_id_seq OWNED BY posts.id")
+
+
+def _copy_posts(source: str) -> None:
+    # search_vector is generated by the insert
+    op.execute("INSERT INTO posts (id, title, content, published, created, user_id, like_count) "
+               f"SELECT id, title, content, published, created, user_id, like_count FROM {source}")
+
+
+def _create_posts_indexes() -> None:
+    op.create_index('ix_posts_created_id', 'posts', ['created', 'id'], unique=False)
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_posts_user_id_created_id', 'posts', ['user_id', 'created', 'id'], unique=False)
+
+
+def _create_likes(partitioned: bool) -> None:
+    op.create_table('likes',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('created', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='likes_user_id_fkey', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'post_id'),
+        **({'postgresql_partition_by': 'HASH (post_id)'} if partitioned else {}),
+    )
+
+
+def _create_likes_indexes() -> None:
+    op.create_index('ix_likes_post_id_user_id', 'likes', ['post_id', 'user_id'], unique=False)
+    op.create_index('ix_likes_created', 'likes', ['created'], unique=False, postgresql_include=['post_id'])
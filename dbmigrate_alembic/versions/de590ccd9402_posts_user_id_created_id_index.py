@@ -0,0 +1,31 @@
+"""posts user_id created id index
+
+Revision ID: de590ccd9402
+Revises: 5e30ef810ea0
+Create Date: 2026-10-18 15:12:08.553901
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'de590ccd9402'
+down_revision = '5e30ef810ea0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # (user_id, created, id) serves GET /users/{id}/posts newest first with keyset pagination, and
+    # still everything ix_posts_user_id did, which is dropped once the wider index is in place
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_user_id_created_id', 'posts', ['user_id', 'created', 'id'], unique=False,
+                        postgresql_concurrently=True)
+        op.drop_index('ix_posts_user_id', table_name='posts', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_user_id', 'posts', ['user_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_posts_user_id_created_id', table_name='posts', postgresql_concurrently=True)
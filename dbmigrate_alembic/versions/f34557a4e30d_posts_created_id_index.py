@@ -0,0 +1,25 @@
+"""posts created id index
+
+Revision ID: f34557a4e30d
+Revises: 871e0d851685
+Create Date: 2026-10-18 10:40:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f34557a4e30d'
+down_revision = '871e0d851685'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Composite index backing the feed ordering and keyset (cursor) pagination
+    op.create_index('ix_posts_created_id', 'posts', ['created', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_created_id', table_name='posts')
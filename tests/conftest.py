@@ -0,0 +1,169 @@
+from contextlib import asynccontextmanager, contextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.main import app
+from app.configuration.config import settings
+from app.authentication import oauth2
+from app.persistence import db_models
+from app.persistence.database import get_db, Base
+from app.utils.rate_limit import rate_limit_backend
+from app.utils.like_events import like_events
+from app.utils.like_queue import known_posts, like_queue
+from app.utils.response_cache import posts_cache
+from app.utils.trending import trending_posts
+
+# Tests run against a separate '<database_name>_test' database on the same postgres server
+TEST_DATABASE_NAME = f'{settings.database_name}_test'
+SERVER_URL = f'postgresql://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}'
+SQLALCHEMY_DATABASE_URL = f'{SERVER_URL}/{TEST_DATABASE_NAME}'
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Every TestClient runs its own event loop, so asyncpg connections must not be pooled across tests
+async_engine = create_async_engine(f'postgresql+asyncpg://{SERVER_URL.split("://", 1)[1]}/{TEST_DATABASE_NAME}',
+                                   poolclass=NullPool)
+AsyncTestingSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autocommit=False, autoflush=False,
+                                        expire_on_commit=False)
+
+
+def create_database(name: str):
+    # CREATE DATABASE cannot run inside a transaction
+    admin_engine = create_engine(f'{SERVER_URL}/{settings.database_name}', isolation_level="AUTOCOMMIT")
+    with admin_engine.connect() as conn:
+        exists = conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": name}).scalar()
+        if not exists:
+            conn.execute(text(f'CREATE DATABASE "{name}"'))
+    admin_engine.dispose()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def test_database():
+    create_database(TEST_DATABASE_NAME)
+
+
+@pytest.fixture(autouse=True)
+def no_background_tasks(monkeypatch):
+    # The app's background tasks would use the app's database, not the test database
+    monkeypatch.setattr(settings, "trending_reconcile_seconds", 0)
+    monkeypatch.setattr(settings, "posts_partitions_check_hours", 0)
+
+
+@pytest.fixture
+def session(test_database):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@pytest.fixture(params=["sync", "async"])
+def client(session, request, monkeypatch):
+    # Every request gets its own session, like the real get_db (database_async off/on)
+    def override_get_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    @asynccontextmanager
+    async def open_test_session():
+        if request.param == "async":
+            async with AsyncTestingSessionLocal() as db:
+                yield db
+        else:
+            db = TestingSessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+    app.dependency_overrides[get_db] = override_get_async_db if request.param == "async" else override_get_db
+    # The write-behind like queue opens its own sessions
+    monkeypatch.setattr(like_queue, "open_session", open_test_session)
+    like_queue.clear()
+    known_posts.clear()
+    like_events.clear()
+    # Table ids restart with every test, don't serve users cached by a previous one
+    oauth2.user_cache.clear()
+    posts_cache.invalidate()
+    rate_limit_backend.clear()
+    trending_posts.clear()
+    with TestClient(app) as client:
+        yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def test_user(client):
+    user_data = {"email": "user1@example.com", "password": "password123"}
+    res = client.post("/users/", json=user_data)
+    assert res.status_code == 201
+
+    new_user = res.json()
+    new_user["password"] = user_data["password"]
+    return new_user
+
+
+@pytest.fixture
+def token(test_user):
+    return oauth2.create_access_token({"user_id": test_user["id"]})
+
+
+@pytest.fixture
+def authorized_client(client, token):
+    client.headers = {**client.headers, "Authorization": f"Bearer {token}"}
+    return client
+
+
+@pytest.fixture
+def test_posts(test_user, session):
+    posts = [db_models.Post(title=f"title {i}", content=f"content {i}", user_id=test_user["id"])
+             for i in range(5)]
+    session.add_all(posts)
+    session.commit()
+
+    return session.query(db_models.Post).order_by(db_models.Post.id).all()
+
+
+@pytest.fixture
+def count_queries():
+    '''
+    Context manager that records the SQL statements the app sends in its block, on both
+    the sync and the async test engine:
+
+        with count_queries() as statements:
+            client.get("/posts/")
+        assert len(statements) == 1
+    '''
+    @contextmanager
+    def count():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        targets = [engine, async_engine.sync_engine]
+        for target in targets:
+            event.listen(target, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            for target in targets:
+                event.remove(target, "before_cursor_execute", record)
+
+    return count
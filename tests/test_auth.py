@@ -0,0 +1,65 @@
+import threading
+from jose import jwt
+
+from app.authentication import auth_utils, oauth2
+from app.configuration.config import settings
+from app.persistence import db_models
+
+
+def test_login(client, test_user):
+    res = client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+    assert res.status_code == 200
+
+    payload = jwt.decode(res.json()["access_token"], settings.secret_key, algorithms=[settings.algorithm])
+    assert payload["user_id"] == int(test_user["id"])
+    assert payload["email"] == test_user["email"]
+
+
+def test_invalid_token(client):
+    res = client.get("/posts/", headers={"Authorization": "Bearer garbage"})
+    assert res.status_code == 401
+
+
+def test_deleted_user_is_not_served_from_cache(authorized_client, session, test_user):
+    assert authorized_client.get("/posts/").status_code == 200
+    assert oauth2.user_cache.get(int(test_user["id"])) is not None
+
+    session.delete(session.get(db_models.User, int(test_user["id"])))
+    session.commit()
+
+    assert authorized_client.get("/posts/").status_code == 401
+
+
+def test_stateless_auth_skips_user_lookup(client, session, test_user, monkeypatch):
+    monkeypatch.setattr(settings, "stateless_auth", True)
+    token = oauth2.create_access_token({"user_id": test_user["id"], "email": test_user["email"]})
+
+    # The user row is gone, but the token claims are trusted until the token expires
+    session.delete(session.get(db_models.User, int(test_user["id"])))
+    session.commit()
+
+    res = client.get("/posts/", headers={"Authorization": f"Bearer {token}"})
+    assert res.status_code == 200
+
+
+def test_login_rehashes_outdated_password(client, session, test_user):
+    user = session.get(db_models.User, int(test_user["id"]))
+    user.password = auth_utils.pwd_context.handler("bcrypt").using(rounds=4).hash(test_user["password"])
+    session.commit()
+
+    res = client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+    assert res.status_code == 200
+
+    session.refresh(user)
+    assert not auth_utils.pwd_context.needs_update(user.password)
+    assert auth_utils.pwd_context.verify(test_user["password"], user.password)
+
+
+def test_password_pool_saturated(client, test_user, monkeypatch):
+    # No free slot in the bcrypt pool or its queue
+    monkeypatch.setattr(auth_utils, "_slots", threading.BoundedSemaphore(1))
+    auth_utils._slots.acquire()
+
+    res = client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
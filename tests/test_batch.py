@@ -0,0 +1,53 @@
+from app.configuration.config import settings
+from app.persistence.like_counts import check_like_counts
+
+
+def test_create_posts_batch(authorized_client, test_user):
+    posts = [{"title": f"batch {i}", "content": f"content {i}"} for i in range(3)]
+
+    res = authorized_client.post("/posts/batch", json=posts)
+
+    assert res.status_code == 201
+    assert [post["title"] for post in res.json()] == ["batch 0", "batch 1", "batch 2"]
+    assert {post["owner"]["email"] for post in res.json()} == {test_user["email"]}
+    assert len(authorized_client.get("/posts/").json()) == 3
+
+
+def test_create_posts_batch_too_large(authorized_client, monkeypatch):
+    monkeypatch.setattr(settings, "batch_max_size", 2)
+    posts = [{"title": "title", "content": "content"}] * 3
+
+    assert authorized_client.post("/posts/batch", json=posts).status_code == 413
+    assert authorized_client.get("/posts/").json() == []
+
+
+def test_like_batch(authorized_client, session, test_posts):
+    first, second, third = (post.id for post in test_posts[:3])
+    authorized_client.post("/like/", json={"post_id": second, "direction": 1})
+
+    res = authorized_client.post("/like/batch", json=[
+        {"post_id": first, "direction": 1},
+        {"post_id": second, "direction": 1},
+        {"post_id": 99999, "direction": 1},
+        {"post_id": third, "direction": 0},
+    ])
+
+    assert res.status_code == 200
+    assert [item["status"] for item in res.json()] == [201, 409, 404, 404]
+
+    res = authorized_client.post("/like/batch", json=[
+        {"post_id": first, "direction": 0},
+        {"post_id": second, "direction": 0},
+        {"post_id": third, "direction": 1},
+    ])
+    assert [item["status"] for item in res.json()] == [201, 201, 201]
+
+    likes = {post["Post"]["id"]: post["likes"] for post in authorized_client.get("/posts/").json()}
+    assert (likes[str(first)], likes[str(second)], likes[str(third)]) == (0, 0, 1)
+    assert check_like_counts(session) == []
+
+
+def test_like_batch_duplicate_post(authorized_client, test_posts):
+    res = authorized_client.post("/like/batch", json=[{"post_id": test_posts[0].id, "direction": 1},
+                                                      {"post_id": test_posts[0].id, "direction": 0}])
+    assert res.status_code == 422
@@ -0,0 +1,102 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.configuration.config import settings
+from app.main import app
+from app.persistence import database
+from app.persistence.database import get_db
+from .conftest import SQLALCHEMY_DATABASE_URL
+
+
+def test_pool_status(client):
+    res = client.get("/health/pool")
+
+    assert res.status_code == 200
+    assert {"size", "checked_out", "idle", "overflow", "waits", "wait_seconds_total",
+            "wait_seconds_max", "timeouts"} <= res.json()["primary"].keys()
+
+
+def test_pool_exhausted(session):
+    options = {**database.engine_options(), "pool_size": 1, "max_overflow": 0, "pool_timeout": 0.1}
+    small_engine = create_engine(SQLALCHEMY_DATABASE_URL, **options)
+
+    def override_get_db():
+        db = sessionmaker(bind=small_engine)()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        # Hold the only connection of the pool
+        with small_engine.connect():
+            res = TestClient(app).get("/users/1")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+    assert small_engine.pool.stats.timeouts == 1
+
+
+def test_run_returns_connection(session):
+    # With one connection, two requests' sessions can only take turns if run() gives it back
+    options = {**database.engine_options(), "pool_size": 1, "max_overflow": 0, "pool_timeout": 0.1}
+    small_engine = create_engine(SQLALCHEMY_DATABASE_URL, **options)
+    first, second = sessionmaker(bind=small_engine)(), sessionmaker(bind=small_engine)()
+
+    async def requests():
+        for db in (first, second, first):
+            assert await database.run(db, lambda db: db.execute(text("SELECT 1")).scalar()) == 1
+            assert small_engine.pool.checkedout() == 0
+
+    asyncio.run(requests())
+    small_engine.dispose()
+
+
+def test_cache_status(client):
+    res = client.get("/health/cache")
+
+    assert res.status_code == 200
+    assert {"size", "hits", "misses", "evictions", "not_modified"} <= res.json()["posts"].keys()
+
+
+def test_ready(client):
+    res = client.get("/health/ready")
+
+    assert res.status_code == 200
+    assert res.json() == {"status": "ready"}
+
+
+def test_not_ready(session):
+    # No postgres listens on port 1
+    unreachable = create_engine(SQLALCHEMY_DATABASE_URL.replace(f":{settings.database_port}/", ":1/"))
+
+    def override_get_db():
+        db = sessionmaker(bind=unreachable)()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        with TestClient(app) as client:
+            assert client.get("/").status_code == 200
+            res = client.get("/health/ready")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert res.status_code == 503
+
+
+def test_lifespan_creates_and_disposes_engines(session):
+    assert database.engine is None
+    with TestClient(app):
+        assert database.engine is not None
+        assert database.SessionLocal.kw["bind"] is database.engine
+    assert database.engine is None
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+
+from app.persistence import db_models, likes, partitions, posts
+
+
+@pytest.fixture
+def seeded(session):
+    # Enough rows for the planner to prefer indexes over sequential scans
+    session.execute(text("INSERT INTO users (id, email, password) "
+                         "SELECT g, 'user' || g || '@example.com', 'x' FROM generate_series(1, 200) g"))
+    session.execute(text("INSERT INTO posts (title, content, user_id, created) "
+                         "SELECT 'title ' || g, 'content ' || g, 1 + g % 200, now() - g * interval '1 second' "
+                         "FROM generate_series(1, 20000) g"))
+    session.execute(text("INSERT INTO likes (user_id, post_id, created) "
+                         "SELECT 1 + g % 200, 1 + g % 20000, now() - g * interval '1 minute' "
+                         "FROM generate_series(0, 19999) g"))
+    session.commit()
+    session.execute(text("ANALYZE"))
+    return session
+
+
+def plan_scans(session, statement):
+    '''
+    Returns the (node type, relation, index, partition, empty) of every scan in the plan of
+    'statement'. Scans of a partition and its indexes are reported as scans of the partitioned
+    table and its indexes, with the partition's name and whether it holds no rows.
+    '''
+    compiled = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"render_postcompile": True})
+    plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    # Partitions and partition indexes -> their parent
+    parents = dict(session.execute(text("SELECT inhrelid::regclass::text, inhparent::regclass::text "
+                                        "FROM pg_inherits")).all())
+    empty = set(session.execute(text("SELECT inhrelid::regclass::text FROM pg_inherits "
+                                     "JOIN pg_class ON pg_class.oid = inhrelid "
+                                     "WHERE relkind = 'r' AND reltuples = 0")).scalars())
+
+    scans, nodes = [], [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Scan" in node["Node Type"]:
+            relation, index = node.get("Relation Name"), node.get("Index Name")
+            scans.append((node["Node Type"], parents.get(relation, relation), parents.get(index, index), relation,
+                          relation in empty))
+        nodes.extend(node.get("Plans", []))
+    return scans
+
+
+def scanned_partitions(scans, table):
+    return {scan[3] for scan in scans if scan[1] == table and scan[3] != table}
+
+
+def assert_uses_index(scans, table, index):
+    # Small joined tables (users here) and empty partitions may still be read sequentially
+    assert not [scan for scan in scans if scan[0] == "Seq Scan" and scan[1] == table and not scan[4]], scans
+    assert any(scan[1] in (table, None) and scan[2] == index for scan in scans), scans
+
+
+def test_feed_uses_index(seeded):
+    feed = posts.newest_first(posts.query_post_likes(seeded, 1))
+    assert_uses_index(plan_scans(seeded, feed.limit(10).statement), "posts", "ix_posts_created_id")
+
+    # Keyset pagination, a page deep into the feed
+    page = posts.after_cursor(feed, datetime.now(timezone.utc) - timedelta(hours=1), 0)
+    assert_uses_index(plan_scans(seeded, page.limit(10).statement), "posts", "ix_posts_created_id")
+
+
+def test_posts_of_user_use_index(seeded):
+    statement = select(db_models.Post.id).where(db_models.Post.user_id == 7)
+    assert_uses_index(plan_scans(seeded, statement), "posts", "ix_posts_user_id_created_id")
+
+    # GET /users/{id}/posts, first and a following page
+    feed = posts.newest_first(posts.query_post_likes(seeded, 1).filter(db_models.Post.user_id == 7))
+    assert_uses_index(plan_scans(seeded, feed.limit(10).statement), "posts", "ix_posts_user_id_created_id")
+    page = posts.after_cursor(feed, datetime.now(timezone.utc) - timedelta(hours=1), 0)
+    assert_uses_index(plan_scans(seeded, page.limit(10).statement), "posts", "ix_posts_user_id_created_id")
+
+
+def test_likes_of_post_use_index(seeded):
+    statement = select(db_models.Like.user_id).where(db_models.Like.post_id == 42)
+    assert_uses_index(plan_scans(seeded, statement), "likes", "ix_likes_post_id_user_id")
+
+
+def test_trending_reconcile_uses_index(seeded):
+    # Likes of the last day, a fourteenth of the seeded ones. Each of the likes partitions holds
+    # few rows, with a larger part of them the planner reads them sequentially.
+    t0 = (datetime.now(timezone.utc) - timedelta(days=1)).timestamp()
+    statement = likes.decayed_like_scores_statement(t0, 6 * 3600)
+    assert_uses_index(plan_scans(seeded, statement), "likes", "ix_likes_created")
+
+
+def test_like_statements_use_indexes(seeded):
+    # One like by user 42 on post 42 exists, see the seed
+    for statement in (likes.add_like_statement(42, 42), likes.remove_like_statement(42, 42)):
+        scans = plan_scans(seeded, statement)
+        assert not [scan for scan in scans if scan[0] == "Seq Scan" and scan[1] in ("posts", "likes") and not scan[4]], scans
+
+
+def test_feed_prunes_partitions(seeded):
+    # Posts in the next three months, their partitions exist ahead of time
+    seeded.execute(text("INSERT INTO posts (title, content, user_id, created) "
+                        "SELECT 'later ' || g, 'content', 1, date_trunc('month', now()) + g * interval '1 month' "
+                        "+ interval '1 day' FROM generate_series(1, 3) g"))
+    seeded.commit()
+    seeded.execute(text("ANALYZE"))
+    today = datetime.now(timezone.utc).date()
+    this_month, next_month, month_after = (partitions.post_partition_name(partitions.month_start(today, months))
+                                           for months in (0, 1, 2))
+    feed = posts.newest_first(posts.query_post_likes(seeded, 1))
+
+    # A page skips the months after its cursor
+    page = posts.after_cursor(feed, datetime.now(timezone.utc), 0)
+    scanned = scanned_partitions(plan_scans(seeded, page.limit(10).statement), "posts")
+    assert this_month in scanned and next_month not in scanned
+
+    page = posts.after_cursor(feed, datetime.combine(partitions.month_start(today, 1), datetime.min.time(),
+                                                     timezone.utc) + timedelta(days=14), 0)
+    scanned = scanned_partitions(plan_scans(seeded, page.limit(10).statement), "posts")
+    assert next_month in scanned and month_after not in scanned
+
+    # An export since the start of next month skips the months before
+    statement = posts.select_posts_export(datetime.combine(partitions.month_start(today, 1), datetime.min.time(),
+                                                           timezone.utc))
+    scanned = scanned_partitions(plan_scans(seeded, statement), "posts")
+    assert next_month in scanned and this_month not in scanned and "posts_history" not in scanned
+
+
+def test_feed_reads_months_in_order(seeded):
+    # Ordered append: the first page reads the newest months until it has its posts, not the
+    # newest rows of every month (a merge append, which a DEFAULT partition would force)
+    feed = posts.newest_first(posts.query_post_likes(seeded, 1)).limit(10).statement
+    compiled = feed.compile(dialect=postgresql.dialect(), compile_kwargs={"render_postcompile": True})
+    plan = "\n".join(seeded.connection().exec_driver_sql(f"EXPLAIN {compiled}", compiled.params).scalars())
+    assert "Merge Append" not in plan and "Append" in plan
+
+
+def test_likes_of_post_prune_partitions(seeded):
+    statement = select(db_models.Like.user_id).where(db_models.Like.post_id == 42)
+    assert len(scanned_partitions(plan_scans(seeded, statement), "likes")) == 1
+
+    for statement in (likes.add_like_statement(42, 42), likes.remove_like_statement(42, 42)):
+        assert len(scanned_partitions(plan_scans(seeded, statement), "likes")) <= 1
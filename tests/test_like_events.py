@@ -0,0 +1,212 @@
+import asyncio
+import threading
+import time
+
+import orjson
+import pytest
+
+from app.configuration.config import settings
+from app.utils.like_events import LocalLikeBroker, event_stream, like_events
+from app.utils.like_queue import like_queue
+
+
+def stream_events(body: str, name: str):
+    # The data of the 'name' events of a text/event-stream body
+    return [{int(post_id): value for post_id, value in orjson.loads(event.split("data: ", 1)[1]).items()}
+            for event in body.split("\n\n") if event.startswith(f"event: {name}\n")]
+
+
+def stream_deltas(body: str):
+    # Sums the 'likes' events of a text/event-stream body
+    totals = {}
+    for event in body.split("\n\n"):
+        if event.startswith("event: likes\n"):
+            for post_id, delta in orjson.loads(event.split("data: ", 1)[1]).items():
+                totals[int(post_id)] = totals.get(int(post_id), 0) + delta
+    return {post_id: delta for post_id, delta in totals.items() if delta}
+
+
+def open_stream(client, post_ids, headers=None):
+    '''
+    Starts GET /like/stream in a thread, the TestClient only returns once the stream ended.
+    Returns the thread and the list the response is put into.
+    '''
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(
+        client.get("/like/stream", params={"post_ids": post_ids}, headers=headers)))
+    thread.start()
+    for _ in range(100):
+        if like_events.stats()["streams"]:
+            break
+        time.sleep(0.05)
+    return thread, responses
+
+
+def test_stream_likes(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "like_stream_max_seconds", 1)
+    first, second, other, liked = (post.id for post in test_posts[:4])
+    assert authorized_client.post("/like/", json={"post_id": liked, "direction": 1}).status_code == 201
+    thread, responses = open_stream(authorized_client, [first, second, liked, 10 ** 6])
+    assert like_events.stats()["streams"] == 1
+
+    assert authorized_client.post("/like/", json={"post_id": first, "direction": 1}).status_code == 201
+    assert authorized_client.post("/like/batch", json=[
+        {"post_id": second, "direction": 1}, {"post_id": other, "direction": 1}]).status_code == 200
+    assert authorized_client.post("/like/", json={"post_id": second, "direction": 0}).status_code == 201
+    # Changes nothing, publishes nothing
+    assert authorized_client.post("/like/", json={"post_id": first, "direction": 1}).status_code == 409
+    thread.join()
+
+    res = responses[0]
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/event-stream")
+    assert res.text.startswith("retry: 1000\n\n")
+    # The counts of the posts that exist, then their changes
+    assert stream_events(res.text, "counts") == [{first: 0, second: 0, liked: 1}]
+    # The like and unlike of 'second' may arrive in one event, then they cancel out
+    assert stream_deltas(res.text) == {first: 1}
+    assert like_events.stats()["streams"] == 0
+
+
+def test_stream_last_event_id(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "like_stream_max_seconds", 0.5)
+    first, second = test_posts[0].id, test_posts[1].id
+    assert authorized_client.post("/like/", json={"post_id": first, "direction": 1}).status_code == 201
+    thread, responses = open_stream(authorized_client, [first])
+    thread.join()
+    last_event_id = responses[0].text.split("id: ", 1)[1].split("\n", 1)[0]
+
+    # Missed while reconnecting
+    assert authorized_client.post("/like/", json={"post_id": second, "direction": 1}).status_code == 201
+    assert authorized_client.post("/like/", json={"post_id": first, "direction": 0}).status_code == 201
+    thread, responses = open_stream(authorized_client, [first], {"Last-Event-ID": last_event_id})
+    thread.join()
+    assert stream_events(responses[0].text, "counts") == []
+    assert stream_events(responses[0].text, "likes") == [{first: -1}]
+
+    # Unknown to the broker (another worker, a restart), the counts again
+    thread, responses = open_stream(authorized_client, [first], {"Last-Event-ID": "0-1"})
+    thread.join()
+    assert stream_events(responses[0].text, "counts") == [{first: 0}]
+
+
+@pytest.mark.parametrize("credentials", ["query", "cookie"])
+def test_stream_token_without_header(client, token, test_posts, monkeypatch, credentials):
+    # EventSource cannot set the Authorization header
+    monkeypatch.setattr(settings, "like_stream_max_seconds", 0.1)
+    params = {"post_ids": test_posts[0].id}
+    if credentials == "query":
+        params["access_token"] = token
+    else:
+        client.cookies.set("access_token", token)
+    res = client.get("/like/stream", params=params)
+    assert res.status_code == 200
+    assert stream_events(res.text, "counts") == [{test_posts[0].id: 0}]
+    assert client.get("/like/stream", params={"post_ids": 1, "access_token": "x"}).status_code == 401
+
+
+def test_stream_write_behind(authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "like_write_behind", True)
+    monkeypatch.setattr(like_queue, "flush_interval", 60)
+    subscription = like_events.subscribe([test_posts[0].id])
+
+    assert authorized_client.post("/like/", json={"post_id": test_posts[0].id, "direction": 1}).status_code == 202
+    # Published once written, not when queued
+    assert like_events.stats()["delivered"] == 0
+    authorized_client.portal.call(like_queue.flush)
+
+    assert authorized_client.portal.call(subscription.get, 1) == {test_posts[0].id: 1}
+
+
+@pytest.mark.parametrize("params, status_code", [
+    ({"post_ids": list(range(1, 102))}, 400),
+    ({}, 422),
+    ({"post_ids": "x"}, 422),
+])
+def test_stream_invalid(authorized_client, params, status_code):
+    assert authorized_client.get("/like/stream", params=params).status_code == status_code
+
+
+def test_stream_unauthorized(client):
+    assert client.get("/like/stream", params={"post_ids": 1}).status_code == 401
+
+
+def test_publish_to_followers():
+    async def main():
+        broker = LocalLikeBroker(queue_size=10, history=10)
+        one, both = broker.subscribe([1]), broker.subscribe([1, 2])
+        broker.publish({1: 1, 2: -1, 3: 1})
+        broker.publish({2: 1, 3: 1})
+        broker.publish({3: 1})
+        # Everything queued is summed, changes that cancel out are left out
+        assert await one.get(1) == {1: 1}
+        assert await both.get(1) == {1: 1}
+        with pytest.raises(asyncio.TimeoutError):
+            await one.get(0.01)
+        assert broker.stats() == {"streams": 2, "posts": 2, "published": 3, "delivered": 3, "dropped": 0,
+                                  "replayed": 0}
+
+        broker.unsubscribe(one)
+        broker.unsubscribe(both)
+        assert broker.stats()["streams"] == broker.stats()["posts"] == 0
+
+    asyncio.run(main())
+
+
+def test_slow_stream_dropped():
+    async def main():
+        broker = LocalLikeBroker(queue_size=2, history=10)
+        events = event_stream(broker, [1], keepalive_seconds=60, max_seconds=60)
+        assert await events.__anext__() == b"retry: 1000\n\n"
+        fast = broker.subscribe([1])
+
+        broker.publish({1: 1})
+        broker.publish({1: 1})
+        assert await fast.get(1) == {1: 2}
+        broker.publish({1: 1})
+        # The stream that did not keep up is dropped, the others go on
+        assert broker.stats() == {"streams": 1, "posts": 1, "published": 3, "delivered": 5, "dropped": 1,
+                                  "replayed": 0}
+        assert await fast.get(1) == {1: 1}
+
+        assert await events.__anext__() == b"event: dropped\ndata: {}\n\n"
+        with pytest.raises(StopAsyncIteration):
+            await events.__anext__()
+        assert broker.stats()["streams"] == 1
+
+    asyncio.run(main())
+
+
+def test_stream_keepalive_and_end():
+    async def main():
+        broker = LocalLikeBroker(queue_size=10, history=10)
+        events = [event async for event in event_stream(broker, [1], keepalive_seconds=0.01, max_seconds=0.05)]
+        assert events[0] == b"retry: 1000\n\n"
+        assert set(events[1:]) == {b": keepalive\n\n"}
+        assert broker.stats()["streams"] == 0
+
+    asyncio.run(main())
+
+
+def test_replay_since_last_event_id():
+    async def main():
+        broker = LocalLikeBroker(queue_size=10, history=2)
+        start = broker.event_id()
+        broker.publish({1: 1, 2: 1})
+        after_first = broker.event_id()
+        broker.publish({1: 1})
+
+        # The changes of the followed posts since the id are queued first
+        replayed = broker.subscribe([1], start)
+        assert replayed.replayed
+        assert await replayed.get(1) == {1: 2}
+        assert broker.subscribe([2], after_first).replayed
+        assert broker.stats()["replayed"] == 2
+
+        # Publishes no longer kept, or ids of another broker
+        broker.publish({1: 1})
+        assert not broker.subscribe([1], start).replayed
+        assert not broker.subscribe([1], "x-1").replayed
+        assert not broker.subscribe([1], "nonsense").replayed
+
+    asyncio.run(main())
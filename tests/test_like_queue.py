@@ -0,0 +1,163 @@
+import time
+
+import pytest
+
+from app.configuration.config import settings
+from app.persistence import db_models
+from app.utils.like_queue import like_queue
+from app.utils.trending import trending_posts
+
+
+@pytest.fixture
+def write_behind(monkeypatch):
+    monkeypatch.setattr(settings, "like_write_behind", True)
+    # Only explicit flushes write
+    monkeypatch.setattr(like_queue, "flush_interval", 60)
+
+
+def like(client, post_id, direction=1):
+    return client.post("/like/", json={"post_id": post_id, "direction": direction})
+
+
+def test_write_behind_like(write_behind, authorized_client, session, test_posts):
+    first, second = test_posts[0].id, test_posts[1].id
+    assert like(authorized_client, first).status_code == 202
+    # Liked twice, only one like is written
+    assert like(authorized_client, first).status_code == 202
+    # Liked and unliked before the flush, nothing is written
+    assert like(authorized_client, second).status_code == 202
+    assert like(authorized_client, second, direction=0).status_code == 202
+    assert like(authorized_client, 99999).status_code == 404
+    assert session.query(db_models.Like).count() == 0
+
+    authorized_client.portal.call(like_queue.flush)
+
+    session.expire_all()
+    assert [(like.post_id, like.user_id) for like in session.query(db_models.Like)] == [(first, test_posts[0].user_id)]
+    assert session.get(db_models.Post, first).like_count == 1
+    assert session.get(db_models.Post, second).like_count == 0
+    assert trending_posts.top(10) == [first]
+    assert authorized_client.get("/health/likes").json() == {
+        "pending": 0, "queued": 4, "rejected": 0, "written": 2, "retried": 0, "dropped": 0, "flushes": 1}
+
+    # Unliking is written the same way
+    assert like(authorized_client, first, direction=0).status_code == 202
+    authorized_client.portal.call(like_queue.flush)
+    session.expire_all()
+    assert session.query(db_models.Like).count() == 0
+    assert session.get(db_models.Post, first).like_count == 0
+    assert trending_posts.top(10) == []
+
+
+def test_queue_full(write_behind, authorized_client, test_posts, monkeypatch):
+    monkeypatch.setattr(like_queue, "maxsize", 1)
+    assert like(authorized_client, test_posts[0].id).status_code == 202
+
+    res = like(authorized_client, test_posts[1].id)
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "1"
+    # A change of a pending like takes no room
+    assert like(authorized_client, test_posts[0].id, direction=0).status_code == 202
+
+    authorized_client.portal.call(like_queue.flush)
+    assert like(authorized_client, test_posts[1].id).status_code == 202
+
+
+def test_flush_on_shutdown(write_behind, authorized_client, session, test_posts):
+    for post in test_posts:
+        assert like(authorized_client, post.id).status_code == 202
+
+    # What the app's lifespan runs on shutdown
+    authorized_client.portal.call(like_queue.stop)
+
+    assert session.query(db_models.Like).count() == len(test_posts)
+
+
+def test_flush_in_batches(write_behind, authorized_client, session, test_posts, monkeypatch):
+    for post in test_posts:
+        assert like(authorized_client, post.id).status_code == 202
+
+    # Set after queueing, so the flush task does not start a flush on its own
+    monkeypatch.setattr(like_queue, "flush_size", 2)
+    authorized_client.portal.call(like_queue.flush)
+
+    assert session.query(db_models.Like).count() == len(test_posts)
+    assert like_queue.stats()["flushes"] == 3
+
+
+def test_queued_like_needs_no_query(write_behind, authorized_client, test_posts, count_queries):
+    # The first like of a post checks that it exists
+    like(authorized_client, test_posts[0].id)
+
+    with count_queries() as statements:
+        assert like(authorized_client, test_posts[0].id, direction=0).status_code == 202
+
+    assert statements == []
+
+
+def test_failed_flush_is_retried(write_behind, authorized_client, session, test_posts, monkeypatch):
+    first, second = test_posts[0].id, test_posts[1].id
+    assert like(authorized_client, first).status_code == 202
+    assert like(authorized_client, second).status_code == 202
+    # The flush task already waits for the old interval
+    monkeypatch.setattr(like_queue, "flush_interval", 1)
+    open_session = like_queue.open_session
+
+    def broken_session():
+        raise OSError("database down")
+
+    monkeypatch.setattr(like_queue, "open_session", broken_session)
+    assert authorized_client.portal.call(like_queue.flush) is False
+    # Queued again, in front of the likes queued since, the retry waits longer
+    assert like(authorized_client, test_posts[2].id).status_code == 202
+    assert like_queue.stats()["pending"] == 3
+    assert like_queue.retry_delay() == 2 * like_queue.flush_interval
+
+    monkeypatch.setattr(like_queue, "open_session", open_session)
+    assert authorized_client.portal.call(like_queue.flush) is True
+    assert like_queue.retry_delay() == like_queue.flush_interval
+    assert session.query(db_models.Like).count() == 3
+    assert like_queue.stats()["retried"] == 2
+    assert like_queue.stats()["dropped"] == 0
+
+
+def test_failed_flush_dropped(write_behind, authorized_client, session, test_posts, monkeypatch):
+    monkeypatch.setattr(like_queue, "retries", 2)
+    assert like(authorized_client, test_posts[0].id).status_code == 202
+
+    def broken_session():
+        raise OSError("database down")
+
+    monkeypatch.setattr(like_queue, "open_session", broken_session)
+    authorized_client.portal.call(like_queue.flush)
+    assert like_queue.stats()["pending"] == 1
+    authorized_client.portal.call(like_queue.flush)
+
+    assert like_queue.stats() == {
+        "pending": 0, "queued": 1, "rejected": 0, "written": 0, "retried": 1, "dropped": 1, "flushes": 0}
+    assert "like_queue_dropped_total 1" in authorized_client.get("/metrics").text
+
+
+def test_flush_task_survives_errors(write_behind, authorized_client, session, test_posts, monkeypatch):
+    add = trending_posts.add
+    calls = []
+
+    def broken_add(*args, **kwargs):
+        # Raises after the first batch was written
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("broken")
+        add(*args, **kwargs)
+
+    monkeypatch.setattr(trending_posts, "add", broken_add)
+    # Every like wakes the flush task up
+    monkeypatch.setattr(like_queue, "flush_size", 1)
+    for written, post in enumerate(test_posts[:2], 1):
+        assert like(authorized_client, post.id).status_code == 202
+        for _ in range(100):
+            if len(calls) == written:
+                break
+            time.sleep(0.05)
+
+    assert session.query(db_models.Like).count() == 2
+    assert trending_posts.top(10) == [test_posts[1].id]
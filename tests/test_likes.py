@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.authentication import oauth2
+from app.persistence import db_models
+from app.persistence.like_counts import check_like_counts, repair_like_counts
+
+
+def test_like_updates_like_count(authorized_client, test_posts):
+    post_id = test_posts[0].id
+
+    res = authorized_client.post("/like/", json={"post_id": post_id, "direction": 1})
+    assert res.status_code == 201
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+
+    res = authorized_client.post("/like/", json={"post_id": post_id, "direction": 0})
+    assert res.status_code == 201
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 0
+
+
+def test_like_twice_conflict(authorized_client, test_posts):
+    post_id = test_posts[0].id
+    authorized_client.post("/like/", json={"post_id": post_id, "direction": 1})
+
+    res = authorized_client.post("/like/", json={"post_id": post_id, "direction": 1})
+    assert res.status_code == 409
+
+
+def test_like_missing_post(authorized_client, test_posts):
+    res = authorized_client.post("/like/", json={"post_id": 99999, "direction": 1})
+    assert res.status_code == 404
+
+
+def test_like_post_id_out_of_range(authorized_client, test_posts):
+    # Above int4, asyncpg would refuse to bind it
+    res = authorized_client.post("/like/", json={"post_id": 1000000000000, "direction": 1})
+    assert res.status_code == 422
+    res = authorized_client.post("/like/batch", json=[{"post_id": 1000000000000, "direction": 1}])
+    assert res.status_code == 422
+
+
+def test_unlike_not_liked(authorized_client, test_posts):
+    res = authorized_client.post("/like/", json={"post_id": test_posts[0].id, "direction": 0})
+    assert res.status_code == 404
+
+
+def test_repair_like_counts(session, test_user, test_posts):
+    # A like inserted behind the API's back leaves the counter stale
+    session.add(db_models.Like(user_id=test_user["id"], post_id=test_posts[0].id))
+    session.commit()
+    assert check_like_counts(session) == [(test_posts[0].id, 0, 1)]
+
+    assert repair_like_counts(session) == 1
+    assert check_like_counts(session) == []
+
+
+def test_delete_post_deletes_likes(authorized_client, session, test_posts):
+    for post in test_posts[:2]:
+        authorized_client.post("/like/", json={"post_id": post.id, "direction": 1})
+
+    assert authorized_client.delete(f"/posts/{test_posts[0].id}").status_code == 204
+
+    assert [like.post_id for like in session.query(db_models.Like)] == [test_posts[1].id]
+    assert session.get(db_models.PostId, test_posts[0].id) is None
+
+
+def test_delete_user_deletes_likes_of_their_posts(session, test_user, test_posts):
+    liker = db_models.User(email="liker@example.com", password="x")
+    session.add(liker)
+    session.commit()
+    other_post = db_models.Post(title="t", content="c", user_id=liker.id)
+    session.add(other_post)
+    session.add_all([db_models.Like(user_id=liker.id, post_id=post.id) for post in test_posts])
+    session.commit()
+
+    # Deletes their posts through the ON DELETE CASCADE of posts.user_id, not through the API
+    session.query(db_models.User).filter(db_models.User.id == test_user["id"]).delete()
+    session.commit()
+
+    assert session.query(db_models.Like).count() == 0
+    assert [post_id.id for post_id in session.query(db_models.PostId)] == [other_post.id]
+
+
+def test_parallel_likes_same_user(authorized_client, test_posts):
+    post_id = test_posts[0].id
+
+    # Every request races to insert the same (user_id, post_id) row
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        statuses = list(pool.map(
+            lambda _: authorized_client.post("/like/", json={"post_id": post_id, "direction": 1}).status_code,
+            range(50)))
+
+    assert statuses.count(201) == 1
+    assert statuses.count(409) == 49
+    assert authorized_client.get(f"/posts/{post_id}").json()["likes"] == 1
+
+
+def test_parallel_likes_many_users(client, session, test_user, test_posts):
+    post_id = test_posts[0].id
+    users = [db_models.User(email=f"liker{i}@example.com", password="x") for i in range(50)]
+    session.add_all(users)
+    session.commit()
+    tokens = [oauth2.create_access_token({"user_id": user.id}) for user in users]
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        statuses = list(pool.map(
+            lambda token: client.post("/like/", json={"post_id": post_id, "direction": 1},
+                                      headers={"Authorization": f"Bearer {token}"}).status_code,
+            tokens))
+
+    assert statuses == [201] * 50
+    session.refresh(test_posts[0])
+    assert test_posts[0].like_count == 50
+    assert check_like_counts(session) == []
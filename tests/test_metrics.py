@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+from sqlalchemy import exc, text
+
+from app.configuration.config import settings
+from app.utils.metrics import metrics
+
+
+def sample(text: str, name: str, labels: str) -> float:
+    prefix = f"{name}{{{labels}}} "
+    return float(next(line[len(prefix):] for line in text.splitlines() if line.startswith(prefix)))
+
+
+def test_metrics(authorized_client, test_posts):
+    metrics.clear()
+    authorized_client.get(f"/posts/{test_posts[0].id}")
+    authorized_client.get(f"/posts/{test_posts[1].id}")
+    authorized_client.get("/posts/99999")
+
+    res = authorized_client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    labels = 'method="GET",route="/posts/{id}"'
+    assert sample(res.text, "http_requests_total", labels + ',status="200"') == 2
+    assert sample(res.text, "http_requests_total", labels + ',status="404"') == 1
+    assert sample(res.text, "http_request_duration_seconds_count", labels) == 3
+    assert sample(res.text, "http_request_duration_seconds_bucket", labels + ',le="+Inf"') == 3
+    # One SELECT per request, the user comes from the cache after the first one
+    assert 3 <= sample(res.text, "db_statements_total", labels) <= 4
+    assert sample(res.text, "db_seconds_total", labels) > 0
+
+
+def test_slow_query_log(authorized_client, test_posts, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "slow_query_ms", 0.0001)
+
+    with caplog.at_level(logging.WARNING, logger="app.utils.metrics"):
+        authorized_client.get(f"/posts/{test_posts[0].id}")
+
+    slow = [record.message for record in caplog.records if "slow query" in record.message]
+    assert any("/posts/{id}" in message and "FROM posts" in message for message in slow)
+    # Parameters may be password hashes, they are only logged with slow_query_log_parameters
+    assert not any("parameters=" in message for message in slow)
+
+    monkeypatch.setattr(settings, "slow_query_log_parameters", True)
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="app.utils.metrics"):
+        authorized_client.get(f"/posts/{test_posts[0].id}")
+    assert any("parameters=" in record.message for record in caplog.records)
+
+
+def test_failed_statement_timing(session):
+    connection = session.connection()
+    with pytest.raises(exc.ProgrammingError):
+        connection.execute(text("SELECT * FROM no_such_table"))
+    session.rollback()
+
+    # Nothing left behind to be paired with the next statement's end
+    connection = session.connection()
+    assert "query_start" not in connection.info
+    connection.execute(text("SELECT 1"))
+    assert "query_start" not in connection.info
@@ -0,0 +1,94 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, InternalError
+
+from app.configuration.config import settings
+from app.persistence import partitions
+
+
+def partition_names(session, table):
+    return set(session.execute(text("SELECT inhrelid::regclass::text FROM pg_inherits "
+                                    f"WHERE inhparent = '{table}'::regclass")).scalars())
+
+
+def test_month_start():
+    assert partitions.month_start(date(2026, 10, 18)) == date(2026, 10, 1)
+    assert partitions.month_start(date(2026, 10, 18), 3) == date(2027, 1, 1)
+    assert partitions.month_start(date(2026, 1, 31), -1) == date(2025, 12, 1)
+    assert partitions.post_partition_name(date(2027, 1, 1)) == "posts_y2027m01"
+
+
+def test_create_all_creates_partitions(session):
+    today = datetime.now(timezone.utc).date()
+    months = {partitions.post_partition_name(partitions.month_start(today, months))
+              for months in range(settings.posts_partitions_ahead_months + 1)}
+
+    assert partition_names(session, "posts") == months | {"posts_history", "posts_future"}
+    assert len(partition_names(session, "likes")) == partitions.LIKES_PARTITIONS
+
+
+def months_ahead(months):
+    return partitions.month_start(datetime.now(timezone.utc).date(), settings.posts_partitions_ahead_months + months)
+
+
+def test_create_post_partitions(session):
+    created = partitions.create_post_partitions(session, months_ahead(2), months_ahead(3))
+    session.commit()
+
+    # Months have no gaps, the month after the last one comes too
+    assert created == [partitions.post_partition_name(months_ahead(months)) for months in (1, 2, 3)]
+    # Existing months are skipped
+    assert partitions.create_post_partitions(session, months_ahead(0), months_ahead(4)) \
+        == [partitions.post_partition_name(months_ahead(4))]
+    session.commit()
+
+    session.execute(text("INSERT INTO users (id, email, password) VALUES (1, 'a@example.com', 'x')"))
+    session.execute(text("INSERT INTO posts (title, content, user_id, created) "
+                         f"VALUES ('t', 'c', 1, '{months_ahead(4) - timedelta(days=1)} 23:30:00-01'), "
+                         "('t', 'c', 1, '2020-01-01'), ('t', 'c', 1, '2200-01-01')"))
+    # Months are in UTC, the first post is from the month after. Posts before the first month go to
+    # posts_history, posts after the last one to posts_future.
+    assert session.execute(text("SELECT tableoid::regclass::text FROM posts ORDER BY created DESC")).scalars().all() \
+        == ["posts_future", partitions.post_partition_name(months_ahead(4)), "posts_history"]
+
+
+def test_post_without_partition(session):
+    session.execute(text("INSERT INTO users (id, email, password) VALUES (1, 'a@example.com', 'x')"))
+    post_id = session.execute(text("INSERT INTO posts (title, content, user_id, created) "
+                                   f"VALUES ('t', 'c', 1, '{months_ahead(2)} 12:00:00+00') RETURNING id")).scalar()
+    session.execute(text(f"INSERT INTO likes (user_id, post_id) VALUES (1, {post_id})"))
+    session.commit()
+    assert session.execute(text("SELECT tableoid::regclass::text FROM posts")).scalar() == "posts_future"
+
+    # Moved into its month once that exists, keeping its likes
+    assert len(partitions.create_post_partitions(session, months_ahead(0), months_ahead(2))) == 2
+    session.commit()
+    assert session.execute(text("SELECT tableoid::regclass::text FROM posts")).scalar() \
+        == partitions.post_partition_name(months_ahead(2))
+    assert session.execute(text("SELECT post_id FROM likes")).scalar() == post_id
+    assert session.execute(text("SELECT count(*) FROM post_ids")).scalar() == 1
+    assert partitions._future_start(session) == months_ahead(3)
+
+
+def test_post_ids(session):
+    session.execute(text("INSERT INTO users (id, email, password) VALUES (1, 'a@example.com', 'x')"))
+    session.execute(text("INSERT INTO posts (id, title, content, user_id, created) VALUES (1, 't', 'c', 1, now())"))
+    session.commit()
+
+    # The primary key (id, created) would allow it, post_ids does not
+    with pytest.raises(IntegrityError, match="post_ids_pkey"):
+        session.execute(text("INSERT INTO posts (id, title, content, user_id, created) VALUES (1, 't', 'c', 1, '2020-01-01')"))
+    session.rollback()
+    with pytest.raises(InternalError, match="posts.id cannot change"):
+        session.execute(text("UPDATE posts SET id = 2 WHERE id = 1"))
+    session.rollback()
+
+    # Moving to another month keeps the post's likes
+    session.execute(text("INSERT INTO likes (user_id, post_id) VALUES (1, 1)"))
+    session.execute(text("UPDATE posts SET created = '2020-01-01', title = 'u' WHERE id = 1"))
+    session.commit()
+    assert session.execute(text("SELECT tableoid::regclass::text FROM posts")).scalar() == "posts_history"
+    assert session.execute(text("SELECT created::date::text FROM post_ids")).scalar() == "2020-01-01"
+    assert session.execute(text("SELECT count(*) FROM likes")).scalar() == 1
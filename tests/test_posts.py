@@ -0,0 +1,264 @@
+import json
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+
+from app.authentication import oauth2
+from app.configuration.config import settings
+from app.models import post_models
+from app.persistence import db_models, pagination
+from app.persistence.posts import POST_FIELDS
+from app.routers import post_router
+
+
+def test_cursor_roundtrip():
+    created = datetime(2023, 1, 14, 10, 53, 14, 530894, tzinfo=timezone.utc)
+    cursor = pagination.encode_cursor(created, 42)
+
+    assert pagination.decode_cursor(cursor) == (created, 42)
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "W10", "WzEsMl0"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor)
+
+
+def test_get_posts_cursor_pagination(authorized_client, test_posts):
+    seen = []
+    res = authorized_client.get("/posts/?limit=2")
+
+    while True:
+        assert res.status_code == 200
+        seen += [int(post["Post"]["id"]) for post in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        res = authorized_client.get(f"/posts/?limit=2&cursor={cursor}")
+
+    # newest first, every post exactly once
+    assert seen == sorted([post.id for post in test_posts], reverse=True)
+
+
+def test_get_posts_invalid_cursor(authorized_client, test_posts):
+    res = authorized_client.get("/posts/?cursor=garbage")
+    assert res.status_code == 400
+
+
+@pytest.mark.parametrize("method", ["GET", "PUT", "DELETE"])
+def test_post_id_out_of_range(authorized_client, test_posts, method):
+    # Above int4, asyncpg would refuse to bind it
+    res = authorized_client.request(method, "/posts/1000000000000", json={"title": "t", "content": "c"})
+    assert res.status_code == 422
+    assert authorized_client.get(f"/users/{10 ** 12}/posts").status_code == 422
+
+
+def test_cursor_id_out_of_range(authorized_client, test_posts):
+    cursor = pagination.encode_cursor(datetime.now(timezone.utc), 10 ** 20)
+    assert authorized_client.get("/posts/", params={"cursor": cursor}).status_code == 400
+    assert authorized_client.get(f"/users/{test_posts[0].user_id}/posts", params={"cursor": cursor}).status_code == 400
+
+
+@pytest.mark.parametrize("params", [{"limit": 0}, {"limit": -1}, {"limit": settings.max_page_size + 1},
+                                    {"skip": -1}])
+def test_get_posts_invalid_page(authorized_client, test_posts, params):
+    assert authorized_client.get("/posts/", params=params).status_code == 422
+
+
+def test_update_post(authorized_client, test_posts):
+    data = {"title": "updated title", "content": "updated content"}
+    res = authorized_client.put(f"/posts/{test_posts[0].id}", json=data)
+
+    assert res.status_code == 200
+    assert res.json()["title"] == "updated title"
+    assert res.json()["owner"]["id"] == str(test_posts[0].user_id)
+
+
+def test_search_posts(authorized_client, session, test_user):
+    session.add_all([
+        db_models.Post(title="Cooking pasta", content="Boil the water first", user_id=test_user["id"]),
+        db_models.Post(title="Weekend notes", content="We were cooking all day", user_id=test_user["id"]),
+        db_models.Post(title="Gardening", content="Tomatoes need water", user_id=test_user["id"]),
+    ])
+    session.commit()
+
+    # Matches title and content, stemmed (cooking -> cook)
+    res = authorized_client.get("/posts/?search=cook&order=relevance")
+    assert res.status_code == 200
+    # The title match ranks above the content match
+    assert [post["Post"]["title"] for post in res.json()] == ["Cooking pasta", "Weekend notes"]
+
+    res = authorized_client.get("/posts/?search=water -tomatoes")
+    assert [post["Post"]["title"] for post in res.json()] == ["Cooking pasta"]
+
+
+def test_search_relevance_with_cursor(authorized_client, test_posts):
+    res = authorized_client.get("/posts/?search=title&order=relevance&cursor=abc")
+    assert res.status_code == 400
+
+
+def pydantic_json(content) -> bytes:
+    # What FastAPI's response_model + JSONResponse produced before the orjson fast path
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def test_read_responses_match_pydantic(authorized_client, session, test_user):
+    session.add_all([
+        db_models.Post(title="naïve café ☕", content='"quoted" \\ back\nslash', user_id=test_user["id"],
+                       created=datetime(2023, 1, 1, tzinfo=timezone.utc), like_count=3),
+        db_models.Post(title="plain", content="text", published=False, user_id=test_user["id"]),
+    ])
+    session.commit()
+    rows = session.query(db_models.Post, db_models.Post.like_count.label("likes"))\
+                  .order_by(db_models.Post.created.desc(), db_models.Post.id.desc()).all()
+    expected = [post_models.PostLikesResponse.from_orm(row) for row in rows]
+
+    res = authorized_client.get("/posts/")
+    assert res.content == pydantic_json(expected)
+
+    for post in expected:
+        assert authorized_client.get(f"/posts/{post.Post.id}").content == pydantic_json(post)
+
+
+def test_liked_by_me(authorized_client, client, session, test_posts):
+    liked, other = test_posts[0].id, test_posts[1].id
+    authorized_client.post("/like/", json={"post_id": liked, "direction": 1})
+
+    feed = {post["Post"]["id"]: post for post in authorized_client.get("/posts/").json()}
+    assert feed[str(liked)]["liked_by_me"] is True
+    assert feed[str(liked)]["likes"] == 1
+    assert feed[str(other)]["liked_by_me"] is False
+    assert authorized_client.get(f"/posts/{liked}").json()["liked_by_me"] is True
+
+    # Another user sees the like count, but not as their own like
+    other_user = db_models.User(email="other@example.com", password="x")
+    session.add(other_user)
+    session.commit()
+    headers = {"Authorization": f"Bearer {oauth2.create_access_token({'user_id': other_user.id})}"}
+    res = client.get(f"/posts/{liked}", headers=headers)
+    assert res.status_code == 200
+    assert (res.json()["likes"], res.json()["liked_by_me"]) == (1, False)
+
+
+def test_get_user_posts(authorized_client, session, test_user, test_posts):
+    other_user = db_models.User(email="other@example.com", password="x")
+    session.add(other_user)
+    session.commit()
+    session.add(db_models.Post(title="not mine", content="content", user_id=other_user.id))
+    session.commit()
+
+    ids, cursor = [], None
+    while True:
+        res = authorized_client.get(f"/users/{test_user['id']}/posts",
+                                    params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert res.status_code == 200
+        ids += [int(post["Post"]["id"]) for post in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert ids == [post.id for post in reversed(test_posts)]
+    assert authorized_client.get(f"/users/{other_user.id}/posts").json()[0]["Post"]["title"] == "not mine"
+    assert authorized_client.get("/users/99999/posts").status_code == 404
+    assert authorized_client.get(f"/users/{test_user['id']}/posts", params={"cursor": "garbage"}).status_code == 400
+
+
+@pytest.mark.parametrize("limit", [0, -1, settings.max_page_size + 1])
+def test_get_user_posts_invalid_limit(authorized_client, test_posts, limit):
+    res = authorized_client.get(f"/users/{test_posts[0].user_id}/posts", params={"limit": limit})
+    assert res.status_code == 422
+
+
+def test_export_posts(authorized_client, session, test_posts, monkeypatch):
+    # Several round trips through the server-side cursor
+    monkeypatch.setattr(settings, "export_batch_size", 2)
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    for i, post in enumerate(test_posts):
+        post.created = start + timedelta(days=i)
+    session.commit()
+    session.add(db_models.Like(user_id=test_posts[0].user_id, post_id=test_posts[0].id))
+    session.query(db_models.Post).filter(db_models.Post.id == test_posts[0].id).update({"like_count": 1})
+    session.commit()
+
+    res = authorized_client.get("/posts/export", headers={"Accept-Encoding": "identity"})
+
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == "application/x-ndjson"
+    assert "Content-Encoding" not in res.headers
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert [int(line["Post"]["id"]) for line in lines] == [post.id for post in test_posts]
+    assert [line["likes"] for line in lines] == [1, 0, 0, 0, 0]
+    assert lines[0]["Post"]["owner"]["id"] == str(test_posts[0].user_id)
+
+    since = (start + timedelta(days=3)).isoformat()
+    res = authorized_client.get("/posts/export", params={"since": since}, headers={"Accept-Encoding": "gzip"})
+
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert [int(json.loads(line)["Post"]["id"]) for line in res.text.splitlines()] == [test_posts[3].id, test_posts[4].id]
+
+    res = authorized_client.get("/posts/export", params={"since": "2100-01-01T00:00:00Z"})
+    assert res.status_code == 200
+    assert res.text == ""
+
+
+@pytest.mark.parametrize("accept_encoding, gzip", [
+    ("gzip", True),
+    ("deflate, gzip;q=0.5", True),
+    ("GZIP; Q=1", True),
+    ("*", True),
+    ("gzip;q=0", False),
+    ("gzip;q=0.000, *", False),
+    ("identity, *;q=0", False),
+    ("br", False),
+    (None, False),
+])
+def test_accepts_gzip(accept_encoding, gzip):
+    assert post_router.accepts_gzip(accept_encoding) == gzip
+
+
+def test_export_posts_unauthorized(client):
+    assert client.get("/posts/export").status_code == 401
+
+
+def test_get_posts_fields(authorized_client, session, test_user):
+    session.add(db_models.Post(title="long", content="word " * 100, user_id=test_user["id"], like_count=2))
+    session.commit()
+
+    res = authorized_client.get("/posts/", params={"fields": "likes, excerpt,title,id", "excerpt_length": 12})
+
+    assert res.status_code == 200
+    post_id = session.query(db_models.Post.id).scalar()
+    # Keys in the order of the full response
+    assert res.content == json.dumps([{"Post": {"title": "long", "excerpt": "word word wo", "id": str(post_id)},
+                                       "likes": 2}], separators=(",", ":")).encode()
+
+    full = authorized_client.get("/posts/").json()[0]
+    # Every field but the excerpt is the full response
+    res = authorized_client.get("/posts/", params={"fields": ",".join(set(POST_FIELDS) - {"excerpt"})})
+    assert res.content == authorized_client.get("/posts/").content
+    res = authorized_client.get("/posts/", params={"fields": "owner,liked_by_me,excerpt"})
+    assert res.json() == [{"Post": {"excerpt": ("word " * 40)[:settings.post_excerpt_length], "owner": full["Post"]["owner"]},
+                           "liked_by_me": False}]
+
+
+def test_get_posts_fields_cursor_pagination(authorized_client, test_posts):
+    seen = []
+    params = {"limit": 2, "fields": "title"}
+    res = authorized_client.get("/posts/", params=params)
+
+    while True:
+        seen += [post["Post"]["title"] for post in res.json()]
+        cursor = res.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        res = authorized_client.get("/posts/", params={**params, "cursor": cursor})
+
+    assert seen == [post.title for post in sorted(test_posts, key=lambda post: post.id, reverse=True)]
+
+
+@pytest.mark.parametrize("params", [{"fields": "title,password"}, {"fields": ""}, {"fields": " , "},
+                                    {"fields": "excerpt", "excerpt_length": 0}])
+def test_get_posts_invalid_fields(authorized_client, test_posts, params):
+    assert authorized_client.get("/posts/", params=params).status_code == 400
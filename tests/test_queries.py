@@ -0,0 +1,131 @@
+import pytest
+
+from app.configuration.config import settings
+from app.persistence import db_models
+from app.utils.response_cache import posts_cache
+
+# Query budgets per endpoint, a lazy load per post (N+1) makes these grow with the page size
+
+
+@pytest.fixture
+def posts_of_many_owners(session, test_user):
+    users = [db_models.User(email=f"owner{i}@example.com", password="x") for i in range(5)]
+    session.add_all(users)
+    session.commit()
+    session.add_all([db_models.Post(title=f"title {i}", content=f"content {i}", user_id=user.id)
+                     for i, user in enumerate(users)])
+    session.commit()
+
+
+@pytest.fixture
+def warm_client(authorized_client, posts_of_many_owners):
+    # The first request of a token loads and caches its user, keep that out of the counts
+    assert authorized_client.get("/").status_code == 200
+    authorized_client.get("/posts/", params={"limit": 1})
+    posts_cache.invalidate()
+    return authorized_client
+
+
+def test_get_posts_queries(warm_client, count_queries):
+    with count_queries() as statements:
+        res = warm_client.get("/posts/")
+
+    assert len(res.json()) == 5
+    assert len({post["Post"]["owner"]["email"] for post in res.json()}) == 5
+    assert len(statements) == 1
+
+
+def test_get_posts_cached_queries(warm_client, count_queries):
+    warm_client.get("/posts/")
+
+    with count_queries() as statements:
+        assert len(warm_client.get("/posts/").json()) == 5
+        assert len(warm_client.get("/posts/", params={"fields": "title,likes"}).json()) == 5
+        assert len(warm_client.get("/posts/", params={"fields": "title,likes"}).json()) == 5
+
+    # The page is shared, only 'liked_by_me' is read per request. Without it a hit reads nothing
+    assert len(statements) == 2
+    assert "likes.user_id" in statements[0] and "posts" not in statements[0]
+
+
+def test_get_posts_fields_queries(warm_client, count_queries):
+    with count_queries() as statements:
+        res = warm_client.get("/posts/", params={"fields": "title,excerpt,likes"})
+
+    assert len(res.json()) == 5
+    # Only the asked for columns are read, the content only in part
+    assert len(statements) == 1
+    select_list = statements[0].split(" FROM ")[0]
+    assert "left(posts.content" in select_list and "posts.content AS" not in select_list
+    assert "users" not in statements[0] and "likes.user_id" not in statements[0]
+
+
+def test_get_post_queries(warm_client, count_queries):
+    post_id = warm_client.get("/posts/").json()[0]["Post"]["id"]
+
+    with count_queries() as statements:
+        res = warm_client.get(f"/posts/{post_id}")
+
+    assert res.status_code == 200
+    assert len(statements) == 1
+
+
+def test_export_posts_queries(warm_client, count_queries, monkeypatch):
+    monkeypatch.setattr(settings, "export_batch_size", 2)
+
+    with count_queries() as statements:
+        res = warm_client.get("/posts/export")
+
+    assert len(res.text.splitlines()) == 5
+    # One SELECT, the batches are fetched from its server-side cursor
+    assert len(statements) == 1
+
+
+def test_get_trending_posts_queries(warm_client, count_queries):
+    for post in warm_client.get("/posts/").json():
+        warm_client.post("/like/", json={"post_id": int(post["Post"]["id"]), "direction": 1})
+
+    with count_queries() as statements:
+        res = warm_client.get("/posts/trending")
+
+    assert len(res.json()) == 5
+    assert len(statements) == 1
+
+
+def test_create_post_queries(warm_client, count_queries):
+    with count_queries() as statements:
+        res = warm_client.post("/posts/", json={"title": "title", "content": "content"})
+
+    assert res.json()["owner"]["email"] == "user1@example.com"
+    # INSERT, reload with owner
+    assert len(statements) == 2
+
+
+def test_update_post_queries(warm_client, count_queries):
+    post_id = warm_client.post("/posts/", json={"title": "title", "content": "content"}).json()["id"]
+
+    with count_queries() as statements:
+        res = warm_client.put(f"/posts/{post_id}", json={"title": "edited", "content": "content"})
+
+    assert res.json()["owner"]["email"] == "user1@example.com"
+    # SELECT, UPDATE, reload with owner
+    assert len(statements) == 3
+
+
+def test_delete_post_queries(warm_client, count_queries):
+    post_id = warm_client.post("/posts/", json={"title": "title", "content": "content"}).json()["id"]
+
+    with count_queries() as statements:
+        assert warm_client.delete(f"/posts/{post_id}").status_code == 204
+
+    # SELECT and DELETE, its post_ids row and likes go with it (trigger and ON DELETE CASCADE)
+    assert len(statements) == 2
+
+
+def test_like_queries(warm_client, count_queries):
+    post_id = warm_client.get("/posts/").json()[0]["Post"]["id"]
+
+    with count_queries() as statements:
+        assert warm_client.post("/like/", json={"post_id": post_id, "direction": 1}).status_code == 201
+
+    assert len(statements) == 1
@@ -0,0 +1,79 @@
+from app.authentication import oauth2
+from app.configuration.config import settings
+from app.persistence import db_models
+from app.utils.rate_limit import Limit, LRURateLimitBackend, client_ip
+
+
+def test_token_bucket():
+    backend = LRURateLimitBackend(maxsize=10)
+    limit = Limit(per_minute=60, burst=2)
+
+    assert backend.take("a", limit) == 0
+    assert backend.take("a", limit) == 0
+    # Empty, the next token arrives within a second
+    assert 0 < backend.take("a", limit) <= 1
+    assert backend.take("b", limit) == 0
+
+
+def test_token_bucket_bounded():
+    backend = LRURateLimitBackend(maxsize=2)
+    for key in "abc":
+        backend.take(key, Limit(per_minute=60, burst=1))
+
+    assert len(backend) == 2
+    # 'a' was dropped and starts over with a full bucket
+    assert backend.take("a", Limit(per_minute=60, burst=1)) == 0
+
+
+def scope(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return {"type": "http", "client": (peer, 50000), "headers": headers}
+
+
+def test_client_ip_behind_proxy(monkeypatch):
+    # Not a trusted proxy, its X-Forwarded-For could be made up
+    assert client_ip(scope("203.0.113.7", "198.51.100.1")) == "203.0.113.7"
+
+    monkeypatch.setattr(settings, "trusted_proxies", ["10.0.0.0/8", "192.0.2.1"])
+    assert client_ip(scope("10.1.2.3", "198.51.100.1")) == "198.51.100.1"
+    # Through two proxies, the client prepended an address of its own
+    assert client_ip(scope("192.0.2.1", "1.2.3.4, 198.51.100.1, 10.1.2.3")) == "198.51.100.1"
+    assert client_ip(scope("10.1.2.3")) == "10.1.2.3"
+    assert client_ip(scope("10.1.2.3", "10.4.5.6")) == "10.1.2.3"
+
+
+def test_login_throttled(client, test_user, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_login_burst", 2)
+    credentials = {"username": test_user["email"], "password": "wrong"}
+
+    assert [client.post("/login", data=credentials).status_code for _ in range(3)] == [403, 403, 429]
+    res = client.post("/login", data={"username": test_user["email"], "password": test_user["password"]})
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) >= 1
+
+
+def test_writes_limited_per_user(authorized_client, session, test_posts, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_write_burst", 2)
+    post_id = test_posts[0].id
+    other_user = db_models.User(email="other@example.com", password="x")
+    session.add(other_user)
+    session.commit()
+    other_token = oauth2.create_access_token({"user_id": other_user.id})
+
+    statuses = [authorized_client.post("/like/", json={"post_id": post_id, "direction": direction}).status_code
+                for direction in (1, 0, 1)]
+    assert statuses == [201, 201, 429]
+
+    # Other users have their own bucket, and reads are a separate group
+    res = authorized_client.post("/like/", json={"post_id": post_id, "direction": 1},
+                                 headers={"Authorization": f"Bearer {other_token}"})
+    assert res.status_code == 201
+    assert authorized_client.get("/posts/").status_code == 200
+
+
+def test_rate_limit_disabled(client, test_user, monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_login_burst", 1)
+    monkeypatch.setattr(settings, "rate_limit_enabled", False)
+    credentials = {"username": test_user["email"], "password": "wrong"}
+
+    assert [client.post("/login", data=credentials).status_code for _ in range(3)] == [403, 403, 403]
@@ -0,0 +1,104 @@
+from app.authentication import oauth2
+from app.persistence import replicas
+from app.utils.response_cache import LRUCacheBackend, ResponseCache, posts_cache
+
+
+def get_feed(client, **headers):
+    # Writers read around the cache for a while, these tests look at what other users get
+    replicas.recent_writers.clear()
+    return client.get("/posts/", params={"limit": 3}, headers=headers)
+
+
+def test_feed_served_from_cache(authorized_client, test_posts):
+    first = get_feed(authorized_client)
+    hits = posts_cache.stats()["hits"]
+    second = get_feed(authorized_client)
+
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+    assert posts_cache.stats()["hits"] == hits + 1
+
+
+def test_feed_not_modified(authorized_client, test_posts):
+    etag = get_feed(authorized_client).headers["ETag"]
+
+    res = get_feed(authorized_client, **{"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+    assert res.headers["ETag"] == etag
+
+    assert get_feed(authorized_client, **{"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_feed_invalidated_by_writes(authorized_client, test_posts):
+    etag = get_feed(authorized_client).headers["ETag"]
+
+    res = authorized_client.post("/posts/", json={"title": "new title", "content": "new content"})
+    assert res.status_code == 201
+    res = get_feed(authorized_client, **{"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json()[0]["Post"]["title"] == "new title"
+
+    etag = res.headers["ETag"]
+    authorized_client.post("/like/", json={"post_id": res.json()[0]["Post"]["id"], "direction": 1})
+    res = get_feed(authorized_client, **{"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json()[0]["likes"] == 1
+
+    post_id = res.json()[0]["Post"]["id"]
+    authorized_client.put(f"/posts/{post_id}", json={"title": "edited", "content": "new content"})
+    assert get_feed(authorized_client).json()[0]["Post"]["title"] == "edited"
+
+    authorized_client.delete(f"/posts/{post_id}")
+    assert get_feed(authorized_client).json()[0]["Post"]["id"] != post_id
+
+
+def test_feed_shared_by_users(authorized_client, test_posts, session):
+    liked = test_posts[-1].id
+    assert authorized_client.post("/like/", json={"post_id": liked, "direction": 1}).status_code == 201
+    first = get_feed(authorized_client)
+    assert [post["liked_by_me"] for post in first.json()] == [True, False, False]
+
+    other = authorized_client.post("/users/", json={"email": "other@example.com", "password": "x"}).json()
+    token = oauth2.create_access_token({"user_id": other["id"]})
+    hits = posts_cache.stats()["hits"]
+    res = get_feed(authorized_client, Authorization=f"Bearer {token}")
+
+    # The same page, with the other user's 'liked_by_me' and ETag
+    assert posts_cache.stats()["hits"] == hits + 1
+    assert [post["liked_by_me"] for post in res.json()] == [False, False, False]
+    assert [post["likes"] for post in res.json()] == [1, 0, 0]
+    assert res.headers["ETag"] != first.headers["ETag"]
+    assert get_feed(authorized_client).content == first.content
+
+
+def test_like_invalidates_its_pages_only(authorized_client, test_posts):
+    first_page = get_feed(authorized_client)
+    second_page = authorized_client.get("/posts/", params={"limit": 3, "skip": 3})
+    liked = second_page.json()[0]["Post"]["id"]
+
+    assert authorized_client.post("/like/", json={"post_id": liked, "direction": 1}).status_code == 201
+    hits, stale = posts_cache.stats()["hits"], posts_cache.stats()["stale"]
+    assert get_feed(authorized_client).content == first_page.content
+    res = authorized_client.get("/posts/", params={"limit": 3, "skip": 3})
+
+    assert res.json()[0]["likes"] == 1 and res.json()[0]["liked_by_me"]
+    assert posts_cache.stats()["hits"] == hits + 2
+    assert posts_cache.stats()["stale"] == stale + 1
+
+
+def test_written_while_reading():
+    cache = ResponseCache(LRUCacheBackend(maxsize=10), written_posts=10)
+    since = cache.sequence
+    # Liked after the page was read, before it was stored
+    cache.invalidate_posts([2])
+    cache.set("page", [{"id": 1}, {"id": 2}], post_ids=[1, 2], since=since)
+    assert cache.get("page") is None
+
+    cache.set("page", [{"id": 1}, {"id": 2}], post_ids=[1, 2], since=cache.sequence)
+    cached = cache.get("page")
+    assert cached.body == b'[{"id":1},{"id":2}]'
+    assert cache.overlay(cached, "liked_by_me", [True, False]).body \
+        == b'[{"id":1,"liked_by_me":true},{"id":2,"liked_by_me":false}]'
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.configuration.config import settings
+from app.persistence import db_models
+from app.utils import trending
+from app.utils.trending import TrendingRanking
+
+HOUR = 3600
+NOW = datetime.now(timezone.utc)
+
+
+def new_ranking(size: int = 10) -> TrendingRanking:
+    ranking = TrendingRanking(size=size, half_life_seconds=6 * HOUR)
+    # The window starts a day before NOW
+    ranking.t0 = (NOW - timedelta(days=1)).timestamp()
+    return ranking
+
+
+def test_recent_likes_weigh_more():
+    ranking = new_ranking()
+    # Two likes two half lives ago are worth one like now
+    ranking.add(1, NOW - timedelta(hours=13))
+    ranking.add(1, NOW - timedelta(hours=13))
+    ranking.add(2, NOW)
+    ranking.add(3, NOW - timedelta(hours=1))
+
+    assert ranking.top(10) == [2, 3, 1]
+    assert ranking.top(2) == [2, 3]
+
+
+def test_top_keeps_size_posts():
+    ranking = new_ranking(size=2)
+    for post_id, likes in ((1, 1), (2, 2), (3, 3)):
+        for _ in range(likes):
+            ranking.add(post_id, NOW)
+
+    assert ranking.top(10) == [3, 2]
+    # Post 1 is still scored and moves in once it outranks post 2
+    ranking.add(1, NOW)
+    ranking.add(1, NOW)
+    assert ranking.top(10) == [3, 1]
+
+
+def test_unlike():
+    ranking = new_ranking()
+    ranking.add(1, NOW)
+    ranking.add(1, NOW)
+    ranking.add(2, NOW)
+
+    ranking.add(1, NOW, count=-1)
+    ranking.add(1, NOW, count=-1)
+
+    assert ranking.top(10) == [2]
+    assert len(ranking) == 1
+
+
+def test_changes_during_reconcile_are_kept():
+    ranking = TrendingRanking(size=10, half_life_seconds=6 * HOUR)
+    t0 = (NOW - timedelta(hours=1)).timestamp()
+    ranking.start_reconcile()
+    ranking.add(2, NOW)
+    ranking.add(2, NOW)
+    ranking.finish_reconcile({1: 1.5}, t0)
+
+    assert ranking.t0 == t0
+    assert ranking.top(10) == [2, 1]
+
+    # A failed reconcile keeps the scores
+    ranking.start_reconcile()
+    ranking.finish_reconcile(None, t0 + 10)
+    assert ranking.t0 == t0
+    assert ranking.top(10) == [2, 1]
+
+    # Post 1 was deleted after the reconcile read its likes
+    ranking.start_reconcile()
+    ranking.remove(1)
+    ranking.finish_reconcile({1: 1.5, 2: 3.0}, t0)
+    assert ranking.top(10) == [2]
+
+
+def test_clear_during_reconcile():
+    ranking = new_ranking()
+    ranking.start_reconcile()
+    ranking.add(2, NOW)
+    ranking.clear()
+
+    # The scores read before the clear and the changes queued for them are dropped
+    ranking.finish_reconcile({1: 1.5}, ranking.t0)
+    assert ranking.top(10) == []
+
+    ranking.add(3, datetime.now(timezone.utc))
+    assert ranking.top(10) == [3]
+
+
+def test_reconcile(session, test_posts):
+    user_id = test_posts[0].user_id
+    users = [db_models.User(email=f"liker{i}@example.com", password="x") for i in range(3)]
+    session.add_all(users)
+    session.commit()
+    # Post 0: three likes a day ago, post 1: two likes now, post 2: one like outside the window
+    window = timedelta(hours=settings.trending_window_hours)
+    session.add_all([db_models.Like(user_id=user.id, post_id=test_posts[0].id, created=NOW - timedelta(days=1))
+                     for user in users])
+    session.add_all([db_models.Like(user_id=user.id, post_id=test_posts[1].id, created=NOW) for user in users[:2]])
+    session.add(db_models.Like(user_id=user_id, post_id=test_posts[2].id, created=NOW - window - timedelta(hours=1)))
+    session.commit()
+
+    expected = [test_posts[1].id, test_posts[0].id]
+    ranking = TrendingRanking(size=10, half_life_seconds=6 * HOUR)
+    # database.run closes the session, detaching test_posts
+    asyncio.run(trending.reconcile(session, ranking))
+
+    assert ranking.top(10) == expected
+
+
+def test_get_trending_posts(authorized_client, test_posts):
+    for post in (test_posts[3], test_posts[0]):
+        assert authorized_client.post("/like/", json={"post_id": post.id, "direction": 1}).status_code == 201
+    assert authorized_client.post("/like/batch", json=[{"post_id": test_posts[2].id, "direction": 1}]).status_code == 200
+    # Liked and unliked again
+    authorized_client.post("/like/", json={"post_id": test_posts[4].id, "direction": 1})
+    authorized_client.post("/like/", json={"post_id": test_posts[4].id, "direction": 0})
+
+    res = authorized_client.get("/posts/trending")
+
+    assert res.status_code == 200
+    posts = res.json()
+    # Equal scores keep the order of the likes, the newest like weighs the most
+    assert {int(post["Post"]["id"]) for post in posts} == {test_posts[0].id, test_posts[2].id, test_posts[3].id}
+    assert [int(post["Post"]["id"]) for post in posts][0] == test_posts[2].id
+    assert all(post["likes"] == 1 and post["liked_by_me"] for post in posts)
+
+    assert authorized_client.delete(f"/posts/{test_posts[2].id}").status_code == 204
+    assert len(authorized_client.get("/posts/trending").json()) == 2
+    assert len(authorized_client.get("/posts/trending", params={"limit": 1}).json()) == 1
+    assert authorized_client.get("/posts/trending", params={"limit": 0}).status_code == 400
+    assert authorized_client.get("/posts/trending", params={"limit": settings.trending_size + 1}).status_code == 400
+
+
+def test_get_trending_posts_empty(authorized_client):
+    res = authorized_client.get("/posts/trending")
+
+    assert res.status_code == 200
+    assert res.json() == []